@@ -1,17 +1,35 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, g, flash, send_from_directory, session
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, g, flash, send_from_directory, session
+from flask.signals import before_render_template, template_rendered
+import click
 import sqlite3
 import os
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import json
-from werkzeug.utils import secure_filename
+import hashlib
+import secrets
+import gzip
+import csv
+import io
+import mimetypes
+from urllib.parse import quote
+from werkzeug.utils import secure_filename, safe_join
 from werkzeug.security import generate_password_hash, check_password_hash
 
-# Simple NLP stuff
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
+# Simple NLP stuff (scikit-learn itself is imported lazily by FaqIndex)
 import re
 import random
+import threading
+import queue
+import atexit
+import bisect
+import time
+import itertools
+import functools
+import shutil
+import subprocess
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
 
 import os
 
@@ -29,27 +47,394 @@ app.config['DEBUG'] = os.environ.get('FLASK_ENV') != 'production'
 def from_json_filter(value):
     return json.loads(value)
 
+# -----------------------
+# Static assets
+# -----------------------
+# url_for('static', ...) adds ?v=<content hash>, so those URLs can be cached
+# for a year; a changed file gets a new URL. `flask compress-static` writes
+# .gz copies that are served to clients accepting gzip.
+# Fingerprinted static files and uploaded videos never change under the same URL
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+PRECOMPRESSED_TYPES = ('.css', '.js', '.svg', '.json', '.txt')
+
+@functools.lru_cache(maxsize=256)
+def _static_fingerprint(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+def static_fingerprint(filename):
+    path = safe_join(app.static_folder, filename)
+    try:
+        st = os.stat(path)
+    except (TypeError, OSError):
+        return None
+    return _static_fingerprint(path, st.st_mtime_ns, st.st_size)
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        fingerprint = static_fingerprint(values['filename'])
+        if fingerprint:
+            values['v'] = fingerprint
+
+def _fresh_gzip(path):
+    """True if path has a .gz copy written after the file itself last changed."""
+    try:
+        return os.stat(path + '.gz').st_mtime_ns >= os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+
+def serve_static(filename):
+    fingerprinted = request.args.get('v') is not None
+    max_age = IMMUTABLE_MAX_AGE if fingerprinted else None
+    path = safe_join(app.static_folder, filename)
+    # A .gz older than its source is stale (edited since compress-static ran) and is ignored
+    if (filename.endswith(PRECOMPRESSED_TYPES) and 'gzip' in request.accept_encodings
+            and path and _fresh_gzip(path)):
+        response = send_from_directory(app.static_folder, filename + '.gz', max_age=max_age,
+                                       mimetype=mimetypes.guess_type(filename)[0],
+                                       download_name=os.path.basename(filename))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(app.static_folder, filename, max_age=max_age)
+    response.vary.add('Accept-Encoding')
+    if fingerprinted:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = serve_static
+
+@app.cli.command('compress-static')
+def compress_static_command():
+    """Write gzip copies of text assets under static/ for serve_static."""
+    written = 0
+    for root, _, files in os.walk(app.static_folder):
+        for name in files:
+            if not name.endswith(PRECOMPRESSED_TYPES):
+                continue
+            path = os.path.join(root, name)
+            if _fresh_gzip(path):
+                continue
+            with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb', compresslevel=9) as dst:
+                dst.write(src.read())
+            written += 1
+    click.echo(f"Compressed {written} static file(s).")
+
 # Upload configuration
 UPLOAD_FOLDER = 'uploads/videos'
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'wmv', 'flv', 'webm'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 
+# Resumable uploads stream their chunks into UPLOAD_PARTIAL_FOLDER and are moved into UPLOAD_FOLDER when finished
+UPLOAD_PARTIAL_FOLDER = os.path.join(UPLOAD_FOLDER, '.partial')
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024   # chunk size suggested to clients
+UPLOAD_CHUNK_MAX = 16 * 1024 * 1024   # largest chunk accepted in one request
+UPLOAD_BLOCK_SIZE = 64 * 1024         # bytes copied from the request stream at a time
+UPLOAD_EXPIRY = timedelta(days=1)     # unfinished uploads idle this long are discarded
+UPLOAD_CLAIM_TIMEOUT = timedelta(minutes=10)  # a chunk request still writing after this is presumed dead
+
+# Who sends video bytes: '' (the Python worker), 'x-accel' (nginx, via X-Accel-Redirect to
+# MEDIA_ACCEL_PREFIX) or 'x-sendfile' (Apache/lighttpd, which also takes over static files)
+MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD', '').lower()
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-videos/')
+app.config['USE_X_SENDFILE'] = MEDIA_OFFLOAD == 'x-sendfile'
+
 # Create upload directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(UPLOAD_PARTIAL_FOLDER, exist_ok=True)
+
+# Lessons per page on the teacher dashboard
+TEACHER_PAGE_SIZE = 20
+# Attempts per page on the results page
+ATTEMPTS_PAGE_SIZE = 50
+CHAT_PAGE_SIZE = 50
+# Topics scored below this percentage are recommended for review
+WEAK_TOPIC_PCT = 70
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def unique_upload_name(filename):
+    # Videos are served as immutable, so a name must never be reused for different bytes
+    return datetime.now().strftime('%Y%m%d_%H%M%S_') + secrets.token_hex(4) + '_' + filename
+
 # -----------------------
 # Database helpers
 # -----------------------
+# Idle connections kept per worker process (SQLite), or the maximum pool size
+# (PostgreSQL); 0 opens a fresh SQLite connection per request. The default
+# gives every gunicorn thread a connection plus one for each background thread
+# (message hub, score and submission flushes, FAQ rebuild), so requests never
+# queue for the pool.
+DB_BACKGROUND_THREADS = 4
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', int(os.environ.get('GUNICORN_THREADS', 16)) + DB_BACKGROUND_THREADS))
+
+# Applied once to every new connection. WAL lets readers run alongside the
+# single writer and busy_timeout makes writers wait instead of failing with
+# "database is locked".
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Advisory lock keys (PostgreSQL): migrations, and folding journaled math-game answers
+PG_SCHEMA_LOCK_ID = 5170001
+SCORE_FOLD_LOCK_ID = 5170002
+
+# psycopg prepares a statement server-side once it has run this many times on a connection
+PG_PREPARE_THRESHOLD = int(os.environ.get('PG_PREPARE_THRESHOLD', 2))
+
+class ConnectionPool:
+    """Per-process pool of SQLite connections reused across requests."""
+
+    def __init__(self, size, connect):
+        self.size = size
+        self.connect = connect
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections inherited through fork must not be shared with the parent
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return self.connect()
+
+    def release(self, db):
+        try:
+            if db.in_transaction:
+                db.rollback()
+        except sqlite3.Error:
+            db.close()
+            return
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(db)
+                return
+        db.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for db in idle:
+            db.close()
+
+class Database(ABC):
+    """Backend behind get_db/query_db/init_db.
+
+    Connections handed out by acquire() follow the sqlite3 API (execute with
+    qmark parameters, executemany, executescript, commit, rollback) and return
+    rows that can be indexed by position or column name.
+    """
+
+    dialect = None
+    Error = Exception
+
+    @abstractmethod
+    def acquire(self):
+        pass
+
+    @abstractmethod
+    def release(self, db):
+        pass
+
+    @contextmanager
+    def connection(self):
+        db = self.acquire()
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    @abstractmethod
+    def insert(self, db, query, args=()):
+        """Run an INSERT and return the id of the new row."""
+
+    def ddl(self, statement):
+        """Adapt a SQLite-syntax DDL statement to this backend."""
+        return statement
+
+    @abstractmethod
+    def lock_schema(self, db):
+        """Open a transaction holding an exclusive lock for schema changes."""
+
+    @abstractmethod
+    def lock(self, db, key):
+        """Open a transaction that other lock() calls with the same key wait for until it ends."""
+
+class SQLiteDatabase(Database):
+    """Local SQLite file with pooled, pragma-configured connections."""
+
+    dialect = 'sqlite'
+    Error = sqlite3.Error
+
+    def __init__(self, path, pool_size):
+        self.path = path
+        self.pool = ConnectionPool(pool_size, self.connect)
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            db.execute(pragma)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def acquire(self):
+        return self.pool.acquire()
+
+    def release(self, db):
+        self.pool.release(db)
+
+    def insert(self, db, query, args=()):
+        return db.execute(query, args).lastrowid
+
+    def lock_schema(self, db):
+        # Explicit BEGIN keeps DDL inside the transaction (sqlite3 autocommits it otherwise)
+        db.execute("BEGIN IMMEDIATE")
+
+    def lock(self, db, key):
+        # SQLite has a single writer, so taking the write lock serialises every key
+        db.execute("BEGIN IMMEDIATE")
+
+class PgRow(tuple):
+    """psycopg row addressable by position or column name, like sqlite3.Row."""
+
+    def __new__(cls, values, columns):
+        row = super().__new__(cls, values)
+        row._columns = columns
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._columns[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._columns)
+
+def _pg_row_factory(cursor):
+    columns = {col.name: i for i, col in enumerate(cursor.description or ())}
+    return lambda values: PgRow(values, columns)
+
+@functools.lru_cache(maxsize=1024)
+def _pg_query(query):
+    """Rewrite qmark placeholders to psycopg's %s, leaving quoted literals alone."""
+    out = []
+    in_literal = False
+    for ch in query:
+        if ch == "'":
+            in_literal = not in_literal
+        if ch == '?' and not in_literal:
+            out.append('%s')
+        elif ch == '%':
+            out.append('%%')
+        else:
+            out.append(ch)
+    return ''.join(out)
+
+def _pg_ddl(script):
+    return re.sub(r'INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY', script, flags=re.IGNORECASE)
+
+class PostgresConnection:
+    """sqlite3-style facade over a pooled psycopg connection."""
+
+    def __init__(self, conn):
+        self.raw = conn
+
+    def execute(self, query, args=()):
+        if args:
+            return self.raw.execute(_pg_query(query), args)
+        return self.raw.execute(query)
+
+    def executemany(self, query, seq_of_args):
+        cur = self.raw.cursor()
+        cur.executemany(_pg_query(query), seq_of_args)
+        return cur
+
+    def executescript(self, script):
+        self.raw.execute(_pg_ddl(script))
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    @property
+    def in_transaction(self):
+        from psycopg.pq import TransactionStatus
+        return self.raw.info.transaction_status != TransactionStatus.IDLE
+
+class PostgresDatabase(Database):
+    """PostgreSQL through a per-process psycopg_pool with server-side prepared statements."""
+
+    dialect = 'postgresql'
+
+    def __init__(self, url, pool_size):
+        import psycopg
+        self.Error = psycopg.Error
+        self.url = url
+        self.pool_size = max(pool_size, 1)
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                from psycopg_pool import ConnectionPool as PgConnectionPool
+                self._pool = PgConnectionPool(
+                    self.url, min_size=1, max_size=self.pool_size, open=True,
+                    kwargs={'prepare_threshold': PG_PREPARE_THRESHOLD, 'row_factory': _pg_row_factory})
+                self._pid = os.getpid()
+            return self._pool
+
+    def acquire(self):
+        return PostgresConnection(self._get_pool().getconn())
+
+    def release(self, db):
+        try:
+            if db.in_transaction:
+                db.rollback()
+        except self.Error:
+            pass
+        self._get_pool().putconn(db.raw)
+
+    def insert(self, db, query, args=()):
+        return db.execute(query + " RETURNING id", args).fetchone()[0]
+
+    def ddl(self, statement):
+        return _pg_ddl(statement)
+
+    def lock_schema(self, db):
+        self.lock(db, PG_SCHEMA_LOCK_ID)
+
+    def lock(self, db, key):
+        db.execute("SELECT pg_advisory_xact_lock(?)", (key,))
+
+def open_database(url):
+    if url.startswith('postgresql://'):
+        return PostgresDatabase(url, DB_POOL_SIZE)
+    return SQLiteDatabase(url, DB_POOL_SIZE)
+
+database = open_database(APP_DB)
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(APP_DB)
-        db.row_factory = sqlite3.Row
-    return db
+        db = g._database = database.acquire()
+    stats = g.get('_request_stats')
+    return InstrumentedConnection(db, stats) if stats is not None else db
 
 def query_db(query, args=(), one=False):
     cur = get_db().execute(query, args)
@@ -57,256 +442,2306 @@ def query_db(query, args=(), one=False):
     cur.close()
     return (rv[0] if rv else None) if one else rv
 
-def init_db():
-    db = sqlite3.connect(APP_DB)
-    cur = db.cursor()
-    
-    # Check if users table exists, if not create all tables
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-    if cur.fetchone() is None:
-        cur.executescript("""
-        CREATE TABLE users (
+def insert_db(query, args=()):
+    """Run an INSERT on the request connection and return the new row id."""
+    return database.insert(get_db(), query, args)
+
+@app.teardown_appcontext
+def close_connection(exception):
+    db = g.pop('_database', None)
+    if db is not None:
+        database.release(db)
+
+# -----------------------
+# Instrumentation
+# -----------------------
+# Opt-in (METRICS=1) request metrics: latency per endpoint, SQL statements and
+# time per request (every execute on the request connection), template render
+# time, and statements repeated within one request (the N+1 signature). They
+# are served in Prometheus text format on /metrics. With several gunicorn
+# workers set METRICS_DIR to a shared directory so each worker's counts are
+# merged into every scrape. PROFILE_SAMPLE_RATE profiles a fraction of
+# requests with cProfile and keeps the dumps of those slower than
+# PROFILE_THRESHOLD_MS.
+METRICS_ENABLED = os.environ.get('METRICS') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_SYNC_INTERVAL = 5
+SQL_REPEAT_WARN = int(os.environ.get('SQL_REPEAT_WARN', 10))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_THRESHOLD_MS = float(os.environ.get('PROFILE_THRESHOLD_MS', 500))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = 50
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+# name: (type, help, histogram buckets)
+METRIC_DEFS = {
+    'app_request_duration_seconds': ('histogram', 'Time to build a response, by endpoint', LATENCY_BUCKETS),
+    'app_requests_total': ('counter', 'Responses by endpoint and status', None),
+    'app_sql_queries_per_request': ('histogram', 'SQL statements run per request', COUNT_BUCKETS),
+    'app_sql_seconds_per_request': ('histogram', 'Time spent in SQL per request', LATENCY_BUCKETS),
+    'app_template_render_seconds': ('histogram', 'render_template time by template', LATENCY_BUCKETS),
+    'app_sql_repeated_statements_total': ('counter', f'Requests that ran one statement at least {SQL_REPEAT_WARN} times', None),
+    'app_profiles_written_total': ('counter', 'cProfile dumps kept for slow requests', None),
+}
+
+class Metrics:
+    """Counters and histograms keyed by metric name and label tuple, one registry per worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._pid = os.getpid()
+        self._thread = None
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            series = self._series(name)
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRIC_DEFS[name][2]
+        with self._lock:
+            series = self._series(name)
+            hist = series.get(labels)
+            if hist is None:
+                hist = series[labels] = [[0] * (len(buckets) + 1), 0.0, 0]
+            hist[0][bisect.bisect_left(buckets, value)] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def _series(self, name):
+        if self._pid != os.getpid():
+            self._values, self._thread, self._pid = {}, None, os.getpid()
+        if METRICS_DIR and self._thread is None:
+            self._thread = threading.Thread(target=self._sync, name='metrics-sync', daemon=True)
+            self._thread.start()
+        return self._values.setdefault(name, {})
+
+    def snapshot(self):
+        with self._lock:
+            return {name: [[list(labels), [list(value[0]), value[1], value[2]] if isinstance(value, list) else value]
+                           for labels, value in series.items()]
+                    for name, series in self._values.items()}
+
+    def _sync(self):
+        path = os.path.join(METRICS_DIR, f'metrics-{os.getpid()}.json')
+        while True:
+            time.sleep(METRICS_SYNC_INTERVAL)
+            try:
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(path + '.tmp', path)
+            except OSError:
+                app.logger.exception("Writing worker metrics failed")
+
+    def collect(self):
+        """This worker's values merged with the other workers' files in METRICS_DIR."""
+        snapshots = [self.snapshot()]
+        if METRICS_DIR and os.path.isdir(METRICS_DIR):
+            own = f'metrics-{os.getpid()}.json'
+            stale = time.time() - METRICS_SYNC_INTERVAL * 60
+            for name in os.listdir(METRICS_DIR):
+                path = os.path.join(METRICS_DIR, name)
+                if name == own or not name.endswith('.json') or os.path.getmtime(path) < stale:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        merged = {}
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                if name not in METRIC_DEFS:
+                    continue
+                target = merged.setdefault(name, {})
+                for labels, value in series:
+                    labels = tuple(tuple(pair) for pair in labels)
+                    if isinstance(value, list):
+                        old = target.get(labels)
+                        target[labels] = value if old is None else [
+                            [a + b for a, b in zip(old[0], value[0])], old[1] + value[1], old[2] + value[2]]
+                    else:
+                        target[labels] = target.get(labels, 0) + value
+        return merged
+
+    def render(self):
+        """Prometheus text exposition of collect()."""
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+            return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+        merged = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRIC_DEFS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for labels, value in sorted(merged.get(name, {}).items()):
+                if kind == 'counter':
+                    lines.append(f'{name}{fmt(labels)} {value}')
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, n in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{fmt(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{fmt(labels)} {total}')
+                lines.append(f'{name}_count{fmt(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+class RequestStats:
+    """SQL activity of one request."""
+
+    __slots__ = ('queries', 'sql_seconds', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+
+class InstrumentedConnection:
+    """Request connection wrapper that times every execute/executemany."""
+
+    def __init__(self, db, stats):
+        self._db = db
+        self._stats = stats
+
+    def _timed(self, method, query, args):
+        start = time.perf_counter()
+        try:
+            return method(query, args)
+        finally:
+            self._stats.queries += 1
+            self._stats.sql_seconds += time.perf_counter() - start
+            self._stats.statements[query] += 1
+
+    def execute(self, query, args=()):
+        return self._timed(self._db.execute, query, args)
+
+    def executemany(self, query, seq_of_args):
+        return self._timed(self._db.executemany, query, seq_of_args)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+_profile_lock = threading.Lock()  # one profiled request at a time per worker
+
+def _start_request_metrics():
+    g._metrics_start = time.perf_counter()
+    g._request_stats = RequestStats()
+    g._template_starts = []
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE and _profile_lock.acquire(blocking=False):
+        import cProfile
+        g._profiler = cProfile.Profile()
+        g._profiler.enable()
+
+def _record_request_metrics(response):
+    stats = g.pop('_request_stats', None)
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - g._metrics_start
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('app_request_duration_seconds', (('endpoint', endpoint), ('method', request.method)), elapsed)
+    metrics.inc('app_requests_total', (('endpoint', endpoint), ('method', request.method),
+                                       ('status', str(response.status_code))))
+    metrics.observe('app_sql_queries_per_request', (('endpoint', endpoint),), stats.queries)
+    metrics.observe('app_sql_seconds_per_request', (('endpoint', endpoint),), stats.sql_seconds)
+    if stats.statements:
+        statement, repeats = stats.statements.most_common(1)[0]
+        if repeats >= SQL_REPEAT_WARN:
+            metrics.inc('app_sql_repeated_statements_total', (('endpoint', endpoint),))
+            app.logger.warning("%s ran the same statement %d times in one request: %s",
+                               endpoint, repeats, ' '.join(statement.split())[:200])
+    _finish_profile(endpoint, elapsed)
+    return response
+
+def _finish_profile(endpoint, elapsed):
+    profiler = g.pop('_profiler', None)
+    if profiler is None:
+        return
+    profiler.disable()
+    _profile_lock.release()
+    if elapsed * 1000 < PROFILE_THRESHOLD_MS:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(
+        PROFILE_DIR, f"{datetime.now():%Y%m%dT%H%M%S.%f}-{secure_filename(endpoint)}-{elapsed * 1000:.0f}ms.prof"))
+    metrics.inc('app_profiles_written_total', ())
+    dumps = sorted((e for e in os.scandir(PROFILE_DIR) if e.name.endswith('.prof')), key=lambda e: e.stat().st_mtime)
+    for entry in dumps[:-PROFILE_KEEP]:
+        os.remove(entry.path)
+
+def _end_request_metrics(exception):
+    # Only does something when after_request did not run
+    if g.get('_profiler') is not None:
+        _finish_profile(request.endpoint or 'unmatched', time.perf_counter() - g._metrics_start)
+
+def _template_started(sender, template, context, **extra):
+    starts = g.get('_template_starts')
+    if starts is not None:
+        starts.append(time.perf_counter())
+
+def _template_finished(sender, template, context, **extra):
+    starts = g.get('_template_starts')
+    if starts:
+        metrics.observe('app_template_render_seconds', (('template', template.name or 'string'),),
+                        time.perf_counter() - starts.pop())
+
+def metrics_authorized():
+    return not METRICS_TOKEN or secrets.compare_digest(request.headers.get('Authorization', ''),
+                                                       f'Bearer {METRICS_TOKEN}')
+
+def metrics_endpoint():
+    if not metrics_authorized():
+        return "Unauthorized", 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def profiles_endpoint(filename=None):
+    """List the kept cProfile dumps (newest first), or download one for `python -m pstats`."""
+    if not metrics_authorized():
+        return "Unauthorized", 401
+    if filename is not None:
+        return send_from_directory(os.path.abspath(PROFILE_DIR), filename, as_attachment=True)
+    names = sorted(os.listdir(PROFILE_DIR), reverse=True) if os.path.isdir(PROFILE_DIR) else []
+    return jsonify({"profiles": [n for n in names if n.endswith('.prof')]})
+
+if METRICS_ENABLED:
+    app.before_request(_start_request_metrics)
+    app.after_request(_record_request_metrics)
+    app.teardown_request(_end_request_metrics)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    # Profiles expose source paths and call graphs, so they are never served without a token
+    if METRICS_TOKEN:
+        app.add_url_rule('/metrics/profiles', 'metrics_profiles', profiles_endpoint)
+        app.add_url_rule('/metrics/profiles/<filename>', 'metrics_profile', profiles_endpoint)
+
+# -----------------------
+# Schema migrations
+# -----------------------
+# Each migration is (version, name, steps). Steps are SQL statements (written
+# in SQLite syntax and adapted by Database.ddl) or callables taking the
+# connection. Applied versions are recorded in schema_migrations, so every
+# migration runs exactly once per database; run them at deploy time with
+# init_db() or `flask --app app migrate`, never from request handlers.
+def _seed_demo_content(db):
+    if db.execute("SELECT COUNT(*) FROM users").fetchone()[0] > 0:
+        return
+    
+    # Create default users
+    now = datetime.now().isoformat()
+    # Default teacher
+    db.execute("INSERT INTO users (name, email, password_hash, user_type, created_at) VALUES (?, ?, ?, ?, ?)",
+               ("Demo Teacher", "teacher@smartlearning.com", generate_password_hash("teacher123"), "teacher", now))
+    # Default student
+    db.execute("INSERT INTO users (name, email, password_hash, user_type, created_at) VALUES (?, ?, ?, ?, ?)",
+               ("Demo Student", "student@smartlearning.com", generate_password_hash("student123"), "student", now))
+    
+    # Check if sample lesson exists
+    if db.execute("SELECT COUNT(*) FROM lessons").fetchone()[0] == 0:
+        # sample lesson + quiz + questions
+        lesson_id = database.insert(db, "INSERT INTO lessons (title,description,video_url,created_at) VALUES (?,?,?,?)",
+                                    ("Mathematics: Fractions",
+                                     "Intro to fractions and basic operations",
+                                     "https://www.youtube.com/watch?v=dQw4w9WgXcQ",  # replace with a working video
+                                     now))
+        quiz_id = database.insert(db, "INSERT INTO quizzes (lesson_id,title) VALUES (?,?)", (lesson_id, "Fractions Quiz"))
+        qlist = [
+            ("What is 1/2 + 1/3 ?", ["5/6","2/5","3/5","1/6"], 0, "fractions"),
+            ("Which is equivalent to 2/4 ?", ["1/2","2/3","3/4","1/4"], 0, "fractions"),
+            ("What is 3/5 - 1/5 ?", ["2/5","1/5","3/10","4/5"], 0, "fractions"),
+            ("Convert 3/4 to decimal.", ["0.75","0.85","0.5","1.25"], 0, "decimal")
+        ]
+        db.executemany("INSERT INTO questions (quiz_id,question,options,answer_index,topic) VALUES (?,?,?,?,?)",
+                       [(quiz_id, q[0], json.dumps(q[1]), q[2], q[3]) for q in qlist])
+
+def _seed_faqs(db):
+    if db.execute("SELECT COUNT(*) FROM faq_version").fetchone()[0] > 0:
+        return
+    now = datetime.now().isoformat()
+    db.executemany("INSERT INTO faqs (question, answer, updated_at) VALUES (?, ?, ?)",
+                   [(q, a, now) for q, a in FAQ_PAIRS])
+    db.execute("INSERT INTO faq_version (version) VALUES (1)")
+
+def _backfill_topic_mastery(db):
+    # Attempts only record the student's name; credit those whose name is unambiguous
+    students = {}
+    for row in db.execute("SELECT id, name FROM users WHERE user_type = 'student'").fetchall():
+        students[row[1]] = None if row[1] in students else row[0]
+    totals = {}
+    for name, detail, taken_at in db.execute("SELECT student_name, detail, taken_at FROM attempts").fetchall():
+        student_id = students.get(name)
+        if student_id is None or not detail:
+            continue
+        for topic, vals in json.loads(detail).items():
+            key = (student_id, topic)
+            correct, total, last_seen = totals.get(key, (0, 0, ''))
+            totals[key] = (correct + vals['right'], total + vals['total'], max(last_seen, taken_at or ''))
+    db.executemany("INSERT INTO topic_mastery (student_id, topic, correct, total, last_seen) VALUES (?, ?, ?, ?, ?)",
+                   [(sid, topic, c, t, seen) for (sid, topic), (c, t, seen) in totals.items()])
+
+def _backfill_conversations(db):
+    conversations = {}
+    for sender_id, receiver_id, message_id, message, sent_at, is_read in db.execute(
+            "SELECT sender_id, receiver_id, id, message, sent_at, is_read FROM messages ORDER BY sent_at, id").fetchall():
+        if sender_id is None or receiver_id is None:
+            continue
+        key = conversation_key(sender_id, receiver_id)
+        unread = conversations.get(key, {'a': 0, 'b': 0})
+        if not is_read:
+            unread['a' if receiver_id == key[0] else 'b'] += 1
+        conversations[key] = dict(unread, id=message_id, message=message, sent_at=sent_at)
+    db.executemany("""
+        INSERT INTO conversations (user_a, user_b, last_message_id, last_message, last_sent_at, unread_a, unread_b)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(a, b, c['id'], c['message'], c['sent_at'], c['a'], c['b']) for (a, b), c in conversations.items()])
+
+def _dedupe_study_streaks(db):
+    # Concurrent first answers could create several rows per student; keep the one with the most points
+    keep = {}
+    for row_id, user_id, points in db.execute(
+            "SELECT id, user_id, COALESCE(total_points, 0) FROM study_streaks WHERE user_id IS NOT NULL ORDER BY id").fetchall():
+        if user_id not in keep or points >= keep[user_id][1]:
+            keep[user_id] = (row_id, points)
+    kept = {row_id for row_id, _ in keep.values()}
+    db.executemany("DELETE FROM study_streaks WHERE id = ?",
+                   [(row_id,) for (row_id,) in db.execute("SELECT id FROM study_streaks WHERE user_id IS NOT NULL").fetchall()
+                    if row_id not in kept])
+
+MIGRATIONS = [
+    (1, 'base schema', [
+        """CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
             email TEXT UNIQUE NOT NULL,
             password_hash TEXT NOT NULL,
             user_type TEXT NOT NULL,
             created_at TEXT
-        );
-        CREATE TABLE IF NOT EXISTS lessons (
+        )""",
+        """CREATE TABLE IF NOT EXISTS lessons (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT,
             description TEXT,
             video_url TEXT,
             created_at TEXT
-        );
-        CREATE TABLE IF NOT EXISTS quizzes (
+        )""",
+        """CREATE TABLE IF NOT EXISTS quizzes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             lesson_id INTEGER,
             title TEXT
-        );
-        CREATE TABLE IF NOT EXISTS questions (
+        )""",
+        """CREATE TABLE IF NOT EXISTS questions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             quiz_id INTEGER,
             question TEXT,
             options TEXT, -- JSON list
             answer_index INTEGER,
             topic TEXT
-        );
-        CREATE TABLE IF NOT EXISTS attempts (
+        )""",
+        """CREATE TABLE IF NOT EXISTS attempts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             student_name TEXT,
             quiz_id INTEGER,
             score REAL,
             detail TEXT,
             taken_at TEXT
-        );
-        CREATE TABLE IF NOT EXISTS messages (
+        )""",
+        """CREATE TABLE IF NOT EXISTS messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             sender_id INTEGER,
             receiver_id INTEGER,
             message TEXT,
             sent_at TEXT,
             is_read INTEGER DEFAULT 0
-        );
-        CREATE TABLE IF NOT EXISTS achievements (
+        )""",
+        """CREATE TABLE IF NOT EXISTS achievements (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
             badge_type TEXT,
             earned_at TEXT
-        );
-        CREATE TABLE IF NOT EXISTS study_streaks (
+        )""",
+        """CREATE TABLE IF NOT EXISTS study_streaks (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
             current_streak INTEGER DEFAULT 0,
             last_activity TEXT,
             total_points INTEGER DEFAULT 0
-        );
-        """)
-        
-        # Create default users
-        now = datetime.now().isoformat()
-        # Default teacher
-        cur.execute("INSERT INTO users (name, email, password_hash, user_type, created_at) VALUES (?, ?, ?, ?, ?)",
-                    ("Demo Teacher", "teacher@smartlearning.com", generate_password_hash("teacher123"), "teacher", now))
-        # Default student
-        cur.execute("INSERT INTO users (name, email, password_hash, user_type, created_at) VALUES (?, ?, ?, ?, ?)",
-                    ("Demo Student", "student@smartlearning.com", generate_password_hash("student123"), "student", now))
-        
-        # Check if sample lesson exists
-        cur.execute("SELECT COUNT(*) FROM lessons")
-        if cur.fetchone()[0] == 0:
-            # sample lesson + quiz + questions
-            now = datetime.now().isoformat()
-            cur.execute("INSERT INTO lessons (title,description,video_url,created_at) VALUES (?,?,?,?)",
-                        ("Mathematics: Fractions",
-                         "Intro to fractions and basic operations",
-                         "https://www.youtube.com/watch?v=dQw4w9WgXcQ",  # replace with a working video
-                         now))
-            lesson_id = cur.lastrowid
-            cur.execute("INSERT INTO quizzes (lesson_id,title) VALUES (?,?)", (lesson_id, "Fractions Quiz"))
-            quiz_id = cur.lastrowid
-            qlist = [
-                ("What is 1/2 + 1/3 ?", ["5/6","2/5","3/5","1/6"], 0, "fractions"),
-                ("Which is equivalent to 2/4 ?", ["1/2","2/3","3/4","1/4"], 0, "fractions"),
-                ("What is 3/5 - 1/5 ?", ["2/5","1/5","3/10","4/5"], 0, "fractions"),
-                ("Convert 3/4 to decimal.", ["0.75","0.85","0.5","1.25"], 0, "decimal")
-            ]
-            for q in qlist:
-                cur.execute("INSERT INTO questions (quiz_id,question,options,answer_index,topic) VALUES (?,?,?,?,?)",
-                            (quiz_id, q[0], json.dumps(q[1]), q[2], q[3]))
-    
-    # Check if messages table exists, if not create it
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'")
-    if cur.fetchone() is None:
-        cur.execute("""
-            CREATE TABLE messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender_id INTEGER,
-                receiver_id INTEGER,
-                message TEXT,
-                sent_at TEXT,
-                is_read INTEGER DEFAULT 0
-            )
-        """)
+        )""",
+        _seed_demo_content,
+    ]),
+    (2, 'AI tutor FAQ corpus', [
+        """CREATE TABLE IF NOT EXISTS faqs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            updated_at TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS faq_version (
+            version INTEGER NOT NULL
+        )""",
+        _seed_faqs,
+    ]),
+    (3, 'secondary indexes', [
+        "CREATE INDEX IF NOT EXISTS idx_users_type_name ON users (user_type, name)",
+        "CREATE INDEX IF NOT EXISTS idx_quizzes_lesson ON quizzes (lesson_id)",
+        "CREATE INDEX IF NOT EXISTS idx_questions_quiz ON questions (quiz_id)",
+        "CREATE INDEX IF NOT EXISTS idx_attempts_taken_at ON attempts (taken_at)",
+        "CREATE INDEX IF NOT EXISTS idx_attempts_quiz ON attempts (quiz_id)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages (sender_id, receiver_id, sent_at)",
+        "CREATE INDEX IF NOT EXISTS idx_achievements_user ON achievements (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_study_streaks_user ON study_streaks (user_id)",
+    ]),
+    (4, 'attempt listing and ranking indexes', [
+        "DROP INDEX IF EXISTS idx_attempts_taken_at",
+        "DROP INDEX IF EXISTS idx_attempts_quiz",
+        "CREATE INDEX IF NOT EXISTS idx_attempts_taken_at_id ON attempts (taken_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_attempts_quiz_taken_at_id ON attempts (quiz_id, taken_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_attempts_score ON attempts (score, taken_at)",
+    ]),
+    (5, 'per-student topic mastery', [
+        """CREATE TABLE IF NOT EXISTS topic_mastery (
+            student_id INTEGER NOT NULL,
+            topic TEXT NOT NULL,
+            correct INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            last_seen TEXT,
+            PRIMARY KEY (student_id, topic)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_topic_mastery_topic ON topic_mastery (topic)",
+        _backfill_topic_mastery,
+    ]),
+    (6, 'quiz content versions', [
+        "ALTER TABLE quizzes ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+    ]),
+    (7, 'conversation summaries', [
+        # One row per user pair (user_a < user_b); unread_a counts messages to user_a not yet read
+        """CREATE TABLE IF NOT EXISTS conversations (
+            user_a INTEGER NOT NULL,
+            user_b INTEGER NOT NULL,
+            last_message_id INTEGER,
+            last_message TEXT,
+            last_sent_at TEXT,
+            unread_a INTEGER NOT NULL DEFAULT 0,
+            unread_b INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_a, user_b)
+        )""",
+        _backfill_conversations,
+    ]),
+    (8, 'chat history paging and read watermarks', [
+        "DROP INDEX IF EXISTS idx_messages_pair",
+        "CREATE INDEX IF NOT EXISTS idx_messages_pair_sent ON messages (sender_id, receiver_id, sent_at, id)",
+        # sent_at of the newest message each side has read; older messages are never rescanned
+        "ALTER TABLE conversations ADD COLUMN read_at_a TEXT NOT NULL DEFAULT ''",
+        "ALTER TABLE conversations ADD COLUMN read_at_b TEXT NOT NULL DEFAULT ''",
+    ]),
+    (9, 'one study streak per student', [
+        _dedupe_study_streaks,
+        "DROP INDEX IF EXISTS idx_study_streaks_user",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_study_streaks_user_unique ON study_streaks (user_id)",
+    ]),
+    (10, 'weekly and monthly points', [
+        # period is 'week:2026-W42' or 'month:2026-10'; rows start from this migration
+        """CREATE TABLE IF NOT EXISTS student_points (
+            period TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            points INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, user_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_study_streaks_activity ON study_streaks (last_activity)",
+    ]),
+    (11, 'resumable video uploads', [
+        # received is the number of bytes stored so far; filename is set once the upload is finalized
+        """CREATE TABLE IF NOT EXISTS uploads (
+            id TEXT PRIMARY KEY,
+            teacher_id INTEGER NOT NULL,
+            original_name TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            received INTEGER NOT NULL DEFAULT 0,
+            sha256 TEXT,
+            filename TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_uploads_updated ON uploads (updated_at)",
+    ]),
+    (12, 'video transcoding', [
+        # video_status: 'ready', 'processing' (original upload still served) or 'failed';
+        # renditions is the JSON manifest written by the transcode worker
+        "ALTER TABLE lessons ADD COLUMN video_status TEXT NOT NULL DEFAULT 'ready'",
+        "ALTER TABLE lessons ADD COLUMN renditions TEXT",
+        """CREATE TABLE IF NOT EXISTS transcode_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lesson_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            locked_at TEXT,
+            finished_at TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_transcode_jobs_status ON transcode_jobs (status, id)",
+        "CREATE INDEX IF NOT EXISTS idx_transcode_jobs_lesson ON transcode_jobs (lesson_id)",
+    ]),
+    (13, 'queued quiz submissions', [
+        # One row per graded submission; the id comes from the student and the client's idempotency key
+        """CREATE TABLE IF NOT EXISTS quiz_submissions (
+            id TEXT PRIMARY KEY,
+            student_id INTEGER NOT NULL,
+            quiz_id INTEGER,
+            result TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            graded_at TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_quiz_submissions_created ON quiz_submissions (created_at)",
+    ]),
+    (14, 'durable quiz submissions', [
+        # Submissions are stored as 'pending' with their answers before submit_quiz answers, then graded
+        """CREATE TABLE quiz_submissions_new (
+            id TEXT PRIMARY KEY,
+            student_id INTEGER NOT NULL,
+            student_name TEXT,
+            quiz_id INTEGER,
+            answers TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            result TEXT,
+            created_at TEXT NOT NULL,
+            graded_at TEXT
+        )""",
+        """INSERT INTO quiz_submissions_new (id, student_id, quiz_id, status, result, created_at, graded_at)
+           SELECT id, student_id, quiz_id, 'graded', result, created_at, graded_at FROM quiz_submissions""",
+        "DROP TABLE quiz_submissions",
+        "ALTER TABLE quiz_submissions_new RENAME TO quiz_submissions",
+        "CREATE INDEX IF NOT EXISTS idx_quiz_submissions_created ON quiz_submissions (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_quiz_submissions_status ON quiz_submissions (status, created_at)",
+    ]),
+    (15, 'upload chunk claims', [
+        # A chunk request claims the upload before writing; claimed_at lets a crashed request's claim expire
+        "ALTER TABLE uploads ADD COLUMN claim TEXT",
+        "ALTER TABLE uploads ADD COLUMN claimed_at TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_uploads_filename ON uploads (filename)",
+    ]),
+    (16, 'journaled math game answers', [
+        # Answers are committed here when acknowledged and folded into study_streaks by ScoreBuffer
+        """CREATE TABLE IF NOT EXISTS score_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            correct INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_score_events_user ON score_events (user_id, id)",
+    ]),
+]
+
+def migrate():
+    """Apply pending migrations in order and return the versions applied."""
+    applied = []
+    with database.connection() as db:
+        for version, name, steps in MIGRATIONS:
+            # Serialises concurrent deploys; released by the commit/rollback below
+            database.lock_schema(db)
+            db.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TEXT
+            )""")
+            if db.execute("SELECT 1 FROM schema_migrations WHERE version=?", (version,)).fetchone():
+                db.rollback()
+                continue
+            try:
+                for step in steps:
+                    if callable(step):
+                        step(db)
+                    else:
+                        db.execute(database.ddl(step))
+                db.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                           (version, name, datetime.now().isoformat()))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            applied.append(version)
+    return applied
+
+def init_db():
+    migrate()
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending database migrations."""
+    applied = migrate()
+    click.echo(f"Applied migrations: {', '.join(map(str, applied))}" if applied else "Database is up to date.")
+
+# -----------------------
+# Simple chatbot (FAQ-based + TF-IDF similarity)
+# -----------------------
+FAQ_PAIRS = [
+    # Platform Usage
+    ("How do I join live class?", "Click on any lesson from the Student Portal, then watch the video lesson. Teachers upload video content for you to learn at your own pace."),
+    ("How to attempt quiz?", "Go to Student Portal → Select a lesson → Click 'Start Learning' → After watching the video, click 'Take Quiz' to test your knowledge."),
+    ("How are recommendations generated?", "Our AI analyzes your quiz performance by topic. If you score below 70% in any topic, we recommend focusing on those areas for improvement."),
+    ("I forgot my password", "This platform doesn't require passwords! Just enter your name when taking quizzes to track your progress."),
+    ("How do I track my progress?", "Visit the Results page to see all your quiz attempts, scores, and performance analytics. You can access it from the main navigation."),
+    ("Can I retake a quiz?", "Yes! You can retake any quiz multiple times to improve your understanding and score."),
+    
+    # Mathematics - Fractions
+    ("What is a fraction?", "A fraction represents a part of a whole. It has two parts: numerator (top number) and denominator (bottom number). For example, in 3/4, 3 is the numerator and 4 is the denominator."),
+    ("How to add fractions?", "To add fractions: 1) Make denominators the same, 2) Add numerators, 3) Keep the denominator. Example: 1/4 + 1/4 = 2/4 = 1/2"),
+    ("Convert 3/4 to decimal", "To convert 3/4 to decimal, divide 3 by 4: 3 ÷ 4 = 0.75"),
+    ("What is equivalent fraction?", "Equivalent fractions represent the same value but look different. Example: 1/2 = 2/4 = 3/6. Multiply or divide both numerator and denominator by the same number."),
+    ("How to subtract fractions?", "Similar to addition: 1) Make denominators the same, 2) Subtract numerators, 3) Keep the denominator. Example: 3/4 - 1/4 = 2/4 = 1/2"),
+    
+    # General Study Tips
+    ("How to study effectively?", "1) Watch video lessons completely, 2) Take notes of key points, 3) Practice with quizzes, 4) Review topics you scored low on, 5) Ask me questions when confused!"),
+    ("I'm struggling with math", "Don't worry! Math takes practice. Start with basics, watch videos multiple times, take quizzes to identify weak areas, and ask specific questions. I'm here to help!"),
+    ("Tips for rural students", "1) Use this platform regularly, 2) Don't hesitate to ask questions, 3) Practice consistently, 4) Connect with urban teachers through video lessons, 5) Believe in yourself!"),
+    ("How does AI tutoring work?", "I use artificial intelligence to understand your questions and provide helpful explanations. I can help with concepts, solve doubts, give study tips, and guide you through problems."),
+    
+    # Technical Support
+    ("Video not loading", "Try refreshing the page or check your internet connection. If the problem persists, the teacher might be updating the video content."),
+    ("Quiz not submitting", "Make sure you've answered all questions and entered your name. Check your internet connection and try again."),
+    ("How to contact teacher?", "Currently, you can learn from teacher-created videos and use this AI tutor for doubts. More direct communication features are coming soon!"),
     
+    # Motivational
+    ("I feel discouraged", "Learning is a journey with ups and downs. Every expert was once a beginner. Keep practicing, use this platform regularly, and celebrate small victories. You've got this!"),
+    ("Am I smart enough?", "Absolutely! Intelligence isn't fixed - it grows with effort and practice. This platform is designed to help you learn at your own pace. Keep going!"),
+]
+
+# Topic keywords used by the rule-based matcher. A query mentioning any of the
+# keywords matches the first FAQ whose question contains the topic name.
+TOPIC_KEYWORDS = {
+    'fraction': ['fraction', 'fractions', 'numerator', 'denominator'],
+    'decimal': ['decimal', 'decimals', 'point'],
+    'quiz': ['quiz', 'test', 'exam', 'question'],
+    'video': ['video', 'lesson', 'watch'],
+    'study': ['study', 'learn', 'practice']
+}
+
+GREETINGS = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening', 'howdy', 'sup']
+GREETING_RESPONSES = [
+    "Hello there! 👋 I'm your AI tutor, ready to help you learn and grow. What subject would you like to explore today?",
+    "Hi! Great to see you here! 😊 I can help with math, study strategies, or any questions about the platform. What can I assist you with?",
+    "Hey! Welcome to your learning session! 🎓 I'm here to make your studies easier and more effective. How can I help?"
+]
+THANKS = ['thank', 'thanks', 'thank you', 'thx', 'appreciate']
+THANKS_RESPONSES = [
+    "You're very welcome! 😊 I'm always happy to help you succeed. Keep up the great work!",
+    "My pleasure! That's what I'm here for. Feel free to ask me anything else - I love helping students learn! 🌟",
+    "Glad I could help! Remember, there's no such thing as a silly question. I'm here whenever you need me! 💪"
+]
+MOTIVATION_WORDS = ['tired', 'difficult', 'hard', 'struggling', 'confused', 'frustrated', 'give up', 'quit']
+COMPLIMENTS = ['good', 'great', 'awesome', 'amazing', 'helpful', 'smart']
+FALLBACK_RESPONSES = [
+    "I want to help, but I'm not sure I understand your question completely. Could you rephrase it or be more specific? 🤔\n\n**I'm great at helping with:**\n• Math concepts (fractions, decimals, etc.)\n• Platform navigation\n• Study tips and strategies\n• Quiz guidance",
+    "Hmm, that's an interesting question! I might need a bit more context to give you the best answer. 💭\n\n**Try asking about:**\n• Specific math topics\n• How to use platform features\n• Study techniques\n• Quiz preparation tips",
+    "I'd love to help you with that! Could you provide a bit more detail or ask in a different way? 😊\n\n**Popular topics I can help with:**\n• Mathematics explanations\n• Learning strategies\n• Platform tutorials\n• Academic support"
+]
+EMPTY_RESPONSE = "I'm here to help! You can ask me about math concepts, how to use the platform, study tips, or anything else related to your learning journey. What's on your mind? 🤔"
+MOTIVATION_RESPONSE = "I understand learning can be challenging sometimes, but you're doing great by asking for help! 💪 Remember, every expert was once a beginner. Take a short break if needed, then let's tackle this together. What specific topic is giving you trouble?"
+COMPLIMENT_RESPONSE = "Thank you so much! 😊 Your kind words motivate me to help even more. I'm here to support your learning journey every step of the way. What else can we work on together?"
+MATH_RESPONSE = "I love helping with math! 📚 I can explain fractions, decimals, basic operations, and more. Try asking specific questions like:\n• 'What is a fraction?'\n• 'How to add fractions?'\n• 'Convert fractions to decimals'\n\nWhat math topic interests you most?"
+HELP_RESPONSE = "I'm here to help! 🌟 You can ask me about:\n\n📚 **Math concepts** (fractions, decimals, operations)\n🎯 **Platform usage** (taking quizzes, watching videos)\n📝 **Study strategies** (effective learning tips)\n💡 **Motivation** (staying focused and confident)\n\nWhat specific topic would you like to explore?"
+
+# Response cache sizing; entries also expire after the TTL (seconds)
+CHATBOT_CACHE_SIZE = int(os.environ.get('CHATBOT_CACHE_SIZE', 2048))
+CHATBOT_CACHE_TTL = float(os.environ.get('CHATBOT_CACHE_TTL', 3600))
+
+# Answers picked with random.choice; these must never be served from the cache
+RANDOM_RESPONSES = frozenset(GREETING_RESPONSES + THANKS_RESPONSES + FALLBACK_RESPONSES)
+
+# Similarity backend for the chatbot: 'sklearn', 'numpy' (TF-IDF) or 'bm25'
+CHATBOT_RETRIEVER = os.environ.get('CHATBOT_RETRIEVER', 'sklearn')
+
+class ChatbotRetriever(ABC):
+    """Scores questions against a fixed list of FAQ questions.
+
+    similarities_many returns a (queries x documents) array of cosine scores in
+    [0, 1]; chatbot_answer applies its 0.3 threshold to these values.
+    """
+
+    @abstractmethod
+    def similarities_many(self, queries):
+        pass
+
+class SklearnRetriever(ChatbotRetriever):
+    """scikit-learn TfidfVectorizer with a cached, L2-normalised FAQ matrix."""
+
+    def __init__(self, documents):
+        # Imported here so workers that never serve the chatbot skip loading scikit-learn
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        self.vectorizer = TfidfVectorizer().fit(documents)
+        self.matrix = self.vectorizer.transform(documents).tocsr()
+
+    def similarities_many(self, queries):
+        # Rows are L2-normalised, so the dot product is the cosine
+        return (self.vectorizer.transform(queries) @ self.matrix.T).toarray()
+
+class NumpyRetriever(ChatbotRetriever):
+    """Dependency-light TF-IDF or BM25 retriever over a term-major CSR index.
+
+    Postings for term t live in indices/data[indptr[t]:indptr[t + 1]]
+    (document positions and L2-normalised weights). The 'tfidf' weighting
+    reproduces TfidfVectorizer's defaults exactly; 'bm25' uses Okapi BM25 term
+    weights, normalised the same way so scores stay cosine-like.
+    """
+
+    TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+    def __init__(self, documents, weighting='tfidf', k1=1.5, b=0.75):
+        import numpy as np
+        self.np = np
+        self.weighting = weighting
+        self.n_docs = len(documents)
+
+        doc_counts = [Counter(self.TOKEN_PATTERN.findall(d.lower())) for d in documents]
+        self.vocabulary = {}
+        postings = []
+        for doc, counts in enumerate(doc_counts):
+            for term, tf in counts.items():
+                term_id = self.vocabulary.setdefault(term, len(postings))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((doc, tf))
+
+        df = np.array([len(p) for p in postings], dtype=np.float64)
+        if weighting == 'bm25':
+            self.idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+        else:
+            self.idf = np.log((1.0 + self.n_docs) / (1.0 + df)) + 1.0
+
+        self.indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(p) for p in postings])
+        self.indices = np.fromiter((doc for p in postings for doc, tf in p),
+                                   dtype=np.int32, count=int(self.indptr[-1]))
+        tf = np.fromiter((tf for p in postings for doc, tf in p),
+                         dtype=np.float64, count=int(self.indptr[-1]))
+        term_ids = np.repeat(np.arange(len(postings)), np.diff(self.indptr))
+
+        if weighting == 'bm25':
+            doc_len = np.array([sum(c.values()) for c in doc_counts], dtype=np.float64)
+            avg_len = doc_len.mean() if self.n_docs else 0.0
+            norm = k1 * (1.0 - b + b * doc_len[self.indices] / (avg_len or 1.0))
+            self.data = self.idf[term_ids] * tf * (k1 + 1.0) / (tf + norm)
+        else:
+            self.data = self.idf[term_ids] * tf
+
+        doc_norms = np.zeros(self.n_docs)
+        np.add.at(doc_norms, self.indices, self.data ** 2)
+        doc_norms = np.sqrt(doc_norms)
+        doc_norms[doc_norms == 0] = 1.0
+        self.data /= doc_norms[self.indices]
+
+    def similarities_many(self, queries):
+        np = self.np
+        scores = np.zeros((len(queries), self.n_docs))
+        for row, text in enumerate(queries):
+            counts = Counter(t for t in self.TOKEN_PATTERN.findall(text.lower()) if t in self.vocabulary)
+            if not counts:
+                continue
+            term_ids = np.array([self.vocabulary[t] for t in counts])
+            if self.weighting == 'bm25':
+                weights = self.idf[term_ids]
+            else:
+                weights = self.idf[term_ids] * np.array(list(counts.values()), dtype=np.float64)
+            weights /= np.linalg.norm(weights)
+            for term_id, weight in zip(term_ids, weights):
+                start, end = self.indptr[term_id], self.indptr[term_id + 1]
+                scores[row, self.indices[start:end]] += weight * self.data[start:end]
+        return scores
+
+CHATBOT_RETRIEVERS = {
+    'sklearn': SklearnRetriever,
+    'numpy': NumpyRetriever,
+    'bm25': lambda documents: NumpyRetriever(documents, weighting='bm25'),
+}
+
+def make_retriever(documents, backend=None):
+    backend = backend or CHATBOT_RETRIEVER
+    if backend not in CHATBOT_RETRIEVERS:
+        raise ValueError(f"Unknown CHATBOT_RETRIEVER {backend!r}; choose from {', '.join(CHATBOT_RETRIEVERS)}")
+    return CHATBOT_RETRIEVERS[backend](documents)
+
+_faq_index_generations = itertools.count(1)
+
+class FaqIndex:
+    """Lookup structures for FAQ_PAIRS, built once instead of on every query."""
+
+    def __init__(self, pairs, backend=None):
+        # Distinguishes cache entries made against different FAQ corpora
+        self.generation = next(_faq_index_generations)
+        self.pairs = list(pairs)
+        self.questions = [q for q, a in self.pairs]
+        self.question_words = [set(re.findall(r'\w+', q.lower())) for q in self.questions]
+
+        # word -> FAQ positions containing it, for the word-overlap rule
+        self.word_index = {}
+        for idx, words in enumerate(self.question_words):
+            for word in words:
+                self.word_index.setdefault(word, []).append(idx)
+
+        # topic -> first FAQ position whose question mentions the topic
+        self.topic_index = {}
+        for topic in TOPIC_KEYWORDS:
+            for idx, q in enumerate(self.questions):
+                if topic in q.lower():
+                    self.topic_index[topic] = idx
+                    break
+
+        self.retriever = make_retriever(self.questions, backend) if self.questions else None
+
+    def keyword_match(self, ui):
+        """Position of the first FAQ sharing two words or a topic with ui, or None."""
+        best = None
+        for topic, idx in self.topic_index.items():
+            if (best is None or idx < best) and any(keyword in ui for keyword in TOPIC_KEYWORDS[topic]):
+                best = idx
+
+        overlap = {}
+        for word in set(re.findall(r'\w+', ui)):
+            for idx in self.word_index.get(word, ()):
+                overlap[idx] = overlap.get(idx, 0) + 1
+        for idx, count in overlap.items():
+            if count >= 2 and (best is None or idx < best):
+                best = idx
+        return best
+
+    def similarities(self, ui):
+        """Cosine similarity of ui against every FAQ question."""
+        return self.similarities_many([ui])[0]
+
+    def similarities_many(self, uis):
+        """Cosine similarity matrix (queries x FAQs) for a batch of questions."""
+        if self.retriever is None:
+            raise ValueError("FAQ index is empty")
+        return self.retriever.similarities_many(uis)
+
+# Seconds between checks of faq_version for edits made by other workers
+FAQ_REFRESH_INTERVAL = float(os.environ.get('FAQ_REFRESH_INTERVAL', 5))
+
+class FaqStore:
+    """Holds the live FaqIndex and rebuilds it from the faqs table when faq_version changes.
+
+    The index is built on first use (or by warm_up), so importing the app does
+    not pay for scikit-learn. Rebuilds run on a background thread and replace
+    the index with a single assignment, so requests already holding the old
+    index finish undisturbed.
+    """
+
+    def __init__(self, pairs):
+        self.default_pairs = list(pairs)
+        self.version = None
+        self._index = None
+        self._checked_at = 0.0
+        self._rebuilding = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @property
+    def index(self):
+        index = self._index
+        if index is None:
+            with self._load_lock:
+                if self._index is None:
+                    self._load()
+                index = self._index
+        return index
+
+    @property
+    def loaded(self):
+        return self._index is not None
+
+    def warm_up(self):
+        """Build the index on a background thread ahead of the first question."""
+        threading.Thread(target=lambda: self.index, daemon=True).start()
+
+    def refresh_if_stale(self, db):
+        if self._index is None:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < FAQ_REFRESH_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            row = db.execute("SELECT version FROM faq_version").fetchone()
+        except database.Error:
+            return
+        if row is not None and row[0] != self.version:
+            self.start_rebuild()
+
+    def start_rebuild(self):
+        if self._index is None:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _read_corpus(self):
+        with database.connection() as db:
+            version = db.execute("SELECT version FROM faq_version").fetchone()[0]
+            rows = db.execute("SELECT question, answer FROM faqs ORDER BY id").fetchall()
+        return version, rows
+
+    def _load(self):
+        try:
+            version, pairs = self._read_corpus()
+        except database.Error:
+            # init_db has not created the FAQ tables yet
+            version, pairs = None, self.default_pairs
+        self._index = FaqIndex(pairs)
+        self.version = version
+        self._checked_at = time.monotonic()
+
+    def _rebuild(self):
+        try:
+            version, rows = self._read_corpus()
+            self._index = FaqIndex(rows)
+            self.version = version
+            chatbot_cache.clear()
+        except Exception as e:
+            app.logger.warning("FAQ index rebuild failed: %s", e)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+faq_store = FaqStore(FAQ_PAIRS)
+
+class ResponseCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+chatbot_cache = ResponseCache(CHATBOT_CACHE_SIZE, CHATBOT_CACHE_TTL)
+
+def normalize_query(text):
+    """Lowercase, punctuation and whitespace collapsed: the cache key and what the rules match.
+
+    Rules and similarity scoring see exactly the key, so questions sharing a
+    key always get the same answer.
+    """
+    return re.sub(r'[\W_]+', ' ', text.lower()).strip()
+
+# Upper bound on questions accepted by /chatbot/batch in one request
+CHATBOT_BATCH_LIMIT = 500
+
+def _rule_answer(index, ui):
+    """Answer from the greeting/thanks/keyword rules, or None to fall through to TF-IDF."""
+    # Handle empty input
+    if not ui:
+        return EMPTY_RESPONSE
+    
+    # Handle greetings with more variety
+    if any(greeting in ui for greeting in GREETINGS):
+        return random.choice(GREETING_RESPONSES)
+    
+    # Handle thanks with warmth
+    if any(thank in ui for thank in THANKS):
+        return random.choice(THANKS_RESPONSES)
+    
+    # Handle motivation and encouragement
+    if any(word in ui for word in MOTIVATION_WORDS):
+        return MOTIVATION_RESPONSE
+    
+    # Handle compliments
+    if any(comp in ui for comp in COMPLIMENTS) and ('you' in ui or 'tutor' in ui):
+        return COMPLIMENT_RESPONSE
+    
+    # Enhanced keyword matching with context
+    match_idx = index.keyword_match(ui)
+    if match_idx is not None:
+        a = index.pairs[match_idx][1]
+        return f"{a}\n\n💡 **Need more help?** Feel free to ask follow-up questions or request examples!"
+    
+    return None
+
+def _similarity_answer(index, ui, similarities):
+    """Answer for ui given its TF-IDF similarity row (None if scoring failed)."""
+    if similarities is not None:
+        best_match_idx = similarities.argmax()
+        if similarities[best_match_idx] > 0.3:
+            answer = index.pairs[best_match_idx][1]
+            return f"{answer}\n\n🤔 **Was this helpful?** If you need clarification or have a different question, just ask!"
+    
+    # Contextual responses for common topics
+    if 'math' in ui or 'mathematics' in ui:
+        return MATH_RESPONSE
+    
+    if 'help' in ui:
+        return HELP_RESPONSE
+    
+    # Fallback with helpful suggestions
+    return random.choice(FALLBACK_RESPONSES)
+
+def _remember(key, answer):
+    if answer not in RANDOM_RESPONSES:
+        chatbot_cache.put(key, answer)
+    return answer
+
+def chatbot_answer(user_input):
+    index = faq_store.index
+    ui = normalize_query(user_input)
+    key = (index.generation, ui)
+    cached = chatbot_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    answer = _rule_answer(index, ui)
+    if answer is not None:
+        return _remember(key, answer)
+    
+    # Use TF-IDF for semantic similarity
+    try:
+        similarities = index.similarities(ui)
+    except:
+        similarities = None
+    return _remember(key, _similarity_answer(index, ui, similarities))
+
+def chatbot_answer_many(queries):
+    """Answer a list of questions, scoring all rule misses in one sparse product."""
+    index = faq_store.index
+    queries = [str(q) for q in queries]
+    uis = [normalize_query(q) for q in queries]
+    keys = [(index.generation, ui) for ui in uis]
+    answers = []
+    for key, ui in zip(keys, uis):
+        answer = chatbot_cache.get(key)
+        if answer is None:
+            answer = _rule_answer(index, ui)
+            if answer is not None:
+                _remember(key, answer)
+        answers.append(answer)
+    pending = [i for i, a in enumerate(answers) if a is None]
+    if pending:
+        try:
+            similarities = index.similarities_many([uis[i] for i in pending])
+        except:
+            similarities = [None] * len(pending)
+        for row, i in zip(similarities, pending):
+            answers[i] = _remember(keys[i], _similarity_answer(index, uis[i], row))
+    return answers
+
+# -----------------------
+# Quiz cache
+# -----------------------
+# quizzes.version is bumped whenever a quiz's questions change, so each worker's
+# cache stays correct without sharing state: a stale entry is simply never hit.
+QUIZ_CACHE_SIZE = int(os.environ.get('QUIZ_CACHE_SIZE', 256))
+QUIZ_CACHE_TTL = float(os.environ.get('QUIZ_CACHE_TTL', 3600))
+
+class QuizPayload:
+    """Pre-parsed questions of one quiz version, shared by quiz() and submit_quiz()."""
+
+    def __init__(self, version, rows):
+        import numpy as np
+        self.np = np
+        self.version = version
+        self.question_ids = [str(r['id']) for r in rows]
+        self.questions = [{
+            "id": r["id"],
+            "question": r["question"],
+            "options": json.loads(r["options"]),
+            "topic": r["topic"]
+        } for r in rows]
+        self.answers = np.array([int(r['answer_index']) for r in rows], dtype=np.int64)
+        # Topics in order of first appearance, and each question's position in that list
+        self.topics = list(dict.fromkeys(r['topic'] or 'general' for r in rows))
+        codes = {topic: i for i, topic in enumerate(self.topics)}
+        self.topic_codes = np.array([codes[r['topic'] or 'general'] for r in rows], dtype=np.int64)
+        self.topic_totals = np.bincount(self.topic_codes, minlength=len(self.topics))
+
+    def grade(self, answers):
+        """Return (correct, topic_scores) for a {question_id: chosen_index} mapping."""
+        np = self.np
+        chosen = np.array([_choice_index(answers.get(qid, -1)) for qid in self.question_ids], dtype=np.int64)
+        hits = chosen == self.answers
+        topic_right = np.bincount(self.topic_codes, weights=hits, minlength=len(self.topics))
+        topic_scores = {
+            topic: {"right": int(right), "total": int(total)}
+            for topic, right, total in zip(self.topics, topic_right, self.topic_totals)
+        }
+        return int(hits.sum()), topic_scores
+
+MAX_CLIENT_INT = 2**31 - 1  # fits an INTEGER column on both backends
+
+def _choice_index(value):
+    """A client-supplied index or id as an int; -1 unless it is a whole number from 0 to MAX_CLIENT_INT."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return -1
+    return value if 0 <= value <= MAX_CLIENT_INT else -1
+
+quiz_cache = ResponseCache(QUIZ_CACHE_SIZE, QUIZ_CACHE_TTL)
+
+def get_quiz_payload(quiz_id, version):
+    key = (quiz_id, version)
+    payload = quiz_cache.get(key)
+    if payload is None:
+        rows = query_db("SELECT * FROM questions WHERE quiz_id=? ORDER BY id", (quiz_id,))
+        payload = QuizPayload(version, rows)
+        quiz_cache.put(key, payload)
+    return payload
+
+def invalidate_quiz(quiz_id, version):
+    quiz_cache.pop((quiz_id, version))
+
+# -----------------------
+# Question banks
+# -----------------------
+# Quiz questions are written through save_questions, which diffs against the
+# stored rows so unchanged questions keep their ids (quiz pages and submitted
+# answers refer to them) and every write is one executemany per kind. Banks
+# can be imported and exported as JSON or CSV (one option_N column per option).
+QUESTION_BANK_MAX = 10000
+QUESTION_BANK_MAX_ERRORS = 20
+
+def clean_question(raw):
+    """Validate one imported question and return it normalised; raises ValueError."""
+    text = str(raw.get('question') or '').strip()
+    if not text:
+        raise ValueError("question text is empty")
+    options = raw.get('options')
+    if isinstance(options, str):
+        options = options.replace('\n', ';').split(';')
+    if not isinstance(options, list):
+        raise ValueError("options must be a list")
+    options = [str(opt).strip() for opt in options if str(opt).strip()]
+    if len(options) < 2:
+        raise ValueError("at least two options are needed")
+    try:
+        answer_index = int(raw.get('answer_index', 0))
+    except (TypeError, ValueError):
+        raise ValueError("answer_index must be a whole number")
+    if not 0 <= answer_index < len(options):
+        raise ValueError(f"answer_index {answer_index} is not one of the {len(options)} options")
+    question_id = raw.get('id')
+    try:
+        question_id = int(question_id) if question_id not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError("id must be a whole number")
+    return {'id': question_id, 'question': text, 'options': options,
+            'answer_index': answer_index, 'topic': str(raw.get('topic') or '').strip() or 'general'}
+
+def _csv_questions(text):
+    reader = csv.DictReader(io.StringIO(text))
+    option_columns = sorted((c for c in reader.fieldnames or () if re.fullmatch(r'option_\d+', c)),
+                            key=lambda c: int(c[7:]))
+    for row in reader:
+        if option_columns:
+            row['options'] = [row[c] or '' for c in option_columns]
+        yield row
+
+def parse_question_bank(filename, data):
+    """Parse and validate a whole JSON or CSV bank; returns (title, questions, errors)."""
+    try:
+        text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    except UnicodeDecodeError:
+        return None, [], ["File is not UTF-8 text"]
+    title = None
+    if filename.lower().endswith('.csv'):
+        items, label = _csv_questions(text), "Row {}"
+        start = 2  # row 1 is the header
+    else:
+        try:
+            items = json.loads(text)
+        except ValueError as e:
+            return None, [], [f"Invalid JSON: {e}"]
+        if isinstance(items, dict):
+            title = items.get('title')
+            items = items.get('questions')
+        if not isinstance(items, list):
+            return None, [], ["Expected a list of questions or an object with a 'questions' list"]
+        label, start = "Question {}", 1
+    questions, errors = [], []
+    for n, raw in enumerate(items, start):
+        try:
+            if not isinstance(raw, dict):
+                raise ValueError("expected an object")
+            questions.append(clean_question(raw))
+        except ValueError as e:
+            errors.append(f"{label.format(n)}: {e}")
+            if len(errors) >= QUESTION_BANK_MAX_ERRORS:
+                errors.append("Stopped after too many errors")
+                break
+    if not questions and not errors:
+        errors.append("The file contains no questions")
+    if len(questions) > QUESTION_BANK_MAX:
+        errors.append(f"At most {QUESTION_BANK_MAX} questions can be imported at once")
+    return title, questions, errors
+
+def questions_from_form(form):
+    """Questions from the create/edit quiz form's parallel lists, skipping incomplete ones."""
+    texts = form.getlist('questions')
+    options, answers = form.getlist('options'), form.getlist('correct_answers')
+    topics, ids = form.getlist('topics'), form.getlist('question_ids')
+    questions = []
+    for i, question in enumerate(texts):
+        if not question.strip():
+            continue
+        options_list = [opt.strip() for opt in (options[i] if i < len(options) else '').replace('\n', ';').split(';')
+                        if opt.strip()]
+        if len(options_list) < 2:
+            continue
+        questions.append({
+            'id': int(ids[i]) if i < len(ids) and ids[i].isdigit() else None,
+            'question': question,
+            'options': options_list,
+            'answer_index': int(answers[i]) if i < len(answers) and answers[i].isdigit() else 0,
+            'topic': topics[i] if i < len(topics) else 'general',
+        })
+    return questions
+
+def save_questions(db, quiz_id, questions, remove_missing=True):
+    """Write questions to a quiz, touching only rows that changed; returns (added, updated, removed).
+
+    Questions whose id belongs to the quiz update that row, others are added;
+    with remove_missing, stored questions not in the list are deleted. The
+    caller commits and bumps quizzes.version if anything changed.
+    """
+    existing = {row['id']: (row['question'], row['options'], row['answer_index'], row['topic'])
+                for row in db.execute("SELECT id, question, options, answer_index, topic FROM questions WHERE quiz_id=?",
+                                      (quiz_id,))}
+    inserts, updates, kept = [], [], set()
+    for q in questions:
+        values = (q['question'], json.dumps(q['options']), q['answer_index'], q['topic'])
+        if q['id'] in existing and q['id'] not in kept:
+            kept.add(q['id'])
+            if existing[q['id']] != values:
+                updates.append(values + (q['id'],))
+        else:
+            inserts.append((quiz_id,) + values)
+    deletes = [(qid,) for qid in existing if qid not in kept] if remove_missing else []
+    if inserts:
+        db.executemany("INSERT INTO questions (quiz_id, question, options, answer_index, topic) VALUES (?, ?, ?, ?, ?)",
+                       inserts)
+    if updates:
+        db.executemany("UPDATE questions SET question=?, options=?, answer_index=?, topic=? WHERE id=?", updates)
+    if deletes:
+        db.executemany("DELETE FROM questions WHERE id=?", deletes)
+    return len(inserts), len(updates), len(deletes)
+
+def export_question_bank(quiz, fmt):
+    """Return a download Response with a quiz's questions as JSON or CSV."""
+    rows = query_db("SELECT id, question, options, answer_index, topic FROM questions WHERE quiz_id=? ORDER BY id",
+                    (quiz['id'],))
+    questions = [{'id': r['id'], 'question': r['question'], 'options': json.loads(r['options']),
+                  'answer_index': r['answer_index'], 'topic': r['topic'] or 'general'} for r in rows]
+    filename = f"quiz-{quiz['id']}.{fmt}"
+    if fmt == 'csv':
+        out = io.StringIO()
+        width = max((len(q['options']) for q in questions), default=2)
+        writer = csv.writer(out)
+        writer.writerow(['id', 'question', 'topic', 'answer_index'] + [f'option_{i}' for i in range(1, width + 1)])
+        for q in questions:
+            writer.writerow([q['id'], q['question'], q['topic'], q['answer_index']] + q['options'])
+        body, mimetype = out.getvalue(), 'text/csv'
+    else:
+        body = json.dumps({'quiz_id': quiz['id'], 'title': quiz['title'], 'questions': questions},
+                          ensure_ascii=False, indent=1)
+        mimetype = 'application/json'
+    return Response(body, mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+# -----------------------
+# Live messaging
+# -----------------------
+MESSAGE_POLL_INTERVAL = float(os.environ.get('MESSAGE_POLL_INTERVAL', 1.0))
+MESSAGE_QUEUE_SIZE = 1000
+MESSAGE_BATCH_SIZE = 200
+# PostgreSQL hands out ids when a row is inserted, not when it commits, so a
+# message can become visible after a higher id has been read. Catch-up reads
+# replay this many ids behind the client's last one (clients skip ids they
+# have), and the hub re-reads ids it skipped over for MESSAGE_REORDER_GRACE seconds.
+MESSAGE_REPLAY_IDS = 50
+MESSAGE_REORDER_GRACE = 10
+SSE_KEEPALIVE = 15
+# Each open stream holds a server thread, so only this many per worker; the
+# rest get a 503 and the chat page polls /messages/<id>/since/<last_id> instead
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', max(1, int(os.environ.get('GUNICORN_THREADS', 16)) // 2)))
+
+MESSAGE_SELECT = """
+    SELECT m.id, m.sender_id, m.receiver_id, m.message, m.sent_at, m.is_read, u.name AS sender_name
+    FROM messages m JOIN users u ON m.sender_id = u.id
+"""
+
+def message_json(row):
+    return {key: row[key] for key in ('id', 'sender_id', 'receiver_id', 'message', 'sent_at', 'is_read', 'sender_name')}
+
+class MessageSubscription:
+    """One open /messages/stream connection."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = queue.Queue(MESSAGE_QUEUE_SIZE)
+        self.overflowed = False
+
+    def push(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # The client is not keeping up: end its stream so it reconnects with Last-Event-ID
+            self.overflowed = True
+
+class MessageHub:
+    """Fans new messages out to this worker's open /messages/stream connections.
+
+    A single background thread per worker reads messages past its watermark,
+    however many clients are listening, and stops when the last one leaves.
+    send_message wakes it straight away; messages saved by other workers are
+    picked up within MESSAGE_POLL_INTERVAL.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_id = 0
+        self._gaps = {}  # ids below last_id not seen yet -> when they were skipped
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def subscribe(self, user_id):
+        sub = MessageSubscription(user_id)
+        with self._lock:
+            if self._thread is None:
+                with database.connection() as db:
+                    self.last_id = db.execute("SELECT COALESCE(MAX(id), 0) AS id FROM messages").fetchone()['id']
+                self._gaps = {}
+                self._thread = threading.Thread(target=self._run, name='message-hub', daemon=True)
+                self._thread.start()
+            self._subscribers.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.user_id]
+
+    def notify(self):
+        self._wake.set()
+
+    def listeners(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                self._dispatch()
+            except Exception:
+                app.logger.exception("Message hub poll failed")
+
+    def _dispatch(self):
+        # A skipped id is a message still being committed, or an insert that was rolled back
+        cutoff = time.monotonic() - MESSAGE_REORDER_GRACE
+        self._gaps = {gap: since for gap, since in self._gaps.items() if since > cutoff}
+        if self._gaps:
+            marks = ','.join('?' * len(self._gaps))
+            with database.connection() as db:
+                self._publish(db.execute(MESSAGE_SELECT + f" WHERE m.id IN ({marks}) ORDER BY m.id",
+                                         list(self._gaps)).fetchall())
+        while True:
+            with database.connection() as db:
+                rows = db.execute(MESSAGE_SELECT + " WHERE m.id > ? ORDER BY m.id LIMIT ?",
+                                  (self.last_id, MESSAGE_BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            self._publish(rows)
+            if len(rows) < MESSAGE_BATCH_SIZE:
+                return
+
+    def _publish(self, rows):
+        now = time.monotonic()
+        with self._lock:
+            for row in rows:
+                message = message_json(row)
+                for user_id in {message['sender_id'], message['receiver_id']}:
+                    for sub in self._subscribers.get(user_id, ()):
+                        sub.push(message)
+                self._gaps.pop(row['id'], None)
+                if row['id'] > self.last_id:
+                    for gap in range(max(self.last_id + 1, row['id'] - MESSAGE_BATCH_SIZE), row['id']):
+                        self._gaps[gap] = now
+                    self.last_id = row['id']
+
+message_hub = MessageHub(MESSAGE_POLL_INTERVAL)
+stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+def latest_message():
+    return query_db("SELECT COALESCE(MAX(id), 0) AS id FROM messages", one=True)['id']
+
+def sse_event(message):
+    return f"id: {message['id']}\ndata: {json.dumps(message)}\n\n"
+
+# -----------------------
+# Math game scoring
+# -----------------------
+# Seconds between folds of journaled math-game answers into study_streaks; 0 writes every answer straight through
+SCORE_FLUSH_INTERVAL = float(os.environ.get('SCORE_FLUSH_INTERVAL', 2.0))
+POINTS_PER_ANSWER = 10
+
+# Adds points and streak increments to a student's row in one statement. With
+# the reset flag set the streak restarts from the increments instead.
+STREAK_UPSERT = """
+    INSERT INTO study_streaks (user_id, current_streak, total_points, last_activity) VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET
+        current_streak = CASE WHEN ? THEN excluded.current_streak
+                              ELSE study_streaks.current_streak + excluded.current_streak END,
+        total_points = study_streaks.total_points + excluded.total_points,
+        last_activity = excluded.last_activity
+    RETURNING current_streak, total_points
+"""
+
+PERIOD_POINTS_UPSERT = """
+    INSERT INTO student_points (period, user_id, points) VALUES (?, ?, ?)
+    ON CONFLICT (period, user_id) DO UPDATE SET points = student_points.points + excluded.points
+"""
+
+def period_keys(day):
+    """student_points periods a day belongs to, by leaderboard window."""
+    year, week, _ = day.isocalendar()
+    return {'week': f"week:{year}-W{week:02d}", 'month': f"month:{day:%Y-%m}"}
+
+def apply_score(db, user_id, streak_delta, points_delta, reset):
+    """Fold a score delta into study_streaks and student_points; returns the new (streak, points) (caller commits)."""
+    now = datetime.now()
+    row = db.execute(STREAK_UPSERT, (user_id, streak_delta, points_delta, now.isoformat(), reset)).fetchone()
+    if points_delta:
+        db.executemany(PERIOD_POINTS_UPSERT,
+                       [(period, user_id, points_delta) for period in period_keys(now.date()).values()])
+    return row['current_streak'], row['total_points']
+
+# Reads a student's stored totals and their answers not yet folded in, in one
+# statement so a concurrent fold cannot make an answer count twice or not at all
+SCORE_VIEW = """
+    SELECT 0 AS id, NULL AS correct, current_streak AS streak, total_points AS points
+    FROM study_streaks WHERE user_id = ?
+    UNION ALL
+    SELECT id, correct, NULL, NULL FROM score_events WHERE user_id = ?
+    ORDER BY id
+"""
+
+class ScoreBuffer:
+    """Write-behind folding of math-game answers into study_streaks, one thread per worker.
+
+    Each answer is appended to score_events and committed before it is
+    acknowledged, so a crash loses nothing. Every `interval` seconds the
+    journal is folded into study_streaks: the events are deleted and applied
+    in one transaction, so each is applied exactly once by whichever worker
+    claims it, including answers left behind by a worker that died. Appends
+    never touch the contended study_streaks rows.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._recorded = False
+        self._pid = os.getpid()
+
+    def record(self, user_id, correct):
+        """Journal one answer; returns the student's (streak, points) including answers not yet folded."""
+        db = get_db()
+        db.execute("INSERT INTO score_events (user_id, correct, created_at) VALUES (?, ?, ?)",
+                   (user_id, int(correct), datetime.now().isoformat()))
+        db.commit()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._thread, self._pid = None, os.getpid()
+            self._recorded = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='score-flush', daemon=True)
+                self._thread.start()
+        streak = points = 0
+        for row in db.execute(SCORE_VIEW, (user_id, user_id)).fetchall():
+            if row['correct'] is None:
+                streak, points = row['streak'], row['points']
+            elif row['correct']:
+                streak, points = streak + 1, points + POINTS_PER_ANSWER
+            else:
+                streak = 0
+        return streak, points
+
+    def flush(self, user_id=None):
+        """Fold journaled answers (all students, or just user_id) into study_streaks.
+
+        Returns how many were folded, or None if the fold failed (the answers
+        then stay in score_events for the next one).
+        """
+        try:
+            with database.connection() as db:
+                # Folds run one at a time, so a student's answers are applied in order
+                database.lock(db, SCORE_FOLD_LOCK_ID)
+                where, args = (" WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+                events = db.execute(f"DELETE FROM score_events{where} RETURNING id, user_id, correct",
+                                    args).fetchall()
+                pending = {}
+                for event in sorted(events, key=lambda e: e['id']):
+                    streak, points, reset = pending.get(event['user_id'], (0, 0, False))
+                    if event['correct']:
+                        streak, points = streak + 1, points + POINTS_PER_ANSWER
+                    else:
+                        streak, reset = 0, True
+                    pending[event['user_id']] = (streak, points, reset)
+                for uid, (streak, points, reset) in pending.items():
+                    apply_score(db, uid, streak, points, reset)
+                db.commit()
+        except Exception:
+            app.logger.exception("Score flush failed; the answers stay journaled for the next one")
+            return None
+        return len(events)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                self._recorded = False
+            folded = self.flush()
+            with self._lock:
+                if folded == 0 and not self._recorded:
+                    self._thread = None
+                    return
+
+score_buffer = ScoreBuffer(SCORE_FLUSH_INTERVAL)
+atexit.register(score_buffer.flush)
+
+# -----------------------
+# Quiz submissions
+# -----------------------
+# submit_quiz stores the answers as a 'pending' quiz_submissions row and replies
+# with the submission id, so an acknowledged submission survives a crash. A
+# thread per worker grades the pending rows every SUBMISSION_FLUSH_INTERVAL
+# seconds, one transaction per batch (quiz_submissions, attempts,
+# topic_mastery). The id is derived from the student and the client's
+# idempotency key, so a retried submit maps to the same row and is only
+# recorded once, even when the retry lands on another worker.
+SUBMISSION_FLUSH_INTERVAL = float(os.environ.get('SUBMISSION_FLUSH_INTERVAL', 0.2))  # 0 grades inside the request
+SUBMISSION_BATCH_SIZE = 500
+SUBMISSION_RESULT_TTL = 120          # seconds a worker keeps results it saved, for polls
+SUBMISSION_RETENTION = timedelta(days=1)
+SUBMISSION_WAIT_MAX = 10             # longest ?wait= a result poll may hold a thread
+SUBMISSION_ORPHAN_AGE = 30           # seconds before any worker grades a pending row left by another one
+
+def submission_id_for(student_id, idempotency_key):
+    return hashlib.sha256(f"{student_id}:{idempotency_key}".encode()).hexdigest()[:32]
+
+def submission_recommendations(topic_scores):
+    recs = []
+    for t, vals in topic_scores.items():
+        pct = (vals['right']/vals['total'])*100 if vals['total'] > 0 else 0.0
+        if pct < WEAK_TOPIC_PCT:
+            recs.append({"topic": t, "score_pct": round(pct, 2)})
+    return recs
+
+def store_submission(db, submission):
+    """Save a submission as pending unless a retry already did (caller commits)."""
+    db.execute("""
+        INSERT INTO quiz_submissions (id, student_id, student_name, quiz_id, answers, status, created_at)
+        VALUES (?, ?, ?, ?, ?, 'pending', ?) ON CONFLICT (id) DO NOTHING
+    """, (submission['id'], submission['student_id'], submission['student_name'], submission['quiz_id'],
+          json.dumps(submission['answers']), submission['submitted_at']))
+
+def stored_submission(db, submission_id):
+    """(student_id, result) of a saved submission, with result None while it is pending; None if unknown."""
+    row = db.execute("SELECT student_id, result FROM quiz_submissions WHERE id=?", (submission_id,)).fetchone()
+    if row is None:
+        return None
+    return row['student_id'], json.loads(row['result']) if row['result'] else None
+
+def failed_submission(error):
+    return {"status": "failed", "error": error}
+
+def grade_submissions(db, submission_ids):
+    """Grade the given submissions that are still pending; returns {id: result} for those graded here (caller commits).
+
+    A submission that cannot be graded gets a 'failed' result instead of holding up the rest.
+    """
+    if not submission_ids:
+        return {}
+    marks = ','.join('?' * len(submission_ids))
+    rows = db.execute(f"SELECT * FROM quiz_submissions WHERE id IN ({marks}) AND status='pending'",
+                      list(submission_ids)).fetchall()
+    quiz_ids = sorted({r['quiz_id'] for r in rows})
+    versions = {}
+    if quiz_ids:
+        marks = ','.join('?' * len(quiz_ids))
+        versions = {r['id']: r['version']
+                    for r in db.execute(f"SELECT id, version FROM quizzes WHERE id IN ({marks})", quiz_ids)}
+    now = datetime.now().isoformat()
+    results, attempts, mastery = {}, [], []
+    for row in rows:
+        correct, topic_scores, total = 0, {}, 0
+        try:
+            if row['quiz_id'] in versions:
+                payload = get_quiz_payload(row['quiz_id'], versions[row['quiz_id']])
+                correct, topic_scores = payload.grade(json.loads(row['answers']))
+                total = len(payload.question_ids)
+        except Exception:
+            app.logger.exception("Grading quiz submission %s failed", row['id'])
+            result = failed_submission("This submission could not be graded")
+        else:
+            score = round((correct/total)*100, 2) if total > 0 else 0.0
+            result = {"status": "graded", "score": score, "recommendations": submission_recommendations(topic_scores)}
+        # Another worker may have graded it meanwhile; only the one whose update matches records the attempt
+        claimed = db.execute("""
+            UPDATE quiz_submissions SET status=?, result=?, graded_at=? WHERE id=? AND status='pending' RETURNING id
+        """, (result['status'], json.dumps(result), now, row['id'])).fetchone()
+        if claimed is None:
+            continue
+        results[row['id']] = result
+        if result['status'] == 'graded':
+            attempts.append((row['student_name'], row['quiz_id'], result['score'], json.dumps(topic_scores),
+                             row['created_at']))
+            mastery.append((row['student_id'], topic_scores, row['created_at']))
+    if attempts:
+        db.executemany("INSERT INTO attempts (student_name,quiz_id,score,detail,taken_at) VALUES (?,?,?,?,?)", attempts)
+    for student_id, topic_scores, submitted_at in mastery:
+        record_topic_mastery(db, student_id, topic_scores, submitted_at)
+    return results
+
+class SubmissionQueue:
+    """Per-worker list of pending submissions to grade, in batches.
+
+    The rows are already saved, so this only decides who grades them and
+    when: a batch that fails is retried one submission at a time, and a
+    submission that still fails is marked failed (or, if even that fails,
+    left for the orphan sweep) so it cannot hold up the queue. Results stay
+    in memory for a while so polls that reach this worker do not need the
+    database.
+    """
+
+    def __init__(self, interval, batch_size, result_ttl):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.result_ttl = result_ttl
+        self._pending = OrderedDict()  # submission id -> student id
+        self._results = {}
+        self._lock = threading.Lock()
+        self._saved = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = os.getpid()
+        self._pruned_at = 0.0
+        self._swept_at = 0.0
+
+    def submit(self, submission_id, student_id):
+        """Queue a stored submission for grading unless this worker already has it."""
+        with self._lock:
+            self._check_fork()
+            if submission_id not in self._pending and submission_id not in self._results:
+                self._pending[submission_id] = student_id
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='submission-flush', daemon=True)
+                self._thread.start()
+
+    def is_pending(self, submission_id):
+        with self._lock:
+            return submission_id in self._pending
+
+    def wait(self, submission_id, timeout):
+        """(student_id, result) of a submission this worker graded, waiting up to timeout if it is still queued here."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while submission_id in self._pending and time.monotonic() < deadline:
+                self._saved.wait(deadline - time.monotonic())
+            entry = self._results.get(submission_id)
+            return entry[1:] if entry else None
+
+    def flush(self):
+        """Grade everything queued, one transaction per batch."""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    self._check_fork()
+                    batch = list(itertools.islice(self._pending.items(), self.batch_size))
+                if not batch:
+                    return
+                try:
+                    results = self._grade([submission_id for submission_id, _ in batch])
+                except Exception:
+                    app.logger.exception("Grading %d quiz submissions failed; grading them one at a time", len(batch))
+                    results = {}
+                    for submission_id, _ in batch:
+                        results.update(self._grade_alone(submission_id))
+                self._done(batch, results)
+
+    def _grade(self, submission_ids):
+        with app.app_context():
+            db = get_db()
+            results = grade_submissions(db, submission_ids)
+            db.commit()
+            return results
+
+    def _grade_alone(self, submission_id):
+        try:
+            return self._grade([submission_id])
+        except Exception:
+            app.logger.exception("Grading quiz submission %s failed", submission_id)
+        result = failed_submission("This submission could not be graded")
+        try:
+            with database.connection() as db:
+                marked = db.execute("""
+                    UPDATE quiz_submissions SET status='failed', result=?, graded_at=?
+                    WHERE id=? AND status='pending' RETURNING id
+                """, (json.dumps(result), datetime.now().isoformat(), submission_id)).fetchone()
+                db.commit()
+            return {submission_id: result} if marked else {}
+        except Exception:
+            app.logger.exception("Marking quiz submission %s failed did not work; leaving it for the sweep",
+                                 submission_id)
+            return {}
+
+    def _done(self, batch, results):
+        expires = time.monotonic() + self.result_ttl
+        with self._lock:
+            for submission_id, student_id in batch:
+                if submission_id in results:
+                    self._results[submission_id] = (expires, student_id, results[submission_id])
+                self._pending.pop(submission_id, None)
+            self._saved.notify_all()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._pending, self._results, self._thread, self._pid = OrderedDict(), {}, None, os.getpid()
+
+    def _sweep(self):
+        """Queue pending rows no worker has graded for a while, e.g. after a worker was killed."""
+        now = time.monotonic()
+        if now - self._swept_at < SUBMISSION_ORPHAN_AGE:
+            return
+        self._swept_at = now
+        cutoff = (datetime.now() - timedelta(seconds=SUBMISSION_ORPHAN_AGE)).isoformat()
+        try:
+            with database.connection() as db:
+                rows = db.execute("""
+                    SELECT id, student_id FROM quiz_submissions WHERE status='pending' AND created_at < ?
+                    ORDER BY created_at LIMIT ?
+                """, (cutoff, self.batch_size)).fetchall()
+        except Exception:
+            app.logger.exception("Looking for orphaned quiz submissions failed")
+            return
+        for row in rows:
+            self.submit(row['id'], row['student_id'])
+
+    def _prune(self):
+        now = time.monotonic()
+        with self._lock:
+            for submission_id in [k for k, (expires, _, _) in self._results.items() if expires < now]:
+                del self._results[submission_id]
+        if now - self._pruned_at > 3600:
+            self._pruned_at = now
+            cutoff = (datetime.now() - SUBMISSION_RETENTION).isoformat()
+            try:
+                with database.connection() as db:
+                    db.execute("DELETE FROM quiz_submissions WHERE created_at < ? AND status <> 'pending'", (cutoff,))
+                    db.commit()
+            except Exception:
+                app.logger.exception("Pruning old quiz submissions failed")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._sweep()
+                self.flush()
+                self._prune()
+            except Exception:
+                app.logger.exception("Quiz submission flush failed")
+            with self._lock:
+                if not self._pending and not self._results:
+                    self._thread = None
+                    return
+
+submission_queue = SubmissionQueue(SUBMISSION_FLUSH_INTERVAL, SUBMISSION_BATCH_SIZE, SUBMISSION_RESULT_TTL)
+atexit.register(submission_queue.flush)
+
+# -----------------------
+# Leaderboards
+# -----------------------
+LEADERBOARD_WINDOWS = ('all', 'week', 'month')
+LEADERBOARD_TOP = 10
+LEADERBOARD_NEIGHBOURS = 2
+LEADERBOARD_LOOKBACK = 5              # seconds of study_streaks changes re-read, for transactions that committed late
+LEADERBOARD_REBUILD_INTERVAL = 600    # seconds between full rebuilds of a board, as a safety net
+
+class Leaderboard:
+    """Students of one window kept sorted by (points, streak) for bisect lookups."""
+
+    def __init__(self, rows):
+        self._students = {}
+        self._lock = threading.Lock()
+        keys = []
+        for row in rows:
+            student = {'user_id': row['user_id'], 'name': row['name'], 'points': row['points'], 'streak': row['streak']}
+            self._students[student['user_id']] = student
+            keys.append(self._key(student))
+        keys.sort()
+        self._keys = keys
+
+    @staticmethod
+    def _key(student):
+        return (-student['points'], -student['streak'], student['user_id'])
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id, name, points, streak):
+        """Add a student or move them to their new place."""
+        student = {'user_id': user_id, 'name': name, 'points': points, 'streak': streak}
+        with self._lock:
+            old = self._students.get(user_id)
+            if old == student:
+                return
+            if old is not None:
+                del self._keys[bisect.bisect_left(self._keys, self._key(old))]
+            self._students[user_id] = student
+            bisect.insort(self._keys, self._key(student))
+
+    def rank(self, user_id):
+        """1-based position of a student, or None if they are not on the board."""
+        with self._lock:
+            return self._rank(user_id)
+
+    def _rank(self, user_id):
+        student = self._students.get(user_id)
+        if student is None:
+            return None
+        return bisect.bisect_left(self._keys, self._key(student)) + 1
+
+    def top(self, k):
+        with self._lock:
+            return self._slice(0, k)
+
+    def around(self, user_id, radius):
+        """The student plus up to `radius` places either side of them."""
+        with self._lock:
+            rank = self._rank(user_id)
+            if rank is None:
+                return []
+            return self._slice(max(rank - 1 - radius, 0), rank + radius)
+
+    def _slice(self, start, stop):
+        return [dict(self._students[key[2]], rank=start + i + 1) for i, key in enumerate(self._keys[start:stop])]
+
+class LeaderboardService:
+    """Per-worker ranked boards, loaded once and then kept current incrementally.
+
+    Every score change stamps study_streaks.last_activity (indexed), so a view
+    only reads the rows stamped since the previous one, plus the last
+    LEADERBOARD_LOOKBACK seconds for other workers' late commits, and moves
+    those students with bisect. New students are found by users.id. A board
+    is loaded from scratch only when it is missing, when its week or month
+    rolls over, or after LEADERBOARD_REBUILD_INTERVAL.
+    """
+
+    def __init__(self):
+        self._boards = {}   # window -> (period, board, loaded at)
+        self._activity = None
+        self._last_user = 0
+        self._lock = threading.Lock()
+
+    def board(self, window='all'):
+        period = period_keys(date.today())[window] if window != 'all' else None
+        with self._lock:
+            self._catch_up()
+            cached = self._boards.get(window)
+            if cached is not None and cached[0] == period and time.monotonic() - cached[2] < LEADERBOARD_REBUILD_INTERVAL:
+                return cached[1]
+            # Loaded after _catch_up moved the watermarks, so later changes are still picked up
+            board = Leaderboard(self._load(period))
+            self._boards[window] = (period, board, time.monotonic())
+            return board
+
+    def _catch_up(self):
+        if not self._boards:
+            row = query_db("""
+                SELECT (SELECT MAX(last_activity) FROM study_streaks) AS activity, (SELECT MAX(id) FROM users) AS users
+            """, one=True)
+            self._activity, self._last_user = row['activity'] or '', row['users'] or 0
+            return
+        since = self._activity
+        if since:
+            since = (datetime.fromisoformat(since) - timedelta(seconds=LEADERBOARD_LOOKBACK)).isoformat()
+        new_users = query_db("SELECT id, name, user_type FROM users WHERE id > ? ORDER BY id", (self._last_user,))
+        if new_users:
+            self._last_user = new_users[-1]['id']
+        for window, (period, board, _) in self._boards.items():
+            for user in new_users:
+                if user['user_type'] == 'student' and board.rank(user['id']) is None:
+                    board.update(user['id'], user['name'], 0, 0)
+            for row in self._changed(period, since):
+                board.update(row['user_id'], row['name'], row['points'], row['streak'])
+                self._activity = max(self._activity, row['last_activity'])
+
+    def _changed(self, period, since):
+        if period is None:
+            return query_db("""
+                SELECT s.user_id, u.name, s.total_points AS points, s.current_streak AS streak, s.last_activity
+                FROM study_streaks s JOIN users u ON u.id = s.user_id
+                WHERE s.last_activity >= ? AND u.user_type = 'student'
+            """, (since,))
+        return query_db("""
+            SELECT s.user_id, u.name, COALESCE(p.points, 0) AS points, s.current_streak AS streak, s.last_activity
+            FROM study_streaks s JOIN users u ON u.id = s.user_id
+            LEFT JOIN student_points p ON p.user_id = s.user_id AND p.period = ?
+            WHERE s.last_activity >= ? AND u.user_type = 'student'
+        """, (period, since))
+
+    def _load(self, period):
+        if period is None:
+            return query_db("""
+                SELECT u.id AS user_id, u.name, COALESCE(s.total_points, 0) AS points, COALESCE(s.current_streak, 0) AS streak
+                FROM users u LEFT JOIN study_streaks s ON s.user_id = u.id
+                WHERE u.user_type = 'student'
+            """)
+        return query_db("""
+            SELECT u.id AS user_id, u.name, COALESCE(p.points, 0) AS points, COALESCE(s.current_streak, 0) AS streak
+            FROM users u
+            LEFT JOIN student_points p ON p.user_id = u.id AND p.period = ?
+            LEFT JOIN study_streaks s ON s.user_id = u.id
+            WHERE u.user_type = 'student'
+        """, (period,))
+
+leaderboards = LeaderboardService()
+
+# -----------------------
+# Video transcoding
+# -----------------------
+# Uploaded lessons are queued in transcode_jobs and converted by a separate
+# worker process (`flask --app app transcode-worker`) into low/medium/high MP4
+# renditions, HLS playlists and a poster. Until a job finishes the lesson
+# keeps playing the original upload (video_status 'processing').
+TRANSCODER = os.environ.get('TRANSCODER', 'ffmpeg')
+TRANSCODE_POLL_INTERVAL = float(os.environ.get('TRANSCODE_POLL_INTERVAL', 5))
+TRANSCODE_TIMEOUT = int(os.environ.get('TRANSCODE_TIMEOUT', 3600))   # seconds one ffmpeg run may take
+# A running job's worker renews locked_at every TRANSCODE_HEARTBEAT seconds;
+# a job not renewed for TRANSCODE_LEASE seconds lost its worker and is requeued
+TRANSCODE_HEARTBEAT = 30
+TRANSCODE_LEASE = 180
+TRANSCODE_MAX_ATTEMPTS = 3
+RENDITIONS_FOLDER = 'renditions'  # under UPLOAD_FOLDER, one directory per job
+# (name, height, video kbit/s, audio kbit/s)
+VIDEO_RENDITIONS = (
+    ('low', 360, 400, 64),
+    ('medium', 540, 1000, 96),
+    ('high', 720, 2500, 128),
+)
+HLS_SEGMENT_SECONDS = 6
+
+class Transcoder(ABC):
+    """Encodes one uploaded video into rendition files inside a directory."""
+
+    def source_height(self, source):
+        """Height of the source video, or None if unknown (all renditions are made)."""
+        return None
+
+    @abstractmethod
+    def encode(self, source, rendition, out_dir):
+        """Write <name>.mp4 and <name>.m3u8 (plus its segments) for one rendition."""
+
+    @abstractmethod
+    def poster(self, source, out_dir):
+        """Write a thumbnail into out_dir and return its file name."""
+
+class FfmpegTranscoder(Transcoder):
+    """H.264/AAC renditions and HLS segments made with the ffmpeg binary."""
+
+    def __init__(self):
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.ffprobe = shutil.which('ffprobe')
+        if self.ffmpeg is None:
+            raise RuntimeError("ffmpeg was not found on PATH")
+
+    def run(self, *args):
+        subprocess.run([self.ffmpeg, '-nostdin', '-y', '-v', 'error', *args],
+                       check=True, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+
+    def source_height(self, source):
+        if self.ffprobe is None:
+            return None
+        out = subprocess.run([self.ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                              '-show_entries', 'stream=height', '-of', 'csv=p=0', source],
+                             capture_output=True, text=True, timeout=60)
+        return int(out.stdout.strip()) if out.stdout.strip().isdigit() else None
+
+    def encode(self, source, rendition, out_dir):
+        name, height, video_kbps, audio_kbps = rendition
+        mp4 = os.path.join(out_dir, name + '.mp4')
+        # Keyframes every segment so the HLS copy below can cut on segment boundaries
+        self.run('-i', source, '-vf', f'scale=-2:{height}',
+                 '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+                 '-b:v', f'{video_kbps}k', '-maxrate', f'{video_kbps * 107 // 100}k', '-bufsize', f'{video_kbps * 2}k',
+                 '-force_key_frames', f'expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})',
+                 '-c:a', 'aac', '-b:a', f'{audio_kbps}k', '-ac', '2',
+                 '-movflags', '+faststart', mp4)
+        self.run('-i', mp4, '-c', 'copy', '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS),
+                 '-hls_playlist_type', 'vod', '-hls_segment_filename', os.path.join(out_dir, name + '_%03d.ts'),
+                 os.path.join(out_dir, name + '.m3u8'))
+
+    def poster(self, source, out_dir):
+        self.run('-i', source, '-vf', 'thumbnail,scale=-2:360', '-frames:v', '1',
+                 os.path.join(out_dir, 'poster.jpg'))
+        return 'poster.jpg'
+
+class StubTranscoder(Transcoder):
+    """Copies the upload as every rendition without re-encoding (for tests and machines without ffmpeg)."""
+
+    POSTER = bytes.fromhex('47494638396101000100800000ffffff00000021f90401000000002c00000000010001000002024401003b')
+
+    def encode(self, source, rendition, out_dir):
+        name = rendition[0]
+        shutil.copyfile(source, os.path.join(out_dir, name + '.mp4'))
+        with open(os.path.join(out_dir, name + '.m3u8'), 'w') as f:
+            f.write(f"#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:{HLS_SEGMENT_SECONDS}\n"
+                    f"#EXT-X-PLAYLIST-TYPE:VOD\n#EXTINF:{HLS_SEGMENT_SECONDS}.0,\n{name}.mp4\n#EXT-X-ENDLIST\n")
+
+    def poster(self, source, out_dir):
+        with open(os.path.join(out_dir, 'poster.gif'), 'wb') as f:
+            f.write(self.POSTER)
+        return 'poster.gif'
+
+TRANSCODERS = {
+    'ffmpeg': FfmpegTranscoder,
+    'stub': StubTranscoder,
+}
+
+def make_transcoder(name=None):
+    name = name or TRANSCODER
+    if name not in TRANSCODERS:
+        raise ValueError(f"Unknown TRANSCODER {name!r}; expected one of {', '.join(TRANSCODERS)}")
+    return TRANSCODERS[name]()
+
+def transcode_video(transcoder, source, out_dir):
+    """Make every rendition that fits the source plus a master playlist and poster; returns the manifest."""
+    height = transcoder.source_height(source)
+    renditions = [r for r in VIDEO_RENDITIONS if height is None or r[1] <= height] or [VIDEO_RENDITIONS[0]]
+    master = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for rendition in renditions:
+        transcoder.encode(source, rendition, out_dir)
+        name, _, video_kbps, audio_kbps = rendition
+        master += [f'#EXT-X-STREAM-INF:BANDWIDTH={(video_kbps + audio_kbps) * 1000}', name + '.m3u8']
+    with open(os.path.join(out_dir, 'master.m3u8'), 'w') as f:
+        f.write('\n'.join(master) + '\n')
+    return {
+        'hls': 'master.m3u8',
+        'poster': transcoder.poster(source, out_dir),
+        'sources': [{'name': name, 'height': height, 'file': name + '.mp4'}
+                    for name, height, _, _ in renditions],
+    }
+
+def uploaded_video_filename(video_url):
+    """File name under UPLOAD_FOLDER for a lesson video URL, or None for external videos."""
+    prefix = '/uploads/videos/'
+    if video_url and video_url.startswith(prefix) and '/' not in video_url[len(prefix):]:
+        return video_url[len(prefix):]
+    return None
+
+def queue_transcode(db, lesson_id, video_url):
+    """Point a lesson at a new video: queue a job for uploads and drop older renditions."""
+    filename = uploaded_video_filename(video_url)
+    db.execute("UPDATE transcode_jobs SET status='cancelled' WHERE lesson_id=? AND status IN ('queued', 'running')",
+               (lesson_id,))
+    db.execute("UPDATE lessons SET video_status=?, renditions=NULL WHERE id=?",
+               ('processing' if filename else 'ready', lesson_id))
+    if filename:
+        db.execute("INSERT INTO transcode_jobs (lesson_id, source, created_at) VALUES (?,?,?)",
+                   (lesson_id, filename, datetime.now().isoformat()))
+
+def claim_transcode_job(db):
+    """Take the oldest queued job (requeueing ones whose worker died), or return None.
+
+    Each claim bumps attempts, so (id, attempts) identifies the claim: updates
+    made for an older claim of the same job match no row.
+    """
+    now = datetime.now()
+    db.execute("UPDATE transcode_jobs SET status='queued' WHERE status='running' AND locked_at < ?",
+               ((now - timedelta(seconds=TRANSCODE_LEASE)).isoformat(),))
+    # The status check makes a job lost to a concurrent worker come back empty
+    job = db.execute("""
+        UPDATE transcode_jobs SET status='running', attempts=attempts+1, locked_at=?
+        WHERE id = (SELECT MIN(id) FROM transcode_jobs WHERE status='queued') AND status='queued'
+        RETURNING *
+    """, (now.isoformat(),)).fetchone()
     db.commit()
-    db.close()
+    return job
 
-@app.teardown_appcontext
-def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+def renew_transcode_job(db, job):
+    """Extend this claim's lease; returns False if the job was requeued, reclaimed or cancelled."""
+    renewed = db.execute("""
+        UPDATE transcode_jobs SET locked_at=? WHERE id=? AND attempts=? AND status='running' RETURNING id
+    """, (datetime.now().isoformat(), job['id'], job['attempts'])).fetchone()
+    db.commit()
+    return renewed is not None
 
-# -----------------------
-# Simple chatbot (FAQ-based + TF-IDF similarity)
-# -----------------------
-FAQ_PAIRS = [
-    # Platform Usage
-    ("How do I join live class?", "Click on any lesson from the Student Portal, then watch the video lesson. Teachers upload video content for you to learn at your own pace."),
-    ("How to attempt quiz?", "Go to Student Portal → Select a lesson → Click 'Start Learning' → After watching the video, click 'Take Quiz' to test your knowledge."),
-    ("How are recommendations generated?", "Our AI analyzes your quiz performance by topic. If you score below 70% in any topic, we recommend focusing on those areas for improvement."),
-    ("I forgot my password", "This platform doesn't require passwords! Just enter your name when taking quizzes to track your progress."),
-    ("How do I track my progress?", "Visit the Results page to see all your quiz attempts, scores, and performance analytics. You can access it from the main navigation."),
-    ("Can I retake a quiz?", "Yes! You can retake any quiz multiple times to improve your understanding and score."),
-    
-    # Mathematics - Fractions
-    ("What is a fraction?", "A fraction represents a part of a whole. It has two parts: numerator (top number) and denominator (bottom number). For example, in 3/4, 3 is the numerator and 4 is the denominator."),
-    ("How to add fractions?", "To add fractions: 1) Make denominators the same, 2) Add numerators, 3) Keep the denominator. Example: 1/4 + 1/4 = 2/4 = 1/2"),
-    ("Convert 3/4 to decimal", "To convert 3/4 to decimal, divide 3 by 4: 3 ÷ 4 = 0.75"),
-    ("What is equivalent fraction?", "Equivalent fractions represent the same value but look different. Example: 1/2 = 2/4 = 3/6. Multiply or divide both numerator and denominator by the same number."),
-    ("How to subtract fractions?", "Similar to addition: 1) Make denominators the same, 2) Subtract numerators, 3) Keep the denominator. Example: 3/4 - 1/4 = 2/4 = 1/2"),
-    
-    # General Study Tips
-    ("How to study effectively?", "1) Watch video lessons completely, 2) Take notes of key points, 3) Practice with quizzes, 4) Review topics you scored low on, 5) Ask me questions when confused!"),
-    ("I'm struggling with math", "Don't worry! Math takes practice. Start with basics, watch videos multiple times, take quizzes to identify weak areas, and ask specific questions. I'm here to help!"),
-    ("Tips for rural students", "1) Use this platform regularly, 2) Don't hesitate to ask questions, 3) Practice consistently, 4) Connect with urban teachers through video lessons, 5) Believe in yourself!"),
-    ("How does AI tutoring work?", "I use artificial intelligence to understand your questions and provide helpful explanations. I can help with concepts, solve doubts, give study tips, and guide you through problems."),
-    
-    # Technical Support
-    ("Video not loading", "Try refreshing the page or check your internet connection. If the problem persists, the teacher might be updating the video content."),
-    ("Quiz not submitting", "Make sure you've answered all questions and entered your name. Check your internet connection and try again."),
-    ("How to contact teacher?", "Currently, you can learn from teacher-created videos and use this AI tutor for doubts. More direct communication features are coming soon!"),
-    
-    # Motivational
-    ("I feel discouraged", "Learning is a journey with ups and downs. Every expert was once a beginner. Keep practicing, use this platform regularly, and celebrate small victories. You've got this!"),
-    ("Am I smart enough?", "Absolutely! Intelligence isn't fixed - it grows with effort and practice. This platform is designed to help you learn at your own pace. Keep going!"),
-]
+def finish_transcode_job(db, job, manifest=None, error=None):
+    """Record a job's outcome if this claim still holds it; failures are retried until TRANSCODE_MAX_ATTEMPTS."""
+    if manifest is None and job['attempts'] < TRANSCODE_MAX_ATTEMPTS:
+        db.execute("UPDATE transcode_jobs SET status='queued', error=? WHERE id=? AND attempts=? AND status='running'",
+                   (error, job['id'], job['attempts']))
+        db.commit()
+        return
+    status = 'done' if manifest is not None else 'failed'
+    finished = db.execute("""
+        UPDATE transcode_jobs SET status=?, error=?, finished_at=? WHERE id=? AND attempts=? AND status='running'
+        RETURNING id
+    """, (status, error, datetime.now().isoformat(), job['id'], job['attempts'])).fetchone()
+    if finished is None:
+        db.rollback()
+        return
+    # A newer job means the teacher replaced the video meanwhile
+    db.execute("""
+        UPDATE lessons SET video_status=?, renditions=?
+        WHERE id=? AND NOT EXISTS (SELECT 1 FROM transcode_jobs WHERE lesson_id=? AND id > ?)
+    """, ('ready' if manifest is not None else 'failed', json.dumps(manifest) if manifest else None,
+          job['lesson_id'], job['lesson_id'], job['id']))
+    db.commit()
 
-faq_questions = [q for q,a in FAQ_PAIRS]
-vectorizer = TfidfVectorizer().fit(faq_questions)
+class TranscodeLease:
+    """Renews a claimed job's lease from a background thread while it is being encoded."""
 
-def chatbot_answer(user_input):
-    ui = user_input.lower().strip()
-    
-    # Handle empty input
-    if not ui:
-        return "I'm here to help! You can ask me about math concepts, how to use the platform, study tips, or anything else related to your learning journey. What's on your mind? 🤔"
-    
-    # Handle greetings with more variety
-    greetings = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening', 'howdy', 'sup']
-    if any(greeting in ui for greeting in greetings):
-        responses = [
-            "Hello there! 👋 I'm your AI tutor, ready to help you learn and grow. What subject would you like to explore today?",
-            "Hi! Great to see you here! 😊 I can help with math, study strategies, or any questions about the platform. What can I assist you with?",
-            "Hey! Welcome to your learning session! 🎓 I'm here to make your studies easier and more effective. How can I help?"
-        ]
-        return random.choice(responses)
-    
-    # Handle thanks with warmth
-    thanks = ['thank', 'thanks', 'thank you', 'thx', 'appreciate']
-    if any(thank in ui for thank in thanks):
-        responses = [
-            "You're very welcome! 😊 I'm always happy to help you succeed. Keep up the great work!",
-            "My pleasure! That's what I'm here for. Feel free to ask me anything else - I love helping students learn! 🌟",
-            "Glad I could help! Remember, there's no such thing as a silly question. I'm here whenever you need me! 💪"
-        ]
-        return random.choice(responses)
-    
-    # Handle motivation and encouragement
-    motivation_words = ['tired', 'difficult', 'hard', 'struggling', 'confused', 'frustrated', 'give up', 'quit']
-    if any(word in ui for word in motivation_words):
-        return "I understand learning can be challenging sometimes, but you're doing great by asking for help! 💪 Remember, every expert was once a beginner. Take a short break if needed, then let's tackle this together. What specific topic is giving you trouble?"
-    
-    # Handle compliments
-    compliments = ['good', 'great', 'awesome', 'amazing', 'helpful', 'smart']
-    if any(comp in ui for comp in compliments) and ('you' in ui or 'tutor' in ui):
-        return "Thank you so much! 😊 Your kind words motivate me to help even more. I'm here to support your learning journey every step of the way. What else can we work on together?"
-    
-    # Enhanced keyword matching with context
-    for q, a in FAQ_PAIRS:
-        question_words = set(re.findall(r'\w+', q.lower()))
-        input_words = set(re.findall(r'\w+', ui))
-        
-        # Check for significant word overlap or specific topic matches
-        common_words = question_words.intersection(input_words)
-        topic_matches = {
-            'fraction': ['fraction', 'fractions', 'numerator', 'denominator'],
-            'decimal': ['decimal', 'decimals', 'point'],
-            'quiz': ['quiz', 'test', 'exam', 'question'],
-            'video': ['video', 'lesson', 'watch'],
-            'study': ['study', 'learn', 'practice']
-        }
-        
-        # Check for topic-specific matches
-        topic_found = False
-        for topic, keywords in topic_matches.items():
-            if any(keyword in ui for keyword in keywords) and topic in q.lower():
-                topic_found = True
-                break
-        
-        if len(common_words) >= 2 or topic_found:
-            return f"{a}\n\n💡 **Need more help?** Feel free to ask follow-up questions or request examples!"
-    
-    # Use TF-IDF for semantic similarity
+    def __init__(self, job):
+        self.job = job
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='transcode-lease', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def renew(self):
+        """Renew now; False once another worker owns the job or it was cancelled."""
+        try:
+            with database.connection() as db:
+                self.lost = self.lost or not renew_transcode_job(db, self.job)
+        except Exception:
+            app.logger.exception("Renewing the lease of transcode job %s failed", self.job['id'])
+        return not self.lost
+
+    def _run(self):
+        while not self._stop.wait(TRANSCODE_HEARTBEAT) and self.renew():
+            pass
+
+def run_next_transcode_job(transcoder):
+    """Transcode one queued upload; returns False when the queue is empty.
+
+    No connection is held while encoding: the job is claimed and committed
+    first, the lease heartbeat keeps it, and the outcome is recorded on a
+    fresh connection.
+    """
+    with database.connection() as db:
+        job = claim_transcode_job(db)
+        if job is None:
+            return False
+        if job['attempts'] > TRANSCODE_MAX_ATTEMPTS:
+            # Requeued after its worker died on the last allowed attempt
+            finish_transcode_job(db, job, error="worker lost")
+            return True
+    source = os.path.join(app.config['UPLOAD_FOLDER'], job['source'])
+    relative = f"{RENDITIONS_FOLDER}/{job['id']}"
+    out_dir = os.path.join(app.config['UPLOAD_FOLDER'], relative)
+    # Built in a scratch directory of this claim and renamed, so served renditions are always complete
+    work_dir = f"{out_dir}.{job['attempts']}.tmp"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
     try:
-        user_vector = vectorizer.transform([ui])
-        faq_vectors = vectorizer.transform(faq_questions)
-        similarities = cosine_similarity(user_vector, faq_vectors)[0]
-        best_match_idx = similarities.argmax()
-        
-        if similarities[best_match_idx] > 0.3:
-            answer = FAQ_PAIRS[best_match_idx][1]
-            return f"{answer}\n\n🤔 **Was this helpful?** If you need clarification or have a different question, just ask!"
-    except:
-        pass
-    
-    # Contextual responses for common topics
-    if 'math' in ui or 'mathematics' in ui:
-        return "I love helping with math! 📚 I can explain fractions, decimals, basic operations, and more. Try asking specific questions like:\n• 'What is a fraction?'\n• 'How to add fractions?'\n• 'Convert fractions to decimals'\n\nWhat math topic interests you most?"
-    
-    if 'help' in ui:
-        return "I'm here to help! 🌟 You can ask me about:\n\n📚 **Math concepts** (fractions, decimals, operations)\n🎯 **Platform usage** (taking quizzes, watching videos)\n📝 **Study strategies** (effective learning tips)\n💡 **Motivation** (staying focused and confident)\n\nWhat specific topic would you like to explore?"
-    
-    # Fallback with helpful suggestions
-    fallback_responses = [
-        "I want to help, but I'm not sure I understand your question completely. Could you rephrase it or be more specific? 🤔\n\n**I'm great at helping with:**\n• Math concepts (fractions, decimals, etc.)\n• Platform navigation\n• Study tips and strategies\n• Quiz guidance",
-        "Hmm, that's an interesting question! I might need a bit more context to give you the best answer. 💭\n\n**Try asking about:**\n• Specific math topics\n• How to use platform features\n• Study techniques\n• Quiz preparation tips",
-        "I'd love to help you with that! Could you provide a bit more detail or ask in a different way? 😊\n\n**Popular topics I can help with:**\n• Mathematics explanations\n• Learning strategies\n• Platform tutorials\n• Academic support"
-    ]
-    
-    return random.choice(fallback_responses)
+        with TranscodeLease(job) as lease:
+            manifest = transcode_video(transcoder, source, work_dir)
+            if not lease.renew():
+                raise RuntimeError("job was cancelled or taken over by another worker")
+            shutil.rmtree(out_dir, ignore_errors=True)
+            os.replace(work_dir, out_dir)
+    except Exception as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        app.logger.exception("Transcode job %s for lesson %s failed", job['id'], job['lesson_id'])
+        with database.connection() as db:
+            finish_transcode_job(db, job, error=str(e)[:500])
+        return True
+    manifest['hls'] = f"{relative}/{manifest['hls']}"
+    manifest['poster'] = f"{relative}/{manifest['poster']}"
+    for item in manifest['sources']:
+        item['file'] = f"{relative}/{item['file']}"
+    with database.connection() as db:
+        finish_transcode_job(db, job, manifest=manifest)
+    return True
+
+@app.cli.command('transcode-worker')
+@click.option('--once', is_flag=True, help='Process the queued jobs, then exit.')
+@click.option('--transcoder', default=None, help='Override TRANSCODER (ffmpeg or stub).')
+def transcode_worker_command(once, transcoder):
+    """Convert uploaded lesson videos into streaming renditions."""
+    transcoder = make_transcoder(transcoder)
+    while True:
+        if not run_next_transcode_job(transcoder):
+            if once:
+                break
+            time.sleep(TRANSCODE_POLL_INTERVAL)
 
 # -----------------------
 # Authentication helpers
@@ -412,6 +2847,8 @@ def register():
 
 @app.route('/logout')
 def logout():
+    if 'user_id' in session:
+        score_buffer.flush(session['user_id'])
     session.clear()
     flash('Logged out successfully!', 'success')
     return redirect(url_for('login'))
@@ -434,38 +2871,313 @@ def teacher():
         description = request.form['description']
         video_url = request.form.get('video_url', '')
         
-        # Handle video file upload
-        if 'video_file' in request.files:
+        # Handle video file upload (resumable upload from the page script, or a plain form post)
+        upload_url = uploaded_video_url(request.form['upload_id']) if request.form.get('upload_id') else None
+        if upload_url:
+            video_url = upload_url
+            flash('Video uploaded successfully!', 'success')
+        elif 'video_file' in request.files:
             file = request.files['video_file']
             if file and file.filename != '' and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Add timestamp to avoid conflicts
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                filename = timestamp + filename
+                filename = unique_upload_name(secure_filename(file.filename))
                 file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 file.save(file_path)
                 video_url = url_for('uploaded_video', filename=filename)
                 flash('Video uploaded successfully!', 'success')
         
         db = get_db()
-        db.execute("INSERT INTO lessons (title,description,video_url,created_at) VALUES (?,?,?,?)",
-                   (title, description, video_url, datetime.now().isoformat()))
+        lesson_id = insert_db("INSERT INTO lessons (title,description,video_url,created_at) VALUES (?,?,?,?)",
+                              (title, description, video_url, datetime.now().isoformat()))
+        queue_transcode(db, lesson_id, video_url)
         db.commit()
         flash('Lesson created successfully!', 'success')
         return redirect(url_for('teacher'))
     
-    lessons = query_db("SELECT * FROM lessons")
-    # Get quiz information for each lesson
-    lessons_with_quizzes = {}
-    for lesson in lessons:
-        quiz = query_db("SELECT * FROM quizzes WHERE lesson_id=?", (lesson['id'],), one=True)
-        if quiz:
-            lessons_with_quizzes[lesson['id']] = quiz
-    return render_template('teacher.html', lessons=lessons, lessons_with_quizzes=lessons_with_quizzes)
-
-@app.route('/uploads/videos/<filename>')
+    total_lessons = query_db("SELECT COUNT(*) FROM lessons", one=True)[0]
+    pages = max(1, -(-total_lessons // TEACHER_PAGE_SIZE))
+    page = min(max(request.args.get('page', 1, type=int), 1), pages)
+    
+    # One query per page: each lesson with its quiz and question/attempt counts
+    lessons = query_db("""
+        SELECT l.*, q.id AS quiz_id, q.title AS quiz_title,
+               (SELECT COUNT(*) FROM questions WHERE quiz_id = q.id) AS question_count,
+               (SELECT COUNT(*) FROM attempts WHERE quiz_id = q.id) AS attempt_count
+        FROM lessons l
+        LEFT JOIN quizzes q ON q.id = (SELECT MIN(id) FROM quizzes WHERE lesson_id = l.id)
+        ORDER BY l.id
+        LIMIT ? OFFSET ?
+    """, (TEACHER_PAGE_SIZE, (page - 1) * TEACHER_PAGE_SIZE))
+    return render_template('teacher.html', lessons=lessons, total_lessons=total_lessons,
+                           page=page, pages=pages)
+
+@app.route('/uploads/videos/<path:filename>')
 def uploaded_video(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve a lesson video with Range, strong ETag and long-lived caching, or hand it to the front server."""
+    parts = filename.split('/')
+    # Besides plain uploads only published renditions/<job id>/<file>, never a job's scratch directory
+    if len(parts) > 1 and not (len(parts) == 3 and parts[0] == RENDITIONS_FOLDER and parts[1].isdigit()):
+        return "Not found", 404
+    if MEDIA_OFFLOAD == 'x-accel':
+        path = safe_join(os.path.join(app.root_path, app.config['UPLOAD_FOLDER']), filename)
+        if path is None or not os.path.isfile(path):
+            return "Not found", 404
+        # nginx answers Range and conditional requests itself from the internal location
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX + quote(filename)
+    else:
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=IMMUTABLE_MAX_AGE)
+    # Upload names carry a timestamp and random tag (unique_upload_name), so a URL always means the same bytes
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+# -----------------------
+# Resumable uploads
+# -----------------------
+# POST /uploads starts an upload, PUT /uploads/<id>?offset=N appends one chunk
+# (streamed to disk, optionally verified with X-Chunk-SHA256), GET reports the
+# offset to resume from and POST /uploads/<id>/finalize checks the whole file
+# against the client's sha256 before publishing it. State lives in the uploads
+# table, so any worker can take the next chunk; each worker also keeps a running
+# digest of the uploads whose chunks it wrote in order, so finalize only has to
+# re-read the file when the chunks were spread over several workers.
+def _partial_path(upload_id):
+    return os.path.join(UPLOAD_PARTIAL_FOLDER, upload_id + '.part')
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(UPLOAD_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# upload id -> (bytes hashed, sha256 object) for uploads whose chunks this worker wrote in order
+_upload_digests = OrderedDict()
+_upload_digests_lock = threading.Lock()
+UPLOAD_DIGESTS_KEPT = 64
+
+def _running_digest(upload_id, offset):
+    """A copy of the running digest covering exactly the first `offset` bytes, or None."""
+    if offset == 0:
+        return hashlib.sha256()
+    with _upload_digests_lock:
+        hashed, digest = _upload_digests.get(upload_id, (None, None))
+        return digest.copy() if hashed == offset else None
+
+def _remember_digest(upload_id, hashed, digest):
+    with _upload_digests_lock:
+        _upload_digests.pop(upload_id, None)
+        if digest is not None:
+            _upload_digests[upload_id] = (hashed, digest)
+            while len(_upload_digests) > UPLOAD_DIGESTS_KEPT:
+                _upload_digests.popitem(last=False)
+
+def _forget_digest(upload_id):
+    with _upload_digests_lock:
+        _upload_digests.pop(upload_id, None)
+
+def _claim_upload(db, upload_id, received):
+    """Claim an unfinished upload holding `received` bytes; returns the claim token or None."""
+    claim = secrets.token_hex(8)
+    now = datetime.now()
+    claimed = db.execute("""
+        UPDATE uploads SET claim = ?, claimed_at = ?, updated_at = ?
+        WHERE id = ? AND received = ? AND filename IS NULL AND (claim IS NULL OR claimed_at < ?)
+        RETURNING id
+    """, (claim, now.isoformat(), now.isoformat(), upload_id, received,
+          (now - UPLOAD_CLAIM_TIMEOUT).isoformat())).fetchone()
+    db.commit()
+    return claim if claimed else None
+
+def _release_upload(db, upload_id, claim):
+    db.execute("UPDATE uploads SET claim = NULL WHERE id = ? AND claim = ?", (upload_id, claim))
+    db.commit()
+
+def _upload_json(upload, **extra):
+    data = {'upload_id': upload['id'], 'offset': upload['received'], 'size': upload['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE, 'complete': upload['filename'] is not None}
+    if upload['filename']:
+        data['video_url'] = url_for('uploaded_video', filename=upload['filename'])
+    data.update(extra)
+    return jsonify(data)
+
+def _get_upload(upload_id):
+    return query_db("SELECT * FROM uploads WHERE id = ? AND teacher_id = ?", (upload_id, session['user_id']), one=True)
+
+def _expire_uploads(db):
+    cutoff = (datetime.now() - UPLOAD_EXPIRY).isoformat()
+    stale = [row['id'] for row in db.execute(
+        "SELECT id FROM uploads WHERE filename IS NULL AND updated_at < ?", (cutoff,)).fetchall()]
+    for upload_id in stale:
+        try:
+            os.remove(_partial_path(upload_id))
+        except FileNotFoundError:
+            pass
+    db.executemany("DELETE FROM uploads WHERE id = ?", [(upload_id,) for upload_id in stale])
+
+def uploaded_video_url(upload_id):
+    """URL of a finished upload owned by the current teacher, or None."""
+    upload = _get_upload(upload_id)
+    if upload is None or upload['filename'] is None:
+        return None
+    return url_for('uploaded_video', filename=upload['filename'])
+
+@app.route('/uploads', methods=['POST'])
+@login_required('teacher')
+def upload_init():
+    data = request.get_json(silent=True) or {}
+    original_name = str(data.get('filename', ''))
+    size = data.get('size')
+    checksum = str(data.get('sha256') or '').lower() or None
+    if not allowed_file(original_name):
+        return jsonify({'error': 'Unsupported file type'}), 400
+    if not isinstance(size, int) or not 0 < size <= app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'Invalid file size'}), 400
+    if checksum and not re.fullmatch(r'[0-9a-f]{64}', checksum):
+        return jsonify({'error': 'Invalid sha256'}), 400
+    
+    db = get_db()
+    _expire_uploads(db)
+    upload_id = secrets.token_hex(16)
+    open(_partial_path(upload_id), 'wb').close()
+    now = datetime.now().isoformat()
+    db.execute("""INSERT INTO uploads (id, teacher_id, original_name, size, sha256, created_at, updated_at)
+                  VALUES (?, ?, ?, ?, ?, ?, ?)""", (upload_id, session['user_id'], original_name, size, checksum, now, now))
+    db.commit()
+    return _upload_json(_get_upload(upload_id)), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@login_required('teacher')
+def upload_status(upload_id):
+    upload = _get_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return _upload_json(upload)
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required('teacher')
+def upload_chunk(upload_id):
+    upload = _get_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    offset = request.args.get('offset', type=int)
+    length = request.content_length
+    if upload['filename'] is not None or offset != upload['received']:
+        # Already stored (e.g. a retried request): tell the client where to continue
+        return _upload_json(upload, error='Offset mismatch'), 409
+    if not length or length > UPLOAD_CHUNK_MAX or offset + length > upload['size']:
+        return _upload_json(upload, error='Invalid chunk length'), 400
+    
+    db = get_db()
+    # Claim the chunk before touching the file, so only one request writes at this offset
+    claim = _claim_upload(db, upload_id, offset)
+    if claim is None:
+        return _upload_json(_get_upload(upload_id), error='Offset mismatch'), 409
+    
+    digest = hashlib.sha256()
+    running = _running_digest(upload_id, offset)
+    written = 0
+    error = None
+    try:
+        with open(_partial_path(upload_id), 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                block = request.stream.read(min(UPLOAD_BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                f.write(block)
+                digest.update(block)
+                if running is not None:
+                    running.update(block)
+                written += len(block)
+    except FileNotFoundError:
+        error = ('Upload expired', 410)
+    except Exception:
+        _release_upload(db, upload_id, claim)
+        raise
+    expected = request.headers.get('X-Chunk-SHA256')
+    if error is None and written != length:
+        error = ('Incomplete chunk', 400)
+    elif error is None and expected and expected.lower() != digest.hexdigest():
+        error = ('Chunk checksum mismatch', 400)
+    
+    if error is not None:
+        _release_upload(db, upload_id, claim)
+    else:
+        moved = db.execute("""
+            UPDATE uploads SET received = ?, claim = NULL, updated_at = ? WHERE id = ? AND claim = ? RETURNING id
+        """, (offset + written, datetime.now().isoformat(), upload_id, claim)).fetchone()
+        db.commit()
+        if moved is None:
+            error = ('Offset mismatch', 409)  # our claim expired and another request took over
+        else:
+            _remember_digest(upload_id, offset + written, running)
+    upload = _get_upload(upload_id)
+    if error is None:
+        return _upload_json(upload)
+    if upload is None:
+        return jsonify({'error': error[0]}), error[1]
+    return _upload_json(upload, error=error[0]), error[1]
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required('teacher')
+def upload_finalize(upload_id):
+    upload = _get_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    if upload['filename'] is not None:
+        return _upload_json(upload)
+    if upload['received'] != upload['size']:
+        return _upload_json(upload, error='Upload incomplete'), 409
+    expected = str((request.get_json(silent=True) or {}).get('sha256') or upload['sha256'] or '').lower()
+    if expected and not re.fullmatch(r'[0-9a-f]{64}', expected):
+        return _upload_json(upload, error='Invalid sha256'), 400
+    
+    db = get_db()
+    claim = _claim_upload(db, upload_id, upload['size'])
+    if claim is None:
+        # Finalized (or being finalized) by a concurrent request
+        upload = _get_upload(upload_id)
+        if upload is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        if upload['filename'] is not None:
+            return _upload_json(upload)
+        return _upload_json(upload, error='Upload is being finalized'), 409
+    
+    partial = _partial_path(upload_id)
+    try:
+        with open(partial, 'r+b') as f:
+            f.truncate(upload['size'])
+        running = _running_digest(upload_id, upload['size'])
+        # Checked before the file is published, since published videos are cached as immutable
+        checksum = running.hexdigest() if running is not None else _file_sha256(partial)
+        if expected and expected != checksum:
+            # Start over rather than keep a corrupt file
+            with open(partial, 'wb'):
+                pass
+            _forget_digest(upload_id)
+            db.execute("UPDATE uploads SET received = 0, claim = NULL, updated_at = ? WHERE id = ? AND claim = ?",
+                       (datetime.now().isoformat(), upload_id, claim))
+            db.commit()
+            return _upload_json(_get_upload(upload_id), error='Checksum mismatch'), 422
+        
+        name = secure_filename(upload['original_name'])
+        if '.' not in name:
+            name = 'video.' + upload['original_name'].rsplit('.', 1)[1].lower()
+        filename = unique_upload_name(name)
+        os.replace(partial, os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    except FileNotFoundError:
+        _release_upload(db, upload_id, claim)
+        return jsonify({'error': 'Upload expired'}), 410
+    except Exception:
+        _release_upload(db, upload_id, claim)
+        raise
+    db.execute("UPDATE uploads SET filename = ?, sha256 = ?, claim = NULL, updated_at = ? WHERE id = ?",
+               (filename, checksum, datetime.now().isoformat(), upload_id))
+    db.commit()
+    _forget_digest(upload_id)
+    return _upload_json(_get_upload(upload_id))
 
 @app.route('/student')
 @login_required('student')
@@ -483,84 +3195,261 @@ def lesson_view(lid):
 @login_required('student')
 def quiz(quiz_id):
     quiz = query_db("SELECT * FROM quizzes WHERE id=?", (quiz_id,), one=True)
-    questions = query_db("SELECT * FROM questions WHERE quiz_id=?", (quiz_id,))
-    qlist = []
-    for q in questions:
-        qlist.append({
-            "id": q["id"],
-            "question": q["question"],
-            "options": json.loads(q["options"]),
-            "topic": q["topic"]
-        })
+    qlist = get_quiz_payload(quiz_id, quiz['version']).questions if quiz else []
     return render_template('quiz.html', quiz=quiz, questions=qlist)
 
 @app.route('/submit_quiz', methods=['POST'])
 @login_required('student')
 def submit_quiz():
-    data = request.json
-    student = session.get('username', 'Anonymous')
-    answers = data.get('answers',{})  
-    quiz_id = data.get('quiz_id')
-    questions = query_db("SELECT * FROM questions WHERE quiz_id=?", (quiz_id,))
-    total = len(questions)
-    correct = 0
-    topic_scores = {}
-    for q in questions:
-        qid = str(q['id'])
-        correct_idx = q['answer_index']
-        topic = q['topic'] or 'general'
-        chosen = answers.get(qid, -1)
-        topic_scores.setdefault(topic, {"right":0,"total":0})
-        topic_scores[topic]["total"] += 1
-        if int(chosen) == int(correct_idx):
-            correct += 1
-            topic_scores[topic]["right"] += 1
-    score = round((correct/total)*100,2) if total>0 else 0.0
-    detail = json.dumps(topic_scores)
+    data = request.get_json(silent=True) or {}
+    answers = data.get('answers', {})
+    if not isinstance(answers, dict):
+        return jsonify({"error": "answers must be an object"}), 400
+    quiz_id = _choice_index(data.get('quiz_id'))
+    if quiz_id < 1:
+        return jsonify({"error": "quiz_id must be a quiz id"}), 400
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key') or secrets.token_hex(16)
+    submission = {
+        'id': submission_id_for(session['user_id'], key),
+        'student_id': session['user_id'],
+        'student_name': session.get('username', 'Anonymous'),
+        'quiz_id': quiz_id,
+        'answers': answers,
+        'submitted_at': datetime.now().isoformat(),
+    }
     db = get_db()
-    db.execute("INSERT INTO attempts (student_name,quiz_id,score,detail,taken_at) VALUES (?,?,?,?,?)",
-               (student, quiz_id, score, detail, datetime.now().isoformat()))
-    db.commit()
-    recs = []
-    for t,vals in topic_scores.items():
-        pct = (vals['right']/vals['total'])*100 if vals['total']>0 else 0.0
-        if pct < 70:
-            recs.append({"topic": t, "score_pct": round(pct,2)})
-    return jsonify({"score": score, "recommendations": recs})
+    store_submission(db, submission)
+    if SUBMISSION_FLUSH_INTERVAL <= 0:
+        grade_submissions(db, [submission['id']])
+        db.commit()
+        _, result = stored_submission(db, submission['id'])
+        if result is not None:
+            return submission_response(submission['id'], result)
+    else:
+        # Committed before the 202, so the submission survives this worker dying
+        db.commit()
+        submission_queue.submit(submission['id'], session['user_id'])
+    return jsonify({"submission_id": submission['id'], "status": "queued",
+                    "result_url": url_for('submission_result', submission_id=submission['id'])}), 202
+
+def submission_response(submission_id, result):
+    return jsonify(dict(result, submission_id=submission_id)), 500 if result['status'] == 'failed' else 200
+
+@app.route('/submissions/<submission_id>')
+@login_required('student')
+def submission_result(submission_id):
+    """Result of a queued quiz submission; ?wait=N holds the request up to N seconds for it."""
+    deadline = time.monotonic() + min(max(request.args.get('wait', 0, type=float), 0), SUBMISSION_WAIT_MAX)
+    while True:
+        stored = submission_queue.wait(submission_id, max(deadline - time.monotonic(), 0))
+        queued_here = stored is None and submission_queue.is_pending(submission_id)
+        if stored is None and not queued_here:
+            # Graded by another worker, still queued there, or left pending by a worker that died
+            stored = stored_submission(get_db(), submission_id)
+            if stored is None:
+                return jsonify({"error": "Submission not found"}), 404
+        if stored is not None:
+            owner, result = stored
+            if owner != session['user_id']:
+                return jsonify({"error": "Submission not found"}), 404
+            if result is not None:
+                return submission_response(submission_id, result)
+        if time.monotonic() >= deadline:
+            if not queued_here:
+                # Still pending after a whole poll: grade it here in case its worker is gone
+                submission_queue.submit(submission_id, session['user_id'])
+            return jsonify({"submission_id": submission_id, "status": "queued"}), 202
+        time.sleep(min(0.5, max(deadline - time.monotonic(), 0)))
+
+def record_topic_mastery(db, student_id, topic_scores, seen_at):
+    """Add one attempt's per-topic results to topic_mastery (caller commits)."""
+    db.executemany("""
+        INSERT INTO topic_mastery (student_id, topic, correct, total, last_seen) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (student_id, topic) DO UPDATE SET
+            correct = topic_mastery.correct + excluded.correct,
+            total = topic_mastery.total + excluded.total,
+            last_seen = excluded.last_seen
+    """, [(student_id, topic, vals['right'], vals['total'], seen_at) for topic, vals in topic_scores.items()])
+
+@app.route('/weak-topics')
+@login_required('student')
+def weak_topics():
+    rows = query_db("""
+        SELECT topic, correct, total, last_seen FROM topic_mastery
+        WHERE student_id = ? AND total > 0 AND correct * 100 < ? * total
+        ORDER BY 1.0 * correct / total, topic
+    """, (session['user_id'], WEAK_TOPIC_PCT))
+    return jsonify({"weak_topics": [
+        {"topic": r['topic'], "score_pct": round(r['correct'] / r['total'] * 100, 2),
+         "questions_answered": r['total'], "last_seen": r['last_seen']}
+        for r in rows
+    ]})
+
+@app.route('/topic-analytics')
+@login_required('teacher')
+def topic_analytics():
+    topics = query_db("""
+        SELECT topic, SUM(correct) AS correct, SUM(total) AS total, COUNT(*) AS students
+        FROM topic_mastery
+        GROUP BY topic
+        HAVING SUM(total) > 0
+        ORDER BY 1.0 * SUM(correct) / SUM(total), topic
+    """)
+    struggling = query_db("""
+        SELECT u.name, m.topic, m.correct, m.total, m.last_seen
+        FROM topic_mastery m JOIN users u ON u.id = m.student_id
+        WHERE m.total > 0 AND m.correct * 100 < ? * m.total
+        ORDER BY 1.0 * m.correct / m.total, m.last_seen DESC
+        LIMIT 50
+    """, (WEAK_TOPIC_PCT,))
+    return render_template('topic_analytics.html', topics=topics, struggling=struggling,
+                           threshold=WEAK_TOPIC_PCT)
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def attempt_filters(quiz_id=None, date_from=None, date_to=None):
+    """WHERE clause and args for the /attempts quiz and date-range filters."""
+    clauses, args = [], []
+    if quiz_id:
+        clauses.append("quiz_id = ?")
+        args.append(quiz_id)
+    if date_from:
+        clauses.append("taken_at >= ?")
+        args.append(date_from.isoformat())
+    if date_to:
+        # taken_at is an ISO timestamp, so compare against the start of the next day
+        clauses.append("taken_at < ?")
+        args.append((date_to + timedelta(days=1)).isoformat())
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), args
 
 @app.route('/attempts')
 @login_required('teacher')
 def attempts():
-    rows = query_db("SELECT * FROM attempts ORDER BY taken_at DESC")
+    quiz_id = request.args.get('quiz_id', type=int)
+    date_from = _parse_date(request.args.get('from'))
+    date_to = _parse_date(request.args.get('to'))
+    where, args = attempt_filters(quiz_id, date_from, date_to)
     
-    # Calculate analytics
+    # Calculate analytics in a single pass over the matching attempts
+    stats = query_db(f"""
+        SELECT COUNT(*) AS total_attempts,
+               AVG(score) AS average_score,
+               MAX(score) AS highest_score,
+               MIN(score) AS lowest_score,
+               SUM(CASE WHEN score >= 70 THEN 1 ELSE 0 END) AS passed,
+               SUM(CASE WHEN score >= 90 THEN 1 ELSE 0 END) AS excellent,
+               SUM(CASE WHEN score >= 70 AND score < 90 THEN 1 ELSE 0 END) AS good,
+               SUM(CASE WHEN score >= 50 AND score < 70 THEN 1 ELSE 0 END) AS average,
+               SUM(CASE WHEN score < 50 THEN 1 ELSE 0 END) AS poor
+        FROM attempts{where}
+    """, args, one=True)
     analytics = {}
-    if rows:
-        scores = [r['score'] for r in rows]
-        analytics['total_attempts'] = len(rows)
-        analytics['average_score'] = sum(scores) / len(scores)
-        analytics['highest_score'] = max(scores)
-        analytics['lowest_score'] = min(scores)
-        analytics['pass_rate'] = len([s for s in scores if s >= 70]) / len(scores) * 100
-        
-        # Top performers
-        analytics['top_performers'] = sorted(rows, key=lambda x: x['score'], reverse=True)[:5]
+    if stats['total_attempts']:
+        analytics = {key: stats[key] for key in stats.keys() if key != 'passed'}
+        analytics['pass_rate'] = stats['passed'] / stats['total_attempts'] * 100
         
-        # Score distribution
-        analytics['excellent'] = len([s for s in scores if s >= 90])
-        analytics['good'] = len([s for s in scores if 70 <= s < 90])
-        analytics['average'] = len([s for s in scores if 50 <= s < 70])
-        analytics['poor'] = len([s for s in scores if s < 50])
+        # Top performers, read straight off the score index
+        analytics['top_performers'] = query_db(
+            f"SELECT * FROM attempts{where} ORDER BY score DESC, taken_at DESC LIMIT 5", args)
     
-    return render_template('results.html', attempts=rows, analytics=analytics)
+    # Keyset pagination on (taken_at, id), newest first so the first page shows recent results
+    # (the unpaginated list used to be oldest first)
+    page_where, page_args = where, list(args)
+    before = request.args.get('before', '')
+    before_at, _, before_id = before.rpartition('|')
+    if before_at and before_id.isdigit():
+        page_where += (" AND " if page_where else " WHERE ") + "(taken_at, id) < (?, ?)"
+        page_args += [before_at, int(before_id)]
+    rows = query_db(f"SELECT * FROM attempts{page_where} ORDER BY taken_at DESC, id DESC LIMIT ?",
+                    page_args + [ATTEMPTS_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(rows) > ATTEMPTS_PAGE_SIZE:
+        rows = rows[:ATTEMPTS_PAGE_SIZE]
+        next_cursor = f"{rows[-1]['taken_at']}|{rows[-1]['id']}"
+    
+    quizzes = query_db("SELECT id, title FROM quizzes ORDER BY id")
+    filters = {'quiz_id': quiz_id, 'from': date_from.isoformat() if date_from else '',
+               'to': date_to.isoformat() if date_to else ''}
+    return render_template('results.html', attempts=rows, analytics=analytics, quizzes=quizzes,
+                           filters=filters, next_cursor=next_cursor, paged=bool(before))
 
 @app.route('/chatbot', methods=['POST'])
 def chatbot():
     data = request.json
     q = data.get('q', '')
+    faq_store.refresh_if_stale(get_db())
     ans = chatbot_answer(q)
     return jsonify({"answer": ans})
 
+@app.route('/chatbot/batch', methods=['POST'])
+def chatbot_batch():
+    data = request.json or {}
+    queries = data.get('queries')
+    if not isinstance(queries, list):
+        return jsonify({"error": "'queries' must be a list of questions"}), 400
+    if len(queries) > CHATBOT_BATCH_LIMIT:
+        return jsonify({"error": f"At most {CHATBOT_BATCH_LIMIT} questions per batch"}), 400
+    faq_store.refresh_if_stale(get_db())
+    return jsonify({"answers": chatbot_answer_many(queries)})
+
+@app.route('/chatbot/stats')
+@login_required('teacher')
+def chatbot_stats():
+    return jsonify({"cache": chatbot_cache.stats(), "faq_version": faq_store.version})
+
+def bump_faq_version(db):
+    db.execute("UPDATE faq_version SET version = version + 1")
+    db.commit()
+    faq_store.start_rebuild()
+
+@app.route('/faqs', methods=['GET', 'POST'])
+@login_required('teacher')
+def manage_faqs():
+    if request.method == 'POST':
+        question = request.form.get('question', '').strip()
+        answer = request.form.get('answer', '').strip()
+        if not question or not answer:
+            flash('Please enter both a question and an answer!', 'error')
+        else:
+            db = get_db()
+            db.execute("INSERT INTO faqs (question, answer, updated_at) VALUES (?, ?, ?)",
+                       (question, answer, datetime.now().isoformat()))
+            bump_faq_version(db)
+            flash('FAQ added! The AI tutor will use it within a few seconds.', 'success')
+        return redirect(url_for('manage_faqs'))
+    
+    faqs = query_db("SELECT * FROM faqs ORDER BY id")
+    return render_template('faqs.html', faqs=faqs)
+
+@app.route('/edit-faq/<int:faq_id>', methods=['POST'])
+@login_required('teacher')
+def edit_faq(faq_id):
+    question = request.form.get('question', '').strip()
+    answer = request.form.get('answer', '').strip()
+    if not question or not answer:
+        flash('Please enter both a question and an answer!', 'error')
+        return redirect(url_for('manage_faqs'))
+    
+    db = get_db()
+    db.execute("UPDATE faqs SET question=?, answer=?, updated_at=? WHERE id=?",
+               (question, answer, datetime.now().isoformat(), faq_id))
+    bump_faq_version(db)
+    flash('FAQ updated successfully!', 'success')
+    return redirect(url_for('manage_faqs'))
+
+@app.route('/delete-faq/<int:faq_id>', methods=['POST'])
+@login_required('teacher')
+def delete_faq(faq_id):
+    db = get_db()
+    db.execute("DELETE FROM faqs WHERE id=?", (faq_id,))
+    bump_faq_version(db)
+    flash('FAQ deleted successfully!', 'success')
+    return redirect(url_for('manage_faqs'))
+
 @app.route('/lesson-page/<int:lesson_id>')
 @login_required('student')
 def lesson_page(lesson_id):
@@ -582,13 +3471,15 @@ def edit_lesson(lesson_id):
         description = request.form['description']
         video_url = request.form.get('video_url', lesson['video_url'])
         
-        # Handle video file upload
-        if 'video_file' in request.files:
+        # Handle video file upload (resumable upload from the page script, or a plain form post)
+        upload_url = uploaded_video_url(request.form['upload_id']) if request.form.get('upload_id') else None
+        if upload_url:
+            video_url = upload_url
+            flash('Video updated successfully!', 'success')
+        elif 'video_file' in request.files:
             file = request.files['video_file']
             if file and file.filename != '' and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                filename = timestamp + filename
+                filename = unique_upload_name(secure_filename(file.filename))
                 file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 file.save(file_path)
                 video_url = url_for('uploaded_video', filename=filename)
@@ -597,6 +3488,8 @@ def edit_lesson(lesson_id):
         db = get_db()
         db.execute("UPDATE lessons SET title=?, description=?, video_url=? WHERE id=?",
                    (title, description, video_url, lesson_id))
+        if video_url != lesson['video_url']:
+            queue_transcode(db, lesson_id, video_url)
         db.commit()
         flash('Lesson updated successfully!', 'success')
         return redirect(url_for('teacher'))
@@ -614,44 +3507,22 @@ def create_quiz(lesson_id):
     if request.method == 'POST':
         quiz_title = request.form.get('quiz_title', f"{lesson['title']} Quiz")
         questions_data = request.form.getlist('questions')
-        options_data = request.form.getlist('options')
-        answers_data = request.form.getlist('correct_answers')
-        topics_data = request.form.getlist('topics')
         
         if not questions_data or len([q for q in questions_data if q.strip()]) == 0:
             flash('Please add at least one question!', 'error')
             return render_template('create_quiz.html', lesson=lesson)
         
+        questions = questions_from_form(request.form)
+        if not questions:
+            flash('No valid questions were added. Please check your question format.', 'error')
+            return render_template('create_quiz.html', lesson=lesson)
+        
         try:
             db = get_db()
             # Create quiz
-            cursor = db.execute("INSERT INTO quizzes (lesson_id, title) VALUES (?, ?)", 
-                      (lesson_id, quiz_title))
-            quiz_id = cursor.lastrowid
-            
-            # Add questions
-            questions_added = 0
-            for i, question in enumerate(questions_data):
-                if question.strip():
-                    options_text = options_data[i] if i < len(options_data) else ""
-                    options_list = [opt.strip() for opt in options_text.replace('\n', ';').split(';') if opt.strip()]
-                    
-                    if len(options_list) >= 2:
-                        correct_answer = int(answers_data[i]) if i < len(answers_data) and answers_data[i].isdigit() else 0
-                        topic = topics_data[i] if i < len(topics_data) else 'general'
-                        
-                        db.execute(
-                            "INSERT INTO questions (quiz_id, question, options, answer_index, topic) VALUES (?, ?, ?, ?, ?)",
-                            (quiz_id, question, json.dumps(options_list), correct_answer, topic)
-                        )
-                        questions_added += 1
-            
-            if questions_added == 0:
-                db.execute("DELETE FROM quizzes WHERE id=?", (quiz_id,))
-                flash('No valid questions were added. Please check your question format.', 'error')
-                db.commit()
-                return render_template('create_quiz.html', lesson=lesson)
-            
+            quiz_id = insert_db("INSERT INTO quizzes (lesson_id, title) VALUES (?, ?)", 
+                                (lesson_id, quiz_title))
+            questions_added, _, _ = save_questions(db, quiz_id, questions)
             db.commit()
             flash(f'Quiz created successfully with {questions_added} questions!', 'success')
             return redirect(url_for('teacher'))
@@ -669,39 +3540,20 @@ def edit_quiz(quiz_id):
         return redirect(url_for('teacher'))
     
     lesson = query_db("SELECT * FROM lessons WHERE id=?", (quiz['lesson_id'],), one=True)
-    questions = query_db("SELECT * FROM questions WHERE quiz_id=?", (quiz_id,))
+    questions = query_db("SELECT * FROM questions WHERE quiz_id=? ORDER BY id", (quiz_id,))
     
     if request.method == 'POST':
         quiz_title = request.form.get('quiz_title', quiz['title'])
-        questions_data = request.form.getlist('questions')
-        options_data = request.form.getlist('options')
-        answers_data = request.form.getlist('correct_answers')
-        topics_data = request.form.getlist('topics')
         
         try:
             db = get_db()
-            # Update quiz title
-            db.execute("UPDATE quizzes SET title=? WHERE id=?", (quiz_title, quiz_id))
-            
-            # Delete existing questions
-            db.execute("DELETE FROM questions WHERE quiz_id=?", (quiz_id,))
-            
-            # Add new questions
-            for i, question in enumerate(questions_data):
-                if question.strip():
-                    options_text = options_data[i] if i < len(options_data) else ""
-                    options_list = [opt.strip() for opt in options_text.replace('\n', ';').split(';') if opt.strip()]
-                    
-                    if len(options_list) >= 2:
-                        correct_answer = int(answers_data[i]) if i < len(answers_data) and answers_data[i].isdigit() else 0
-                        topic = topics_data[i] if i < len(topics_data) else 'general'
-                        
-                        db.execute(
-                            "INSERT INTO questions (quiz_id, question, options, answer_index, topic) VALUES (?, ?, ?, ?, ?)",
-                            (quiz_id, question, json.dumps(options_list), correct_answer, topic)
-                        )
-            
+            # Only changed questions are written; unchanged ones keep their ids
+            changes = save_questions(db, quiz_id, questions_from_form(request.form))
+            if any(changes) or quiz_title != quiz['title']:
+                # Publish a new content version
+                db.execute("UPDATE quizzes SET title=?, version=version+1 WHERE id=?", (quiz_title, quiz_id))
             db.commit()
+            invalidate_quiz(quiz_id, quiz['version'])
             flash('Quiz updated successfully!', 'success')
             return redirect(url_for('teacher'))
         except Exception as e:
@@ -709,18 +3561,97 @@ def edit_quiz(quiz_id):
     
     return render_template('edit_quiz.html', quiz=quiz, lesson=lesson, questions=questions)
 
+def _uploaded_question_bank():
+    """(filename, bytes) of a bank posted as a 'question_file' upload or a raw JSON/CSV body."""
+    upload = request.files.get('question_file')
+    if upload and upload.filename:
+        return upload.filename, upload.read()
+    return ('questions.csv' if request.mimetype == 'text/csv' else 'questions.json'), request.get_data()
+
+def _wants_json():
+    return request.is_json or request.mimetype == 'text/csv' or request.accept_mimetypes.best == 'application/json'
+
+@app.route('/import-quiz/<int:lesson_id>', methods=['POST'])
+@login_required('teacher')
+def import_quiz(lesson_id):
+    """Create a quiz for a lesson from a JSON or CSV question bank."""
+    lesson = query_db("SELECT * FROM lessons WHERE id=?", (lesson_id,), one=True)
+    if not lesson:
+        return (jsonify({"errors": ["Lesson not found"]}), 404) if _wants_json() else redirect(url_for('teacher'))
+    title, questions, errors = parse_question_bank(*_uploaded_question_bank())
+    if errors:
+        if _wants_json():
+            return jsonify({"errors": errors}), 400
+        for error in errors:
+            flash(error, 'error')
+        return redirect(url_for('create_quiz', lesson_id=lesson_id))
+    title = request.form.get('quiz_title') or title or f"{lesson['title']} Quiz"
+    db = get_db()
+    quiz_id = insert_db("INSERT INTO quizzes (lesson_id, title) VALUES (?, ?)", (lesson_id, title))
+    # Ids in the file belong to another quiz, so every question is added
+    added, _, _ = save_questions(db, quiz_id, [dict(q, id=None) for q in questions])
+    db.commit()
+    if _wants_json():
+        return jsonify({"quiz_id": quiz_id, "added": added}), 201
+    flash(f'Quiz created successfully with {added} questions!', 'success')
+    return redirect(url_for('teacher'))
+
+@app.route('/edit-quiz/<int:quiz_id>/import', methods=['POST'])
+@login_required('teacher')
+def import_quiz_questions(quiz_id):
+    """Merge a question bank into a quiz; mode=replace also removes questions missing from it."""
+    quiz = query_db("SELECT * FROM quizzes WHERE id=?", (quiz_id,), one=True)
+    if not quiz:
+        return (jsonify({"errors": ["Quiz not found"]}), 404) if _wants_json() else redirect(url_for('teacher'))
+    _, questions, errors = parse_question_bank(*_uploaded_question_bank())
+    if errors:
+        if _wants_json():
+            return jsonify({"errors": errors}), 400
+        for error in errors:
+            flash(error, 'error')
+        return redirect(url_for('edit_quiz', quiz_id=quiz_id))
+    replace = (request.form.get('mode') or request.args.get('mode')) == 'replace'
+    db = get_db()
+    added, updated, removed = save_questions(db, quiz_id, questions, remove_missing=replace)
+    if added or updated or removed:
+        db.execute("UPDATE quizzes SET version=version+1 WHERE id=?", (quiz_id,))
+    db.commit()
+    invalidate_quiz(quiz_id, quiz['version'])
+    if _wants_json():
+        return jsonify({"added": added, "updated": updated, "removed": removed})
+    flash(f'Imported questions: {added} added, {updated} updated, {removed} removed.', 'success')
+    return redirect(url_for('edit_quiz', quiz_id=quiz_id))
+
+@app.route('/edit-quiz/<int:quiz_id>/export')
+@login_required('teacher')
+def export_quiz(quiz_id):
+    quiz = query_db("SELECT * FROM quizzes WHERE id=?", (quiz_id,), one=True)
+    if not quiz:
+        return "Not found", 404
+    return export_question_bank(quiz, 'csv' if request.args.get('format') == 'csv' else 'json')
+
 @app.route('/delete-lesson/<int:lesson_id>', methods=['POST'])
 @login_required('teacher')
 def delete_lesson(lesson_id):
     try:
         db = get_db()
+        quizzes = query_db("SELECT id, version FROM quizzes WHERE lesson_id=?", (lesson_id,))
+        jobs = query_db("SELECT id FROM transcode_jobs WHERE lesson_id=?", (lesson_id,))
         # Delete related questions first
         db.execute("DELETE FROM questions WHERE quiz_id IN (SELECT id FROM quizzes WHERE lesson_id=?)", (lesson_id,))
         # Delete related quizzes
         db.execute("DELETE FROM quizzes WHERE lesson_id=?", (lesson_id,))
         # Delete lesson
         db.execute("DELETE FROM lessons WHERE id=?", (lesson_id,))
+        # A running job's lease renewal then fails and its worker drops the work
+        db.execute("UPDATE transcode_jobs SET status='cancelled' WHERE lesson_id=? AND status IN ('queued', 'running')",
+                   (lesson_id,))
         db.commit()
+        for q in quizzes:
+            invalidate_quiz(q['id'], q['version'])
+        for job in jobs:
+            shutil.rmtree(os.path.join(app.config['UPLOAD_FOLDER'], RENDITIONS_FOLDER, str(job['id'])),
+                          ignore_errors=True)
         flash('Lesson deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting lesson: {str(e)}', 'error')
@@ -730,64 +3661,40 @@ def delete_lesson(lesson_id):
 @app.route('/messages/<int:chat_user_id>')
 @login_required()
 def messages(chat_user_id=None):
-    # Ensure messages table exists
     db = get_db()
-    try:
-        db.execute("SELECT 1 FROM messages LIMIT 1")
-    except:
-        db.execute("""
-            CREATE TABLE messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender_id INTEGER,
-                receiver_id INTEGER,
-                message TEXT,
-                sent_at TEXT,
-                is_read INTEGER DEFAULT 0
-            )
-        """)
-        db.commit()
-    
     user_id = session['user_id']
     user_type = session['user_type']
+    # Read before anything is rendered so the live stream picks up from this point
+    latest_message_id = latest_message()
     
-    # Get all contacts
-    if user_type == 'teacher':
-        contacts = query_db("""
-            SELECT u.id, u.name, u.email, u.user_type,
-                   (SELECT COUNT(*) FROM messages WHERE sender_id = u.id AND receiver_id = ? AND is_read = 0) as unread_count,
-                   (SELECT message FROM messages WHERE (sender_id = u.id AND receiver_id = ?) OR (sender_id = ? AND receiver_id = u.id) ORDER BY sent_at DESC LIMIT 1) as last_message,
-                   (SELECT sent_at FROM messages WHERE (sender_id = u.id AND receiver_id = ?) OR (sender_id = ? AND receiver_id = u.id) ORDER BY sent_at DESC LIMIT 1) as last_message_time
-            FROM users u WHERE u.user_type = 'student'
-            ORDER BY last_message_time DESC, u.name
-        """, (user_id, user_id, user_id, user_id, user_id))
-    else:
-        contacts = query_db("""
-            SELECT u.id, u.name, u.email, u.user_type,
-                   (SELECT COUNT(*) FROM messages WHERE sender_id = u.id AND receiver_id = ? AND is_read = 0) as unread_count,
-                   (SELECT message FROM messages WHERE (sender_id = u.id AND receiver_id = ?) OR (sender_id = ? AND receiver_id = u.id) ORDER BY sent_at DESC LIMIT 1) as last_message,
-                   (SELECT sent_at FROM messages WHERE (sender_id = u.id AND receiver_id = ?) OR (sender_id = ? AND receiver_id = u.id) ORDER BY sent_at DESC LIMIT 1) as last_message_time
-            FROM users u WHERE u.user_type = 'teacher'
-            ORDER BY last_message_time DESC, u.name
-        """, (user_id, user_id, user_id, user_id, user_id))
+    # Teachers talk to students and students to teachers
+    contacts = query_db("""
+        SELECT u.id, u.name, u.email, u.user_type,
+               COALESCE(CASE WHEN c.user_a = ? THEN c.unread_a ELSE c.unread_b END, 0) AS unread_count,
+               c.last_message, c.last_sent_at AS last_message_time
+        FROM users u
+        LEFT JOIN conversations c
+          ON c.user_a = CASE WHEN u.id < ? THEN u.id ELSE ? END
+         AND c.user_b = CASE WHEN u.id < ? THEN ? ELSE u.id END
+        WHERE u.user_type = ?
+        ORDER BY c.last_sent_at IS NULL, c.last_sent_at DESC, u.name
+    """, (user_id, user_id, user_id, user_id, user_id, 'student' if user_type == 'teacher' else 'teacher'))
     
     # Get chat messages if a user is selected
     chat_messages = []
+    next_cursor = None
     selected_user = None
     if chat_user_id:
         selected_user = query_db("SELECT * FROM users WHERE id = ?", (chat_user_id,), one=True)
         if selected_user:
-            chat_messages = query_db("""
-                SELECT m.*, u.name as sender_name FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE (m.sender_id = ? AND m.receiver_id = ?) OR (m.sender_id = ? AND m.receiver_id = ?)
-                ORDER BY m.sent_at ASC
-            """, (user_id, chat_user_id, chat_user_id, user_id))
+            chat_messages, next_cursor = conversation_page(user_id, chat_user_id)
             
             # Mark messages as read
-            db.execute("UPDATE messages SET is_read = 1 WHERE sender_id = ? AND receiver_id = ?", (chat_user_id, user_id))
+            mark_conversation_read(db, user_id, chat_user_id)
             db.commit()
     
-    return render_template('whatsapp_chat.html', contacts=contacts, chat_messages=chat_messages, selected_user=selected_user)
+    return render_template('whatsapp_chat.html', contacts=contacts, chat_messages=chat_messages, selected_user=selected_user,
+                           next_cursor=next_cursor, latest_message_id=latest_message_id)
 
 @app.route('/chat/<int:other_user_id>')
 @login_required()
@@ -799,20 +3706,91 @@ def chat(other_user_id):
         flash('User not found!', 'error')
         return redirect(url_for('messages'))
     
-    # Get chat messages
-    messages = query_db("""
-        SELECT m.*, u.name as sender_name FROM messages m
-        JOIN users u ON m.sender_id = u.id
-        WHERE (m.sender_id = ? AND m.receiver_id = ?) OR (m.sender_id = ? AND m.receiver_id = ?)
-        ORDER BY m.sent_at ASC
-    """, (user_id, other_user_id, other_user_id, user_id))
+    latest_message_id = latest_message()
+    
+    # Get the latest page of chat messages
+    messages, next_cursor = conversation_page(user_id, other_user_id)
     
     # Mark messages as read
     db = get_db()
-    db.execute("UPDATE messages SET is_read = 1 WHERE sender_id = ? AND receiver_id = ?", (other_user_id, user_id))
+    mark_conversation_read(db, user_id, other_user_id)
     db.commit()
     
-    return render_template('chat.html', messages=messages, other_user=other_user)
+    return render_template('chat.html', messages=messages, other_user=other_user, next_cursor=next_cursor,
+                           latest_message_id=latest_message_id)
+
+def conversation_key(user_id, other_id):
+    """(user_a, user_b) primary key of the conversations row for a pair of users."""
+    return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+
+def record_message(db, sender_id, receiver_id, message, sent_at):
+    """Store a message and fold it into its conversations row (caller commits)."""
+    message_id = database.insert(db, "INSERT INTO messages (sender_id, receiver_id, message, sent_at) VALUES (?, ?, ?, ?)",
+                                 (sender_id, receiver_id, message, sent_at))
+    user_a, user_b = conversation_key(sender_id, receiver_id)
+    db.execute("""
+        INSERT INTO conversations (user_a, user_b, last_message_id, last_message, last_sent_at, unread_a, unread_b)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_a, user_b) DO UPDATE SET
+            last_message_id = excluded.last_message_id,
+            last_message = excluded.last_message,
+            last_sent_at = excluded.last_sent_at,
+            unread_a = conversations.unread_a + excluded.unread_a,
+            unread_b = conversations.unread_b + excluded.unread_b
+    """, (user_a, user_b, message_id, message, sent_at, int(receiver_id == user_a), int(receiver_id == user_b)))
+    return message_id
+
+def mark_conversation_read(db, user_id, other_id):
+    """Mark other_id's messages to user_id as read and update the unread counter (caller commits).
+
+    Nothing is scanned while the unread counter is zero, and otherwise only
+    messages from the reader's watermark onwards.
+    """
+    user_a, user_b = conversation_key(user_id, other_id)
+    side = 'a' if user_id == user_a else 'b'
+    conversation = db.execute(f"SELECT unread_{side} AS unread, read_at_{side} AS read_at FROM conversations WHERE user_a = ? AND user_b = ?",
+                              (user_a, user_b)).fetchone()
+    if conversation is None or conversation['unread'] <= 0:
+        return
+    mark = "UPDATE messages SET is_read = 1 WHERE sender_id = ? AND receiver_id = ? AND is_read = 0"
+    marked = db.execute(mark + " AND sent_at >= ? RETURNING sent_at", (other_id, user_id, conversation['read_at'])).fetchall()
+    if len(marked) < conversation['unread']:
+        # A message stamped before the watermark was committed after it moved: sweep the whole thread
+        marked += db.execute(mark + " RETURNING sent_at", (other_id, user_id)).fetchall()
+    if marked:
+        # Subtract what was actually marked so a message arriving meanwhile stays counted
+        read_at = max([conversation['read_at']] + [row['sent_at'] or '' for row in marked])
+        db.execute(f"UPDATE conversations SET unread_{side} = unread_{side} - ?, read_at_{side} = ? WHERE user_a = ? AND user_b = ?",
+                   (len(marked), read_at, user_a, user_b))
+    else:
+        db.execute(f"UPDATE conversations SET unread_{side} = 0 WHERE user_a = ? AND user_b = ?", (user_a, user_b))
+
+def conversation_page(user_id, other_id, before=''):
+    """Newest CHAT_PAGE_SIZE messages between two users older than a `sent_at|id` cursor.
+
+    Returns (messages oldest first, cursor for the next older page or None).
+    """
+    cond, args = "", []
+    before_at, _, before_id = before.rpartition('|')
+    if before_at and before_id.isdigit():
+        cond, args = " AND (sent_at, id) < (?, ?)", [before_at, int(before_id)]
+    limit = CHAT_PAGE_SIZE + 1
+    # One index range per direction, each cut to a page before they are merged
+    rows = query_db(f"""
+        SELECT m.*, u.name AS sender_name FROM (
+            SELECT * FROM (SELECT * FROM messages WHERE sender_id = ? AND receiver_id = ?{cond}
+                           ORDER BY sent_at DESC, id DESC LIMIT ?) sent
+            UNION ALL
+            SELECT * FROM (SELECT * FROM messages WHERE sender_id = ? AND receiver_id = ? AND sender_id <> receiver_id{cond}
+                           ORDER BY sent_at DESC, id DESC LIMIT ?) received
+        ) m JOIN users u ON m.sender_id = u.id
+        ORDER BY m.sent_at DESC, m.id DESC LIMIT ?
+    """, [user_id, other_id, *args, limit, other_id, user_id, *args, limit, limit])
+    next_cursor = None
+    if len(rows) > CHAT_PAGE_SIZE:
+        rows = rows[:CHAT_PAGE_SIZE]
+        next_cursor = f"{rows[-1]['sent_at']}|{rows[-1]['id']}"
+    return rows[::-1], next_cursor
 
 @app.route('/send_message', methods=['POST'])
 @login_required()
@@ -821,17 +3799,89 @@ def send_message():
     receiver_id = data.get('receiver_id')
     message = data.get('message', '').strip()
     
+    try:
+        receiver_id = int(receiver_id)
+    except (TypeError, ValueError):
+        receiver_id = None
     if not message or not receiver_id:
         return jsonify({'success': False, 'error': 'Invalid message'})
     
     sender_id = session['user_id']
     
     db = get_db()
-    db.execute("INSERT INTO messages (sender_id, receiver_id, message, sent_at) VALUES (?, ?, ?, ?)",
-               (sender_id, receiver_id, message, datetime.now().isoformat()))
+    message_id = record_message(db, sender_id, receiver_id, message, datetime.now().isoformat())
     db.commit()
+    message_hub.notify()
     
-    return jsonify({'success': True})
+    saved = query_db(MESSAGE_SELECT + " WHERE m.id = ?", (message_id,), one=True)
+    return jsonify({'success': True, 'message': message_json(saved)})
+
+@app.route('/messages/stream')
+@login_required()
+def message_stream():
+    """Server-Sent Events feed of messages sent to or by the current user."""
+    user_id = session['user_id']
+    # Browsers send Last-Event-ID when they reconnect; ?after= covers the first connection
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+    if not stream_slots.acquire(blocking=False):
+        return Response("Too many live streams on this server; poll for messages instead\n", status=503,
+                        mimetype='text/plain', headers={'Retry-After': '30'})
+
+    def events():
+        sub = message_hub.subscribe(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            # Ids sent during catch-up; the hub may deliver the same messages again
+            caught_up = set()
+            last_id = None if after is None else max(after - MESSAGE_REPLAY_IDS, 0)
+            while last_id is not None:
+                with database.connection() as db:
+                    rows = db.execute(MESSAGE_SELECT + """
+                        WHERE (m.sender_id = ? OR m.receiver_id = ?) AND m.id > ?
+                        ORDER BY m.id LIMIT ?
+                    """, (user_id, user_id, last_id, MESSAGE_BATCH_SIZE)).fetchall()
+                for row in rows:
+                    yield sse_event(message_json(row))
+                    caught_up.add(row['id'])
+                    last_id = row['id']
+                if len(rows) < MESSAGE_BATCH_SIZE:
+                    break
+            while not sub.overflowed:
+                try:
+                    message = sub.queue.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message['id'] not in caught_up:
+                    yield sse_event(message)
+        finally:
+            message_hub.unsubscribe(sub)
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(stream_slots.release)
+    return response
+
+@app.route('/messages/<int:other_user_id>/history')
+@login_required()
+def message_history(other_user_id):
+    """Older messages of a conversation, for "Load older messages"."""
+    rows, next_cursor = conversation_page(session['user_id'], other_user_id, request.args.get('before', ''))
+    return jsonify({'messages': [message_json(r) for r in rows], 'next_cursor': next_cursor})
+
+@app.route('/messages/<int:other_user_id>/since/<int:last_id>')
+@login_required()
+def messages_since(other_user_id, last_id):
+    """Messages in one conversation newer than last_id (replaying MESSAGE_REPLAY_IDS before it), oldest first."""
+    user_id = session['user_id']
+    rows = query_db(MESSAGE_SELECT + """
+        WHERE ((m.sender_id = ? AND m.receiver_id = ?) OR (m.sender_id = ? AND m.receiver_id = ?))
+          AND m.id > ?
+        ORDER BY m.id LIMIT ?
+    """, (user_id, other_user_id, other_user_id, user_id, max(last_id - MESSAGE_REPLAY_IDS, 0), MESSAGE_BATCH_SIZE))
+    return jsonify({'messages': [message_json(r) for r in rows]})
 
 @app.route('/study-notes')
 @login_required('student')
@@ -841,46 +3891,21 @@ def study_notes():
 @app.route('/leaderboard')
 @login_required('student')
 def leaderboard():
-    # Ensure gamification tables exist
-    db = get_db()
-    try:
-        db.execute("SELECT 1 FROM study_streaks LIMIT 1")
-    except:
-        db.execute("""
-            CREATE TABLE study_streaks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                current_streak INTEGER DEFAULT 0,
-                last_activity TEXT,
-                total_points INTEGER DEFAULT 0
-            )
-        """)
-        db.execute("""
-            CREATE TABLE achievements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                badge_type TEXT,
-                earned_at TEXT
-            )
-        """)
-        db.commit()
-    
-    # Get top students by points
-    top_students = query_db("""
-        SELECT u.name, COALESCE(s.total_points, 0) as points, COALESCE(s.current_streak, 0) as streak
-        FROM users u
-        LEFT JOIN study_streaks s ON u.id = s.user_id
-        WHERE u.user_type = 'student'
-        ORDER BY points DESC, streak DESC
-        LIMIT 10
-    """)
+    window = request.args.get('window', 'all')
+    if window not in LEADERBOARD_WINDOWS:
+        window = 'all'
+    user_id = session['user_id']
+    score_buffer.flush(user_id)
+    board = leaderboards.board(window)
     
-    # Get current user's rank
+    # The student's own totals come straight from their row
     user_stats = query_db("""
         SELECT total_points, current_streak FROM study_streaks WHERE user_id = ?
-    """, (session['user_id'],), one=True)
+    """, (user_id,), one=True)
     
-    return render_template('leaderboard.html', top_students=top_students, user_stats=user_stats)
+    return render_template('leaderboard.html', window=window, top_students=board.top(LEADERBOARD_TOP),
+                           neighbours=board.around(user_id, LEADERBOARD_NEIGHBOURS), user_rank=board.rank(user_id),
+                           total_students=len(board), user_stats=user_stats)
 
 @app.route('/math-games')
 @login_required('student')
@@ -896,24 +3921,14 @@ def check_answer():
     
     # Update points and streak
     user_id = session['user_id']
-    db = get_db()
-    
-    # Get or create streak record
-    streak_record = query_db("SELECT * FROM study_streaks WHERE user_id = ?", (user_id,), one=True)
-    
-    if not streak_record:
-        db.execute("INSERT INTO study_streaks (user_id, current_streak, total_points, last_activity) VALUES (?, 0, 0, ?)",
-                   (user_id, datetime.now().isoformat()))
+    is_correct = str(answer) == str(correct)
+    points_earned = POINTS_PER_ANSWER if is_correct else 0
+    if SCORE_FLUSH_INTERVAL > 0:
+        new_streak, new_points = score_buffer.record(user_id, is_correct)
+    else:
+        db = get_db()
+        new_streak, new_points = apply_score(db, user_id, int(is_correct), points_earned, not is_correct)
         db.commit()
-        streak_record = query_db("SELECT * FROM study_streaks WHERE user_id = ?", (user_id,), one=True)
-    
-    points_earned = 10 if str(answer) == str(correct) else 0
-    new_streak = streak_record['current_streak'] + 1 if points_earned > 0 else 0
-    new_points = streak_record['total_points'] + points_earned
-    
-    db.execute("UPDATE study_streaks SET current_streak = ?, total_points = ?, last_activity = ? WHERE user_id = ?",
-               (new_streak, new_points, datetime.now().isoformat(), user_id))
-    db.commit()
     
     return jsonify({
         'correct': str(answer) == str(correct),
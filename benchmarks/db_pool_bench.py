@@ -0,0 +1,57 @@
+"""Per-request database overhead benchmark.
+
+Runs a request-sized unit of work (acquire the request connection, run one
+indexed read, tear down the app context) with the connection pool enabled and
+with DB_POOL_SIZE=0, which opens and configures a fresh connection per request:
+
+    python benchmarks/db_pool_bench.py --requests 5000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(n_requests):
+    import app
+
+    app.init_db()
+    timings = []
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        with app.app.app_context():
+            app.query_db("SELECT id FROM users WHERE email = ?", ("student@smartlearning.com",), one=True)
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    print(f"{statistics.median(timings):.1f} {timings[int(len(timings) * 0.99) - 1]:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run(args.requests)
+        return
+
+    with tempfile.TemporaryDirectory() as work:
+        print(f"{'mode':<24} {'p50 us':>8} {'p99 us':>8}")
+        for label, pool_size in (('fresh connection', '0'), ('pooled (DB_POOL_SIZE=8)', '8')):
+            env = dict(os.environ, DATABASE_URL=os.path.join(work, 'bench.db'),
+                       DB_POOL_SIZE=pool_size, PYTHONPATH=REPO)
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child',
+                                  '--requests', str(args.requests)],
+                                 cwd=work, env=env, capture_output=True, text=True, check=True)
+            p50, p99 = out.stdout.split()
+            print(f"{label:<24} {float(p50):8.1f} {float(p99):8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,463 @@
+"""Student and teacher flow load test.
+
+Seeds a synthetic database (students, teachers, lessons with quizzes, past
+attempts and chat history), then drives each traffic mix with --concurrency
+virtual users for --duration seconds, both in-process (Flask test client on
+threads) and through gunicorn over HTTP. Reports throughput, p50/p95/p99
+latency per endpoint, server errors and database lock errors:
+
+    python benchmarks/load_bench.py --students 500 --duration 20 --json before.json
+    python benchmarks/load_bench.py --students 500 --duration 20 --compare before.json
+
+Mixes:
+    student   login, /student, /quiz/<id>, /submit_quiz (and its result)
+    teacher   login, /attempts (all and per quiz), /teacher
+    messages  login, /messages, /send_message, /messages/<id>/history
+    chatbot   bursts of /chatbot questions
+    math      /check-answer storms
+
+Every mode starts from a copy of the same seeded SQLite file. --database-url
+runs against an empty PostgreSQL database instead (seeded once, modes share it).
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIXES = ('student', 'teacher', 'messages', 'chatbot', 'math')
+PASSWORD = 'bench-password'
+LOCK_ERRORS = re.compile(r'database is locked|database table is locked|deadlock detected|could not obtain lock|'
+                         r'lock timeout', re.IGNORECASE)
+CHATBOT_QUESTIONS = [
+    "What is a fraction?", "How do I add fractions?", "convert fractions to decimals", "how to take a quiz",
+    "I'm struggling with math", "How to study effectively?", "hello", "thanks!", "what is a numerator",
+    "Can I retake a quiz?", "How are recommendations generated?", "how do i track my progress",
+]
+
+
+# -----------------------
+# Seeding (runs in a child process so the app binds to the benchmark database)
+# -----------------------
+def seed(args):
+    import app
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(args.seed)
+    app.init_db()
+    now = time.time()
+    password_hash = generate_password_hash(PASSWORD)  # one hash for everyone; login still verifies it
+    with app.database.connection() as db:
+        teacher_ids, student_ids = [], []
+        for i in range(args.teachers):
+            teacher_ids.append(app.database.insert(
+                db, "INSERT INTO users (name, email, password_hash, user_type, created_at) VALUES (?,?,?,?,?)",
+                (f"Teacher {i}", f"teacher{i}@bench.local", password_hash, 'teacher', app.datetime.now().isoformat())))
+        db.executemany("INSERT INTO users (name, email, password_hash, user_type, created_at) VALUES (?,?,?,?,?)",
+                       [(f"Student {i}", f"student{i}@bench.local", password_hash, 'student',
+                         app.datetime.now().isoformat()) for i in range(args.students)])
+        student_ids = [r[0] for r in db.execute("SELECT id FROM users WHERE email LIKE 'student%@bench.local' ORDER BY id")]
+
+        quiz_ids = []
+        for i in range(args.lessons):
+            lesson_id = app.database.insert(
+                db, "INSERT INTO lessons (title, description, video_url, created_at) VALUES (?,?,?,?)",
+                (f"Lesson {i}", f"Synthetic lesson {i}", '', app.datetime.now().isoformat()))
+            quiz_id = app.database.insert(db, "INSERT INTO quizzes (lesson_id, title) VALUES (?,?)",
+                                          (lesson_id, f"Lesson {i} Quiz"))
+            app.save_questions(db, quiz_id, [
+                {'id': None, 'question': f"L{i} question {n}: {n} + {i} = ?",
+                 'options': [str(n + i), str(n + i + 1), str(n + i + 2), str(n + i + 3)],
+                 'answer_index': 0, 'topic': f"topic{n % 5}"}
+                for n in range(args.questions)])
+            quiz_ids.append(quiz_id)
+
+        topics = [f"topic{n}" for n in range(5)]
+        db.executemany("INSERT INTO attempts (student_name, quiz_id, score, detail, taken_at) VALUES (?,?,?,?,?)", [
+            (f"Student {rng.randrange(args.students)}", rng.choice(quiz_ids), round(rng.uniform(0, 100), 2),
+             json.dumps({t: {'right': rng.randint(0, 2), 'total': 2} for t in topics}),
+             app.datetime.fromtimestamp(now - rng.uniform(0, 60 * 86400)).isoformat())
+            for _ in range(args.attempts)])
+
+        people = student_ids + teacher_ids
+        sent = sorted(now - rng.uniform(0, 30 * 86400) for _ in range(args.messages))
+        for sent_at in sent:
+            sender, receiver = rng.sample(people, 2)
+            app.record_message(db, sender, receiver, f"Synthetic message {rng.random():.6f}",
+                               app.datetime.fromtimestamp(sent_at).isoformat())
+        db.commit()
+    print(json.dumps({'quiz_ids': quiz_ids, 'student_ids': student_ids, 'teacher_ids': teacher_ids,
+                      'students': args.students, 'teachers': args.teachers}))
+
+
+# -----------------------
+# Clients
+# -----------------------
+class InProcessClient:
+    """Flask test client; keeps the session cookie like a browser."""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, json_body=None, form=None, headers=None):
+        resp = self.client.open(path, method=method, json=json_body, data=form, headers=headers or {})
+        return resp.status_code, resp.get_data()
+
+
+class HttpClient:
+    """Keep-alive HTTP/1.1 connection with a minimal cookie jar."""
+
+    def __init__(self, base):
+        parts = urllib.parse.urlsplit(base)
+        self.host, self.port = parts.hostname, parts.port
+        self.conn = None
+        self.cookies = {}
+
+    def request(self, method, path, json_body=None, form=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if json_body is not None:
+            body, headers['Content-Type'] = json.dumps(json_body), 'application/json'
+        elif form is not None:
+            body, headers['Content-Type'] = urllib.parse.urlencode(form), 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        for cookie in resp.msg.get_all('Set-Cookie') or ():
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            self.cookies[name.strip()] = value.strip()
+        return resp.status, data
+
+
+# -----------------------
+# Virtual users and mixes
+# -----------------------
+class VirtualUser:
+    def __init__(self, client, manifest, rng, recorder):
+        self.client = client
+        self.manifest = manifest
+        self.rng = rng
+        self.recorder = recorder
+        self.logged_in = False
+
+    def call(self, label, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, body = self.client.request(method, path, **kwargs)
+        except Exception:
+            self.recorder(label, time.perf_counter() - start, 0)
+            raise
+        self.recorder(label, time.perf_counter() - start, status)
+        return status, body
+
+    def login(self, teacher=False):
+        if self.logged_in:
+            return
+        if teacher:
+            email = f"teacher{self.rng.randrange(self.manifest['teachers'])}@bench.local"
+        else:
+            email = f"student{self.rng.randrange(self.manifest['students'])}@bench.local"
+        status, _ = self.call('POST /login', 'POST', '/login', form={'email': email, 'password': PASSWORD})
+        self.logged_in = status == 302
+
+
+def student_flow(vu):
+    vu.login()
+    vu.call('GET /student', 'GET', '/student')
+    quiz_id = vu.rng.choice(vu.manifest['quiz_ids'])
+    _, page = vu.call('GET /quiz/<id>', 'GET', f'/quiz/{quiz_id}')
+    question_ids = re.findall(rb'name="q(\d+)"', page)
+    answers = {qid.decode(): vu.rng.randrange(4) for qid in dict.fromkeys(question_ids)}
+    status, body = vu.call('POST /submit_quiz', 'POST', '/submit_quiz', json_body={'quiz_id': quiz_id, 'answers': answers},
+                           headers={'Idempotency-Key': f'{vu.rng.random():.17f}'})
+    if status == 202:
+        vu.call('GET /submissions/<id>', 'GET', json.loads(body)['result_url'] + '?wait=10')
+
+
+def teacher_flow(vu):
+    vu.login(teacher=True)
+    vu.call('GET /attempts', 'GET', '/attempts')
+    vu.call('GET /attempts?quiz_id', 'GET', f"/attempts?quiz_id={vu.rng.choice(vu.manifest['quiz_ids'])}")
+    vu.call('GET /teacher', 'GET', '/teacher')
+
+
+def messages_flow(vu):
+    vu.login()
+    other = vu.rng.choice(vu.manifest['student_ids'] + vu.manifest['teacher_ids'])
+    vu.call('GET /messages', 'GET', '/messages')
+    vu.call('POST /send_message', 'POST', '/send_message',
+            json_body={'receiver_id': other, 'message': f'load test {vu.rng.random():.6f}'})
+    vu.call('GET /messages/<id>/history', 'GET', f'/messages/{other}/history')
+
+
+def chatbot_flow(vu):
+    vu.login()
+    for _ in range(5):
+        vu.call('POST /chatbot', 'POST', '/chatbot', json_body={'q': vu.rng.choice(CHATBOT_QUESTIONS)})
+
+
+def math_flow(vu):
+    vu.login()
+    for _ in range(10):
+        a, b = vu.rng.randint(1, 20), vu.rng.randint(1, 20)
+        answer = a + b if vu.rng.random() < 0.8 else a + b + 1
+        vu.call('POST /check-answer', 'POST', '/check-answer', json_body={'answer': answer, 'correct': a + b})
+
+
+FLOWS = {
+    'student': student_flow,
+    'teacher': teacher_flow,
+    'messages': messages_flow,
+    'chatbot': chatbot_flow,
+    'math': math_flow,
+}
+
+
+class LockErrorCounter(logging.Handler):
+    """Counts server log records that report a database lock problem (in-process mode)."""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record):
+        text = record.getMessage()
+        if record.exc_info:
+            text += ' ' + repr(record.exc_info[1])
+        if LOCK_ERRORS.search(text):
+            self.count += 1
+
+
+def run_mix(mix, make_client, manifest, args, lock_errors):
+    """Drive one mix and return its summary."""
+    samples = defaultdict(list)
+    failures = defaultdict(int)
+    lock = threading.Lock()
+
+    def recorder(label, seconds, status):
+        with lock:
+            samples[label].append(seconds)
+            if status == 0 or status >= 500:
+                failures[label] += 1
+
+    # One untimed pass warms caches (chatbot index, quiz payloads, templates)
+    FLOWS[mix](VirtualUser(make_client(), manifest, random.Random(-1), lambda *a: None))
+    # Log every virtual user in before the clock starts; password hashing would otherwise dominate the tail
+    ready = threading.Barrier(args.concurrency + 1)
+    clock = {}
+
+    def user(n):
+        vu = VirtualUser(make_client(), manifest, random.Random(args.seed * 1000 + n), lambda *a: None)
+        try:
+            vu.login(teacher=mix == 'teacher')
+        finally:
+            vu.recorder = recorder
+            ready.wait()
+        while time.monotonic() < clock['deadline']:
+            try:
+                FLOWS[mix](vu)
+            except Exception:
+                vu.logged_in = False
+
+    threads = [threading.Thread(target=user, args=(n,), daemon=True) for n in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    before = lock_errors()
+    start = time.monotonic()
+    clock['deadline'] = start + args.duration
+    ready.wait()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    return summarize(samples, failures, elapsed, lock_errors() - before)
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))] * 1000
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)} if values else {'p50': 0, 'p95': 0, 'p99': 0}
+
+
+def summarize(samples, failures, elapsed, lock_errors):
+    everything = [s for values in samples.values() for s in values]
+    return dict(percentiles(everything), requests=len(everything), rps=len(everything) / elapsed,
+                errors=sum(failures.values()), lock_errors=lock_errors,
+                endpoints={label: dict(percentiles(values), requests=len(values), rps=len(values) / elapsed,
+                                       errors=failures[label])
+                           for label, values in sorted(samples.items())})
+
+
+def run_inprocess(args, manifest):
+    """Child process entry: drive every mix against the imported app and print the results."""
+    import app
+    counter = LockErrorCounter()
+    app.app.logger.addHandler(counter)
+    results = {mix: run_mix(mix, lambda: InProcessClient(app.app), manifest, args, lambda: counter.count)
+               for mix in args.mixes}
+    print(json.dumps(results))
+
+
+def wait_ready(base, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, _ = HttpClient(base).request('GET', '/login')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"server at {base} did not start")
+
+
+def run_gunicorn(args, manifest, env, work):
+    log_path = os.path.join(work, 'gunicorn.log')
+    base = f'http://127.0.0.1:{args.port}'
+    with open(log_path, 'w') as log:
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO, 'gunicorn.conf.py'),
+                                   '--bind', f'127.0.0.1:{args.port}', '--workers', str(args.workers), 'app:app'],
+                                  cwd=work, env=env, stdout=log, stderr=log)
+    try:
+        wait_ready(base)
+
+        def lock_errors():
+            with open(log_path, errors='replace') as f:
+                return len(LOCK_ERRORS.findall(f.read()))
+
+        return {mix: run_mix(mix, lambda: HttpClient(base), manifest, args, lock_errors) for mix in args.mixes}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+# -----------------------
+# Reporting
+# -----------------------
+def report(results, previous=None):
+    header = f"{'mode/mix':<20} {'endpoint':<28} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}"
+    print(header)
+    print('-' * len(header))
+    for mode, mixes in results.items():
+        for mix, summary in mixes.items():
+            name = f"{mode}/{mix}"
+            rows = [('ALL', summary)] + list(summary['endpoints'].items())
+            for label, row in rows:
+                line = (f"{name:<20} {label:<28} {row['requests']:>7} {row['rps']:>8.1f} {row['p50']:>8.1f} "
+                        f"{row['p95']:>8.1f} {row['p99']:>8.1f} {row['errors']:>6}")
+                old = previous.get(mode, {}).get(mix) if previous else None
+                if old and label != 'ALL':
+                    old = old['endpoints'].get(label)
+                if old and old['rps']:
+                    line += f"   req/s {(row['rps'] / old['rps'] - 1) * 100:+.0f}%, p95 {row['p95'] - old['p95']:+.1f} ms"
+                print(line)
+                name = ''
+            print(f"{'':<20} {'db lock errors':<28} {summary['lock_errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--teachers', type=int, default=5)
+    parser.add_argument('--lessons', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=10, help='questions per quiz')
+    parser.add_argument('--attempts', type=int, default=20000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--mixes', default=','.join(MIXES), help='comma-separated subset of: ' + ', '.join(MIXES))
+    parser.add_argument('--modes', default='inprocess,gunicorn')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per mix')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--port', type=int, default=5097)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url', help='empty PostgreSQL database to use instead of SQLite files')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file from an earlier run to compare against')
+    parser.add_argument('--child', choices=('seed', 'inprocess'), help=argparse.SUPPRESS)
+    parser.add_argument('--manifest', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.mixes = [m for m in args.mixes.split(',') if m]
+    unknown = set(args.mixes) - set(MIXES)
+    if unknown:
+        parser.error(f"unknown mixes: {', '.join(sorted(unknown))}")
+
+    if args.child == 'seed':
+        seed(args)
+        return
+    if args.child == 'inprocess':
+        with open(args.manifest) as f:
+            run_inprocess(args, json.load(f))
+        return
+
+    with tempfile.TemporaryDirectory() as work:
+        base_env = dict(os.environ, PYTHONPATH=REPO, FLASK_ENV='production', SECRET_KEY='load-bench')
+        seed_url = args.database_url or os.path.join(work, 'seed.db')
+        passthrough = [f'--{k}={getattr(args, k)}' for k in ('students', 'teachers', 'lessons', 'questions',
+                                                              'attempts', 'messages', 'seed', 'duration',
+                                                              'concurrency')]
+        start = time.monotonic()
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', 'seed'] + passthrough,
+                             cwd=work, env=dict(base_env, DATABASE_URL=seed_url),
+                             capture_output=True, text=True, check=True)
+        manifest = json.loads(out.stdout.strip().splitlines()[-1])
+        manifest_path = os.path.join(work, 'manifest.json')
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        print(f"seeded {args.students} students, {args.lessons} quizzes, {args.attempts} attempts, "
+              f"{args.messages} messages in {time.monotonic() - start:.1f}s")
+
+        def fresh_database(mode):
+            if args.database_url:
+                return args.database_url
+            path = os.path.join(work, f'{mode}.db')
+            with sqlite3.connect(seed_url) as src, sqlite3.connect(path) as dst:
+                src.backup(dst)
+            return path
+
+        results = {}
+        for mode in [m for m in args.modes.split(',') if m]:
+            env = dict(base_env, DATABASE_URL=fresh_database(mode))
+            if mode == 'inprocess':
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', 'inprocess',
+                                      '--manifest', manifest_path, '--mixes', ','.join(args.mixes)] + passthrough,
+                                     cwd=work, env=env, capture_output=True, text=True, check=True)
+                results[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+            elif mode == 'gunicorn':
+                results[mode] = run_gunicorn(args, manifest, env, work)
+            else:
+                parser.error(f"unknown mode {mode!r}")
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    report(results, previous)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Chatbot retriever benchmark.
+
+Compares the CHATBOT_RETRIEVER backends on the built-in FAQ_PAIRS corpus:
+per-query latency, resident memory of a worker after building the index, and
+top-1 accuracy on the FAQ questions plus a set of student-style paraphrases.
+Each backend runs in its own interpreter so memory figures do not mix:
+
+    python benchmarks/retriever_bench.py --queries 2000
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ['sklearn', 'numpy', 'bm25']
+
+# (paraphrase, FAQ question it should retrieve)
+PARAPHRASES = [
+    ("join a live class", "How do I join live class?"),
+    ("attempt the quiz", "How to attempt quiz?"),
+    ("how do recommendations get generated", "How are recommendations generated?"),
+    ("forgot password", "I forgot my password"),
+    ("track progress", "How do I track my progress?"),
+    ("retake quiz again", "Can I retake a quiz?"),
+    ("explain fraction meaning", "What is a fraction?"),
+    ("add two fractions", "How to add fractions?"),
+    ("convert to decimal", "Convert 3/4 to decimal"),
+    ("equivalent fractions", "What is equivalent fraction?"),
+    ("subtract fractions", "How to subtract fractions?"),
+    ("study effectively at home", "How to study effectively?"),
+    ("struggling in math class", "I'm struggling with math"),
+    ("tips rural students", "Tips for rural students"),
+    ("ai tutoring work", "How does AI tutoring work?"),
+    ("video not loading", "Video not loading"),
+    ("quiz not submitting", "Quiz not submitting"),
+    ("contact my teacher", "How to contact teacher?"),
+    ("feel discouraged today", "I feel discouraged"),
+    ("smart enough", "Am I smart enough?"),
+]
+
+
+def rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_backend(backend, n_queries):
+    """Runs inside a child interpreter and prints one JSON result line."""
+    import app
+
+    base_rss = rss_mb()
+    questions = [q for q, a in app.FAQ_PAIRS]
+    start = time.perf_counter()
+    retriever = app.make_retriever(questions, backend)
+    build_ms = (time.perf_counter() - start) * 1000
+    index_rss = rss_mb()
+
+    labelled = [(q, q) for q in questions] + PARAPHRASES
+    scores = retriever.similarities_many([text for text, _ in labelled])
+    top1 = sum(questions[row.argmax()] == expected for row, (_, expected) in zip(scores, labelled))
+    answered = sum(row.max() > 0.3 and questions[row.argmax()] == expected
+                   for row, (_, expected) in zip(scores, labelled))
+
+    rng = random.Random(42)
+    vocab = " ".join(text for text, _ in labelled).lower().replace('?', '').split()
+    queries = [" ".join(rng.choice(vocab) for _ in range(rng.randint(2, 8))) for _ in range(n_queries)]
+    retriever.similarities_many(queries[:10])
+    latencies = []
+    for q in queries:
+        t = time.perf_counter()
+        retriever.similarities_many([q])
+        latencies.append((time.perf_counter() - t) * 1e6)
+    t = time.perf_counter()
+    retriever.similarities_many(queries)
+    batch_us = (time.perf_counter() - t) * 1e6 / len(queries)
+
+    latencies.sort()
+    print(json.dumps({
+        'backend': backend,
+        'build_ms': build_ms,
+        'p50_us': statistics.median(latencies),
+        'p95_us': latencies[int(len(latencies) * 0.95) - 1],
+        'batch_us': batch_us,
+        'rss_app_mb': base_rss,
+        'rss_index_mb': index_rss,
+        'top1': top1 / len(labelled),
+        'answered': answered / len(labelled),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--backend', choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        run_backend(args.backend, args.queries)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as work:
+        env = dict(os.environ, DATABASE_URL=os.path.join(work, 'bench.db'), PYTHONPATH=REPO)
+        for backend in BACKENDS:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--backend', backend,
+                                  '--queries', str(args.queries)],
+                                 cwd=work, env=env, capture_output=True, text=True, check=True)
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    header = f"{'backend':<8} {'build ms':>9} {'p50 us':>8} {'p95 us':>8} {'batch us/q':>10} " \
+             f"{'RSS app MB':>10} {'RSS +index MB':>13} {'top-1':>6} {'>0.3 & right':>12}"
+    print(header)
+    for r in results:
+        print(f"{r['backend']:<8} {r['build_ms']:9.1f} {r['p50_us']:8.1f} {r['p95_us']:8.1f} "
+              f"{r['batch_us']:10.1f} {r['rss_app_mb']:10.1f} {r['rss_index_mb']:13.1f} "
+              f"{r['top1']:6.0%} {r['answered']:12.0%}")
+
+
+if __name__ == '__main__':
+    main()
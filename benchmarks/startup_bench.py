@@ -0,0 +1,104 @@
+"""Worker start-up benchmark.
+
+Times a cold ``import app`` in fresh interpreters (what every gunicorn worker
+and the Dockerfile's init step pay), the extra cost of building the chatbot
+index, and optionally the same import at an older git revision so the effect
+of lazy loading can be compared before/after:
+
+    python benchmarks/startup_bench.py --runs 7 --ref baseline-commit
+    python benchmarks/startup_bench.py --gunicorn
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_snippet(snippet, app_dir, runs):
+    """Median wall time (seconds) of running snippet in a fresh interpreter."""
+    code = ("import time; t = time.perf_counter(); " + snippet +
+            "; print(time.perf_counter() - t)")
+    samples = []
+    with tempfile.TemporaryDirectory() as work:
+        env = dict(os.environ, DATABASE_URL=os.path.join(work, 'bench.db'),
+                   PYTHONPATH=app_dir, PYTHONDONTWRITEBYTECODE='1')
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, '-c', code], cwd=work, env=env,
+                                 capture_output=True, text=True, check=True)
+            samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def checkout_app(ref, dest):
+    source = subprocess.run(['git', 'show', f'{ref}:app.py'], cwd=REPO,
+                            capture_output=True, text=True, check=True).stdout
+    with open(os.path.join(dest, 'app.py'), 'w') as f:
+        f.write(source)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def time_gunicorn_boot(timeout=60):
+    """Seconds from spawning a one-worker gunicorn to its first served page."""
+    port = free_port()
+    with tempfile.TemporaryDirectory() as work:
+        env = dict(os.environ, DATABASE_URL=os.path.join(work, 'bench.db'))
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', '1',
+                                 '--bind', f'127.0.0.1:{port}', 'app:app'],
+                                cwd=REPO, env=env, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        try:
+            while time.perf_counter() - start < timeout:
+                try:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=1)
+                    return time.perf_counter() - start
+                except OSError:
+                    time.sleep(0.02)
+            raise RuntimeError('gunicorn did not start serving in time')
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--ref', help='git revision to compare against (e.g. the commit before lazy loading)')
+    parser.add_argument('--gunicorn', action='store_true', help='also time a real gunicorn worker boot')
+    args = parser.parse_args()
+
+    rows = [
+        ('import app (current)', time_snippet('import app', REPO, args.runs)),
+        ('import app + chatbot index (current)',
+         time_snippet('import app; app.faq_store.index', REPO, args.runs)),
+    ]
+    if args.ref:
+        old_dir = tempfile.mkdtemp()
+        try:
+            checkout_app(args.ref, old_dir)
+            rows.append((f'import app ({args.ref})', time_snippet('import app', old_dir, args.runs)))
+        finally:
+            shutil.rmtree(old_dir)
+    if args.gunicorn:
+        rows.append(('gunicorn worker boot to first page', time_gunicorn_boot()))
+
+    width = max(len(name) for name, _ in rows)
+    for name, seconds in rows:
+        print(f'{name:<{width}}  {seconds * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Video streaming under load benchmark.
+
+Starts gunicorn on a scratch database with one lesson video, then opens
+--streams slow clients that play the video the way a browser does (Range
+requests of --range-size bytes, pausing between them) while timing ordinary
+page requests. Reports page latency percentiles with and without the streams
+and the aggregate video throughput:
+
+    python benchmarks/video_stream_bench.py --streams 40 --video-mb 64
+
+Pass --url (and --video) to run the same load against an existing deployment,
+e.g. gunicorn behind nginx with MEDIA_OFFLOAD=x-accel.
+"""
+import argparse
+import http.client
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VIDEO_NAME = 'bench_video.mp4'
+
+
+def connect(base):
+    parts = urllib.parse.urlsplit(base)
+    cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return cls(parts.hostname, parts.port, timeout=30)
+
+
+def wait_ready(base, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = connect(base)
+            conn.request('GET', '/login')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"server at {base} did not start")
+
+
+def stream(base, path, range_size, pause, stop, stats):
+    """Play the video in Range chunks until stopped, looping at the end."""
+    conn = connect(base)
+    offset = 0
+    while not stop.is_set():
+        try:
+            conn.request('GET', path, headers={'Range': f'bytes={offset}-{offset + range_size - 1}'})
+            response = conn.getresponse()
+            body = response.read()
+        except OSError:
+            stats['errors'] += 1
+            conn = connect(base)
+            continue
+        if response.status == 416 or (response.status == 206 and len(body) < range_size):
+            offset = 0
+        elif response.status == 206:
+            offset += len(body)
+        else:
+            stats['errors'] += 1
+        stats['bytes'] += len(body)
+        stop.wait(pause)
+
+
+def page_latencies(base, path, count):
+    conn = connect(base)
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        conn.request('GET', path)
+        conn.getresponse().read()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings
+
+
+def percentile(timings, q):
+    return timings[min(len(timings) - 1, int(len(timings) * q))]
+
+
+def run(base, video_path, args):
+    idle = page_latencies(base, args.page, args.requests)
+
+    stop = threading.Event()
+    stats = {'bytes': 0, 'errors': 0}
+    threads = [threading.Thread(target=stream, daemon=True,
+                                args=(base, video_path, args.range_size, args.pause, stop, stats))
+               for _ in range(args.streams)]
+    for t in threads:
+        t.start()
+    time.sleep(1)
+    start, start_bytes = time.monotonic(), stats['bytes']
+    loaded = page_latencies(base, args.page, args.requests)
+    elapsed = time.monotonic() - start
+    stop.set()
+    for t in threads:
+        t.join(timeout=5)
+
+    print(f"{'page ' + args.page:<28} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, timings in (('idle', idle), (f'{args.streams} video streams', loaded)):
+        print(f"{label:<28} {statistics.median(timings):8.1f} "
+              f"{percentile(timings, 0.95):8.1f} {percentile(timings, 0.99):8.1f}")
+    mbps = (stats['bytes'] - start_bytes) / elapsed / 1e6
+    print(f"video throughput {mbps:.1f} MB/s, stream errors {stats['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200, help='page requests per phase')
+    parser.add_argument('--page', default='/login')
+    parser.add_argument('--range-size', type=int, default=1024 * 1024)
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds between Range requests per stream')
+    parser.add_argument('--video-mb', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=5098)
+    parser.add_argument('--url', help='benchmark a running server instead of starting gunicorn')
+    parser.add_argument('--video', default=VIDEO_NAME, help='uploaded video file name (with --url)')
+    args = parser.parse_args()
+
+    video_path = '/uploads/videos/' + urllib.parse.quote(args.video)
+    if args.url:
+        run(args.url.rstrip('/'), video_path, args)
+        return
+
+    with tempfile.TemporaryDirectory() as work:
+        # The app serves uploads relative to its own directory, so run a copy of it
+        shutil.copy(os.path.join(REPO, 'app.py'), work)
+        for folder in ('templates', 'static'):
+            shutil.copytree(os.path.join(REPO, folder), os.path.join(work, folder))
+        os.makedirs(os.path.join(work, 'uploads', 'videos'))
+        with open(os.path.join(work, 'uploads', 'videos', VIDEO_NAME), 'wb') as f:
+            for _ in range(args.video_mb):
+                f.write(os.urandom(1024 * 1024))
+        env = dict(os.environ, DATABASE_URL=os.path.join(work, 'bench.db'), PYTHONPATH=work,
+                   FLASK_ENV='production')
+        subprocess.run([sys.executable, '-c', 'import app; app.init_db()'], cwd=work, env=env, check=True)
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO, 'gunicorn.conf.py'),
+                                   '--bind', f'127.0.0.1:{args.port}', '--workers', str(args.workers),
+                                   '--chdir', work, 'app:app'],
+                                  cwd=work, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base = f'http://127.0.0.1:{args.port}'
+            wait_ready(base)
+            run(base, video_path, args)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# Gunicorn settings for Smart Learning Cloud (picked up automatically from the
+# working directory by `gunicorn app:app`).
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:' + os.environ.get('PORT', '5000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Each open /messages/stream (Server-Sent Events) connection keeps a thread
+# busy for as long as the chat page is open, so use threaded workers. The app
+# lets streams take at most SSE_MAX_STREAMS (half the threads by default) per
+# worker; chat pages beyond that poll, so ordinary requests always get a thread.
+worker_class = 'gthread'
+# The app sizes its database pool (DB_POOL_SIZE) from GUNICORN_THREADS, so set
+# the thread count through that variable rather than --threads.
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+
+def post_worker_init(worker):
+    """Optionally build the chatbot index right after a worker boots.
+
+    The app loads scikit-learn lazily on the first /chatbot request. Set
+    CHATBOT_WARMUP=1 to build it on a background thread as soon as the worker
+    has imported the app instead, so the first student question is fast
+    without slowing down worker boot.
+    """
+    if os.environ.get('CHATBOT_WARMUP') == '1':
+        from app import faq_store
+        faq_store.warm_up()
@@ -1,6 +1,15 @@
 // Chat functionality is now handled in individual page scripts
 
 // Enhanced Quiz Functionality with better UX
+// One key per attempt: a retried submit is recognised by the server and recorded once
+const QUIZ_RESULT_TIMEOUT = 120000;
+let quizSubmitKey = newSubmitKey();
+
+function newSubmitKey() {
+  return (window.crypto && crypto.randomUUID) ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
 async function submitQuiz(quiz_id) {
   // Validation - check if all questions are answered
   
@@ -28,16 +37,22 @@ async function submitQuiz(quiz_id) {
       answers[questionId] = parseInt(input.value);
     });
     
-    const res = await fetch('/submit_quiz', {
+    const res = await fetchWithRetry('/submit_quiz', {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: { 'Content-Type': 'application/json', 'Idempotency-Key': quizSubmitKey },
       body: JSON.stringify({
         quiz_id: quiz_id,
         answers: answers
       })
     });
     
-    const data = await res.json();
+    let data = await quizResponse(res);
+    if (res.status === 202) {
+      submitBtn.innerHTML = '⏳ Grading...';
+      data = await waitForQuizResult(data.result_url);
+    }
+    // The attempt is recorded; submitting again is a new attempt
+    quizSubmitKey = newSubmitKey();
     showQuizResults(data);
     
   } catch (error) {
@@ -49,6 +64,36 @@ async function submitQuiz(quiz_id) {
   }
 }
 
+async function fetchWithRetry(url, options, attempts = 3) {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      const res = await fetch(url, options);
+      if (res.status < 500 || attempt >= attempts) return res;
+    } catch (error) {
+      if (attempt >= attempts) throw error;
+    }
+    await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+  }
+}
+
+async function waitForQuizResult(resultUrl) {
+  // Each request is held by the server until the result is ready (or ~10s pass)
+  const deadline = Date.now() + QUIZ_RESULT_TIMEOUT;
+  while (Date.now() < deadline) {
+    const res = await fetchWithRetry(`${resultUrl}?wait=10`, {});
+    if (res.status !== 202) return quizResponse(res);
+  }
+  throw new Error('Timed out waiting for the quiz result');
+}
+
+async function quizResponse(res) {
+  const data = await res.json();
+  // A submission that could not be graded stays failed; trying again needs a new key
+  if (data.status === 'failed') quizSubmitKey = newSubmitKey();
+  if (!res.ok) throw new Error(data.error || `Quiz request failed with ${res.status}`);
+  return data;
+}
+
 function showQuizResults(data) {
   const resultDiv = document.getElementById('result');
   resultDiv.style.display = 'block';
@@ -116,8 +161,135 @@ function formatDate(dateString) {
   return date.toLocaleDateString() + ' at ' + date.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
 }
 
+// Resumable video uploads: the file is sent to /uploads in chunks, so a dropped
+// connection only repeats the current chunk and a retried submit resumes where it stopped.
+const UPLOAD_RETRY_DELAYS = [1000, 2000, 5000, 10000, 30000];
+
+async function sha256Hex(buffer) {
+  if (!window.crypto || !crypto.subtle) return null;  // only available on https/localhost
+  const hash = await crypto.subtle.digest('SHA-256', buffer);
+  return Array.from(new Uint8Array(hash)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// fetch() that retries network errors and server errors with backoff
+async function uploadRequest(url, options) {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await fetch(url, options);
+      if (response.status < 500) return response;
+    } catch (err) {
+      // connection dropped; retry below
+    }
+    if (attempt >= UPLOAD_RETRY_DELAYS.length) throw new Error('Upload interrupted');
+    await new Promise(resolve => setTimeout(resolve, UPLOAD_RETRY_DELAYS[attempt]));
+  }
+}
+
+async function uploadVideoInChunks(file, onProgress) {
+  const key = `upload:${file.name}:${file.size}:${file.lastModified}`;
+  let state = null;
+  
+  const savedId = localStorage.getItem(key);
+  if (savedId) {
+    const response = await uploadRequest(`/uploads/${savedId}`, {});
+    if (response.ok) state = await response.json();
+  }
+  if (!state) {
+    // Whole-file checksum, checked by the server before the video is published
+    let checksum = null;
+    try {
+      checksum = await sha256Hex(await file.arrayBuffer());
+    } catch (err) {
+      // too large to hash in memory; the per-chunk checksums still apply
+    }
+    const response = await uploadRequest('/uploads', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size, sha256: checksum })
+    });
+    state = await response.json();
+    if (!response.ok) throw new Error(state.error || 'Upload failed');
+    localStorage.setItem(key, state.upload_id);
+  }
+  
+  let failures = 0;
+  while (state.offset < state.size) {
+    onProgress(state.offset / state.size);
+    const chunk = await file.slice(state.offset, state.offset + state.chunk_size).arrayBuffer();
+    const headers = { 'Content-Type': 'application/octet-stream' };
+    const checksum = await sha256Hex(chunk);
+    if (checksum) headers['X-Chunk-SHA256'] = checksum;
+    
+    const response = await uploadRequest(`/uploads/${state.upload_id}?offset=${state.offset}`, {
+      method: 'PUT', headers: headers, body: chunk
+    });
+    const data = await response.json();
+    if (response.ok || response.status === 409) {
+      // 409: the server already has more (or less) than we thought; continue from its offset.
+      // Same offset: an earlier attempt of this chunk is still being written, so give it time
+      if (response.status === 409 && data.offset === state.offset) {
+        await new Promise(resolve => setTimeout(resolve, UPLOAD_RETRY_DELAYS[0]));
+      }
+      state = data;
+      failures = 0;
+    } else if (response.status === 400 && data.offset !== undefined && ++failures <= 3) {
+      state = data;
+    } else {
+      if (response.status === 404 || response.status === 410) localStorage.removeItem(key);
+      throw new Error(data.error || 'Upload failed');
+    }
+  }
+  
+  let response, data;
+  for (let attempt = 0; ; attempt++) {
+    response = await uploadRequest(`/uploads/${state.upload_id}/finalize`, { method: 'POST' });
+    data = await response.json();
+    // 409 with the whole file received: another request is finalizing it, wait for that one
+    if (response.status !== 409 || data.offset !== data.size || attempt >= UPLOAD_RETRY_DELAYS.length) break;
+    await new Promise(resolve => setTimeout(resolve, UPLOAD_RETRY_DELAYS[attempt]));
+  }
+  if (!response.ok) {
+    localStorage.removeItem(key);
+    throw new Error(data.error || 'Upload failed');
+  }
+  localStorage.removeItem(key);
+  onProgress(1);
+  return data;
+}
+
+// Forms marked data-chunked-upload upload their video_file first, then submit its upload_id instead
+function attachChunkedUpload(form) {
+  const fileInput = form.querySelector('input[type=file][name=video_file]');
+  const uploadId = form.querySelector('input[name=upload_id]');
+  const progress = form.querySelector('.upload-progress');
+  if (!fileInput || !uploadId || !window.fetch || !window.Blob || !Blob.prototype.arrayBuffer) return;
+  
+  form.addEventListener('submit', async function(e) {
+    if (!fileInput.files.length || uploadId.value) return;
+    e.preventDefault();
+    const submitBtn = form.querySelector('button[type=submit]');
+    const restore = addLoadingState(submitBtn, submitBtn.innerHTML);
+    if (progress) progress.style.display = 'block';
+    
+    try {
+      const result = await uploadVideoInChunks(fileInput.files[0], fraction => {
+        if (progress) progress.value = fraction;
+        submitBtn.innerHTML = `⏳ Uploading ${Math.floor(fraction * 100)}%`;
+      });
+      uploadId.value = result.upload_id;
+      fileInput.disabled = true;  // the video is already on the server
+      form.submit();
+    } catch (err) {
+      restore();
+      alert(`${err.message}. Submit again to resume the upload.`);
+    }
+  });
+}
+
 // Initialize page functionality
 document.addEventListener('DOMContentLoaded', function() {
+  document.querySelectorAll('form[data-chunked-upload]').forEach(attachChunkedUpload);
+  
   // Auto-focus on name input in quiz page
   const nameInput = document.getElementById('student-name');
   if (nameInput && !nameInput.value) {
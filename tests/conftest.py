@@ -0,0 +1,51 @@
+"""Shared fixtures: the app runs against a throwaway SQLite database and upload folder."""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK = tempfile.mkdtemp(prefix='slc-tests-')
+
+# app reads DATABASE_URL and creates its upload folders (relative to the cwd) on import
+os.environ['DATABASE_URL'] = os.path.join(WORK, 'test.db')
+os.chdir(WORK)
+sys.path.insert(0, REPO)
+
+import app as app_module  # noqa: E402
+
+app_module.app.config.update(TESTING=True, UPLOAD_FOLDER=os.path.abspath(app_module.UPLOAD_FOLDER))
+app_module.init_db()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORK, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+def _client(email, password):
+    client = app_module.app.test_client()
+    response = client.post('/login', data={'email': email, 'password': password})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def teacher(app):
+    return _client('teacher@smartlearning.com', 'teacher123')
+
+
+@pytest.fixture
+def student(app):
+    return _client('student@smartlearning.com', 'student123')
+
+
+def fetch(query, args=()):
+    with app_module.database.connection() as db:
+        return db.execute(query, args).fetchall()
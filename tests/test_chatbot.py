@@ -0,0 +1,16 @@
+import pytest
+
+
+@pytest.mark.parametrize('first, second', [
+    ('Give-up on quizzes?', 'give up on quizzes'),
+    ('How do I take a QUIZ?!', 'how do i take a quiz'),
+])
+def test_questions_sharing_a_cache_key_get_the_same_answer(app, first, second):
+    assert app.normalize_query(first) == app.normalize_query(second)
+    with app.app.app_context():
+        app.chatbot_cache.clear()
+        uncached = app.chatbot_answer(second)
+        app.chatbot_cache.clear()
+        assert app.chatbot_answer(first) == uncached
+        assert app.chatbot_answer(second) == uncached
+        assert app.chatbot_answer_many([first, second]) == [uncached, uncached]
@@ -0,0 +1,99 @@
+"""The Database interface behaves the same on every backend.
+
+Runs on a temporary SQLite file; set TEST_DATABASE_URL=postgresql://... to run
+the same checks against a PostgreSQL database as well.
+"""
+import os
+import threading
+
+import pytest
+
+BACKENDS = ['sqlite'] + (['postgresql'] if os.environ.get('TEST_DATABASE_URL') else [])
+
+
+@pytest.fixture(params=BACKENDS)
+def database(request, app, tmp_path):
+    if request.param == 'sqlite':
+        database = app.open_database(os.path.join(tmp_path, 'interface.db'))
+    else:
+        database = app.open_database(os.environ['TEST_DATABASE_URL'])
+    with database.connection() as db:
+        db.execute("DROP TABLE IF EXISTS interface_check")
+        db.execute(database.ddl("""CREATE TABLE interface_check (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            hits INTEGER NOT NULL DEFAULT 0
+        )"""))
+        db.commit()
+    yield database
+    with database.connection() as db:
+        db.execute("DROP TABLE interface_check")
+        db.commit()
+
+
+def test_insert_and_rows(database):
+    with database.connection() as db:
+        first = database.insert(db, "INSERT INTO interface_check (name) VALUES (?)", ('a',))
+        second = database.insert(db, "INSERT INTO interface_check (name) VALUES (?)", ('b',))
+        db.commit()
+        assert second > first
+        row = db.execute("SELECT id, name, hits FROM interface_check WHERE id = ?", (first,)).fetchone()
+        assert (row[0], row[1], row['name'], row['hits']) == (first, 'a', 'a', 0)
+        assert list(row.keys()) == ['id', 'name', 'hits']
+
+
+def test_upsert_returning_and_executemany(database):
+    with database.connection() as db:
+        db.executemany("INSERT INTO interface_check (name) VALUES (?)", [('x',), ('y',)])
+        db.execute("""INSERT INTO interface_check (name, hits) VALUES (?, 1)
+                      ON CONFLICT (name) DO UPDATE SET hits = interface_check.hits + 1""", ('x',))
+        updated = db.execute("UPDATE interface_check SET hits = hits + 1 WHERE name = ? RETURNING hits",
+                             ('x',)).fetchone()
+        db.commit()
+        assert updated['hits'] == 2
+
+
+def test_rollback_and_errors(database):
+    with database.connection() as db:
+        db.execute("INSERT INTO interface_check (name) VALUES (?)", ('kept',))
+        db.commit()
+        db.execute("INSERT INTO interface_check (name) VALUES (?)", ('dropped',))
+        db.rollback()
+        with pytest.raises(database.Error):
+            db.execute("INSERT INTO interface_check (name) VALUES (?)", ('kept',))
+        db.rollback()
+        names = [row['name'] for row in db.execute("SELECT name FROM interface_check")]
+        assert names == ['kept']
+
+
+@pytest.mark.parametrize('lock', ['schema', 'key'])
+def test_locks_serialise_transactions(database, lock):
+    def take(db):
+        if lock == 'schema':
+            database.lock_schema(db)
+        else:
+            database.lock(db, 42)
+
+    order = []
+    with database.connection() as db:
+        take(db)
+
+        def other():
+            with database.connection() as db2:
+                take(db2)
+                order.append('second')
+                db2.commit()
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join(0.3)
+        order.append('first')
+        db.commit()
+        thread.join()
+    assert order == ['first', 'second']
+
+
+@pytest.mark.skipif('DB_POOL_SIZE' in os.environ or 'GUNICORN_THREADS' in os.environ,
+                    reason="pool size set explicitly")
+def test_pool_covers_every_gunicorn_thread(app):
+    assert app.DB_POOL_SIZE == 16 + app.DB_BACKGROUND_THREADS
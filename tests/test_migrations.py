@@ -0,0 +1,23 @@
+import os
+
+
+def test_migrations_apply_once_on_fresh_database(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'database', app.open_database(os.path.join(tmp_path, 'fresh.db')))
+    versions = [version for version, _, _ in app.MIGRATIONS]
+    assert versions == sorted(versions) == list(range(1, len(versions) + 1))
+
+    assert app.migrate() == versions
+    assert app.migrate() == []
+    with app.database.connection() as db:
+        applied = [row[0] for row in db.execute("SELECT version FROM schema_migrations ORDER BY version")]
+        assert applied == versions
+        # Seed data from the first migrations
+        assert db.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 2
+        assert db.execute("SELECT COUNT(*) FROM quizzes").fetchone()[0] >= 1
+
+
+def test_migrate_command(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'database', app.open_database(os.path.join(tmp_path, 'cli.db')))
+    runner = app.app.test_cli_runner()
+    assert 'Applied migrations: 1' in runner.invoke(args=['migrate']).output
+    assert runner.invoke(args=['migrate']).output.strip() == 'Database is up to date.'
@@ -0,0 +1,35 @@
+from conftest import fetch
+
+
+def totals():
+    row = fetch("SELECT current_streak, total_points FROM study_streaks WHERE user_id = 2")
+    return tuple(row[0]) if row else (0, 0)
+
+
+def answer(student, correct):
+    return student.post('/check-answer', json={'answer': 1, 'correct': 1 if correct else 2}).json
+
+
+def test_answers_are_journaled_before_acknowledging(app, student, monkeypatch):
+    app.score_buffer.flush()
+    monkeypatch.setattr(app, 'score_buffer', app.ScoreBuffer(3600))
+    streak, points = totals()
+    for correct in (True, True, False, True):
+        reply = answer(student, correct)
+    assert (reply['streak'], reply['total_points']) == (1, points + 30)
+    # Nothing folded yet, but every acknowledged answer is already stored
+    assert totals() == (streak, points)
+    assert fetch("SELECT COUNT(*) FROM score_events WHERE user_id = 2")[0][0] == 4
+
+    # Any worker can fold them, e.g. after the one that took them was killed
+    assert app.ScoreBuffer(3600).flush() == 4
+    assert totals() == (1, points + 30)
+    assert app.score_buffer.flush() == 0
+
+
+def test_leaderboard_sees_unfolded_answers(app, student, monkeypatch):
+    monkeypatch.setattr(app, 'score_buffer', app.ScoreBuffer(3600))
+    answer(student, True)
+    points = answer(student, True)['total_points']
+    student.get('/leaderboard')
+    assert totals()[1] == points
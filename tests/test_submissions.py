@@ -0,0 +1,57 @@
+from conftest import fetch
+
+ANSWERS = {'1': 0, '2': 0}
+
+
+def attempt_count():
+    return fetch("SELECT COUNT(*) FROM attempts WHERE student_name = 'Demo Student'")[0][0]
+
+
+def test_idempotency_key_replay_records_one_attempt(app, student):
+    before = attempt_count()
+    headers = {'Idempotency-Key': 'replay-1'}
+    first = student.post('/submit_quiz', json={'quiz_id': 1, 'answers': ANSWERS}, headers=headers)
+    retry = student.post('/submit_quiz', json={'quiz_id': 1, 'answers': ANSWERS}, headers=headers)
+    assert first.status_code == retry.status_code == 202
+    assert first.json['submission_id'] == retry.json['submission_id']
+
+    result = student.get(first.json['result_url'] + '?wait=5')
+    assert result.status_code == 200
+    assert 'score' in result.json
+
+    # Retried after grading: same result, still one attempt
+    late = student.post('/submit_quiz', json={'quiz_id': 1, 'answers': {'1': 1}}, headers=headers)
+    assert late.json['submission_id'] == first.json['submission_id']
+    assert student.get(first.json['result_url'] + '?wait=5').json == result.json
+    assert attempt_count() == before + 1
+
+
+def test_result_survives_worker_cache_loss(app, student):
+    response = student.post('/submit_quiz', json={'quiz_id': 1, 'answers': ANSWERS},
+                            headers={'Idempotency-Key': 'replay-2'})
+    graded = student.get(response.json['result_url'] + '?wait=5').json
+    app.submission_queue._results.clear()  # as seen from another worker
+    assert student.get(response.json['result_url']).json == graded
+
+
+def test_inline_grading(app, student, monkeypatch):
+    monkeypatch.setattr(app, 'SUBMISSION_FLUSH_INTERVAL', 0)
+    response = student.post('/submit_quiz', json={'quiz_id': 1, 'answers': ANSWERS},
+                            headers={'Idempotency-Key': 'inline-1'})
+    assert response.status_code == 200
+    assert 'score' in response.json
+
+
+def test_invalid_submissions(student):
+    assert student.post('/submit_quiz', json={'quiz_id': 1, 'answers': [1]}).status_code == 400
+    assert student.post('/submit_quiz', json={'quiz_id': 0, 'answers': ANSWERS}).status_code == 400
+    assert student.get('/submissions/unknown').status_code == 404
+
+
+def test_other_students_cannot_read_results(app, student):
+    response = student.post('/submit_quiz', json={'quiz_id': 1, 'answers': ANSWERS},
+                            headers={'Idempotency-Key': 'private-1'})
+    other = app.app.test_client()
+    with other.session_transaction() as session:
+        session.update(user_id=999, user_type='student', username='Someone else')
+    assert other.get(response.json['result_url'] + '?wait=5').status_code == 404
@@ -0,0 +1,109 @@
+import io
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import app_module, fetch
+
+
+@pytest.fixture(autouse=True)
+def empty_queue(app):
+    with app.database.connection() as db:
+        db.execute("UPDATE transcode_jobs SET status='cancelled' WHERE status IN ('queued', 'running')")
+        db.commit()
+
+
+def create_lesson(teacher, title):
+    response = teacher.post('/teacher', data={
+        'title': title, 'description': 'd', 'video_file': (io.BytesIO(b'\0' * 5000), 'clip.mp4'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 302
+    return fetch("SELECT id FROM lessons WHERE title = ?", (title,))[0]['id']
+
+
+def lesson_job(lesson_id):
+    return fetch("SELECT * FROM transcode_jobs WHERE lesson_id = ? ORDER BY id DESC", (lesson_id,))[0]
+
+
+class FailingTranscoder(app_module.StubTranscoder):
+    def encode(self, source, rendition, out_dir):
+        raise RuntimeError('encoder crashed')
+
+
+def test_job_publishes_renditions(app, teacher):
+    lesson_id = create_lesson(teacher, 'Transcoded')
+    assert fetch("SELECT video_status FROM lessons WHERE id = ?", (lesson_id,))[0][0] == 'processing'
+
+    assert app.run_next_transcode_job(app.StubTranscoder())
+    assert not app.run_next_transcode_job(app.StubTranscoder())
+
+    lesson = fetch("SELECT video_status, renditions FROM lessons WHERE id = ?", (lesson_id,))[0]
+    assert lesson['video_status'] == 'ready'
+    manifest = json.loads(lesson['renditions'])
+    for name in [manifest['hls'], manifest['poster']] + [s['file'] for s in manifest['sources']]:
+        assert teacher.get(f'/uploads/videos/{name}').status_code == 200
+
+
+def test_failed_job_is_retried_then_marked_failed(app, teacher):
+    lesson_id = create_lesson(teacher, 'Broken')
+    for _ in range(app.TRANSCODE_MAX_ATTEMPTS):
+        assert app.run_next_transcode_job(FailingTranscoder())
+    assert not app.run_next_transcode_job(FailingTranscoder())
+
+    job = lesson_job(lesson_id)
+    assert (job['status'], job['attempts'], job['error']) == ('failed', app.TRANSCODE_MAX_ATTEMPTS, 'encoder crashed')
+    assert fetch("SELECT video_status FROM lessons WHERE id = ?", (lesson_id,))[0][0] == 'failed'
+
+
+def test_expired_lease_is_requeued_and_stale_claim_ignored(app, teacher):
+    lesson_id = create_lesson(teacher, 'Requeued')
+    with app.database.connection() as db:
+        stale = app.claim_transcode_job(db)
+        assert stale['lesson_id'] == lesson_id
+        # A second worker finds nothing while the lease is fresh
+        assert app.claim_transcode_job(db) is None
+        expired = (datetime.now() - timedelta(seconds=app.TRANSCODE_LEASE + 1)).isoformat()
+        db.execute("UPDATE transcode_jobs SET locked_at = ? WHERE id = ?", (expired, stale['id']))
+        db.commit()
+
+    assert app.run_next_transcode_job(app.StubTranscoder())
+    job = lesson_job(lesson_id)
+    assert (job['status'], job['attempts']) == ('done', 2)
+
+    # The first worker coming back late can neither renew nor overwrite the result
+    with app.database.connection() as db:
+        assert not app.renew_transcode_job(db, stale)
+        app.finish_transcode_job(db, stale, error='late')
+    assert lesson_job(lesson_id)['status'] == 'done'
+    assert fetch("SELECT video_status FROM lessons WHERE id = ?", (lesson_id,))[0][0] == 'ready'
+
+
+def test_worker_lost_on_last_attempt_fails_job(app, teacher):
+    lesson_id = create_lesson(teacher, 'Lost')
+    expired = (datetime.now() - timedelta(seconds=app.TRANSCODE_LEASE + 1)).isoformat()
+    with app.database.connection() as db:
+        db.execute("UPDATE transcode_jobs SET status='running', attempts=?, locked_at=? WHERE lesson_id=?",
+                   (app.TRANSCODE_MAX_ATTEMPTS, expired, lesson_id))
+        db.commit()
+    assert app.run_next_transcode_job(app.StubTranscoder())
+    job = lesson_job(lesson_id)
+    assert (job['status'], job['error']) == ('failed', 'worker lost')
+
+
+def test_deleting_lesson_removes_renditions(app, teacher):
+    lesson_id = create_lesson(teacher, 'Deleted')
+    assert app.run_next_transcode_job(app.StubTranscoder())
+    out_dir = os.path.join(app.app.config['UPLOAD_FOLDER'], app.RENDITIONS_FOLDER, str(lesson_job(lesson_id)['id']))
+    assert os.path.isdir(out_dir)
+
+    teacher.post(f'/delete-lesson/{lesson_id}')
+    assert not os.path.exists(out_dir)
+
+
+def test_deleting_lesson_cancels_queued_job(app, teacher):
+    lesson_id = create_lesson(teacher, 'Cancelled')
+    teacher.post(f'/delete-lesson/{lesson_id}')
+    assert lesson_job(lesson_id)['status'] == 'cancelled'
+    assert not app.run_next_transcode_job(app.StubTranscoder())
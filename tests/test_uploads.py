@@ -0,0 +1,86 @@
+import hashlib
+import os
+from datetime import datetime
+
+from conftest import fetch
+
+DATA = os.urandom(3000)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+def start(teacher, **body):
+    response = teacher.post('/uploads', json=dict({'filename': 'Lesson Video.mp4', 'size': len(DATA)}, **body))
+    assert response.status_code == 201
+    return response.json['upload_id']
+
+
+def put(teacher, upload_id, offset, data, **headers):
+    return teacher.put(f'/uploads/{upload_id}?offset={offset}', data=data, headers=headers)
+
+
+def test_upload_resumes_and_finalizes(teacher):
+    upload_id = start(teacher, sha256=SHA256)
+    assert put(teacher, upload_id, 0, DATA[:1000]).json['offset'] == 1000
+
+    # A retried chunk is not written twice; the client is told where to continue
+    retried = put(teacher, upload_id, 0, DATA[:1000])
+    assert (retried.status_code, retried.json['offset']) == (409, 1000)
+    assert teacher.get(f'/uploads/{upload_id}').json['offset'] == 1000
+    assert teacher.post(f'/uploads/{upload_id}/finalize').status_code == 409
+
+    chunk = DATA[1000:]
+    response = put(teacher, upload_id, 1000, chunk, **{'X-Chunk-SHA256': hashlib.sha256(chunk).hexdigest()})
+    assert response.json['offset'] == len(DATA)
+
+    finalized = teacher.post(f'/uploads/{upload_id}/finalize')
+    assert finalized.status_code == 200 and finalized.json['complete']
+    assert teacher.get(finalized.json['video_url']).data == DATA
+
+    # Finalize is idempotent
+    again = teacher.post(f'/uploads/{upload_id}/finalize')
+    assert (again.status_code, again.json['video_url']) == (200, finalized.json['video_url'])
+
+
+def test_chunk_checksum_mismatch_is_rejected(teacher):
+    upload_id = start(teacher)
+    response = put(teacher, upload_id, 0, DATA[:1000], **{'X-Chunk-SHA256': '0' * 64})
+    assert (response.status_code, response.json['offset']) == (400, 0)
+    assert fetch("SELECT claim FROM uploads WHERE id = ?", (upload_id,))[0][0] is None
+
+
+def test_finalize_checksum_mismatch_starts_over(app, teacher):
+    upload_id = start(teacher, sha256='1' * 64)
+    put(teacher, upload_id, 0, DATA)
+    published = set(os.listdir(app.app.config['UPLOAD_FOLDER']))
+
+    response = teacher.post(f'/uploads/{upload_id}/finalize')
+    assert (response.status_code, response.json['offset'], response.json['complete']) == (422, 0, False)
+    assert set(os.listdir(app.app.config['UPLOAD_FOLDER'])) == published
+
+    put(teacher, upload_id, 0, DATA)
+    assert teacher.post(f'/uploads/{upload_id}/finalize', json={'sha256': SHA256}).status_code == 200
+
+
+def test_finalize_rereads_file_written_by_other_workers(app, teacher):
+    upload_id = start(teacher, sha256=SHA256)
+    put(teacher, upload_id, 0, DATA[:1000])
+    app._upload_digests.clear()  # the next chunks look like they landed on another worker
+    put(teacher, upload_id, 1000, DATA[1000:])
+    assert teacher.post(f'/uploads/{upload_id}/finalize').status_code == 200
+
+
+def test_claimed_upload_is_not_written(app, teacher):
+    upload_id = start(teacher)
+    with app.database.connection() as db:
+        db.execute("UPDATE uploads SET claim = 'other', claimed_at = ? WHERE id = ?",
+                   (datetime.now().isoformat(), upload_id))
+        db.commit()
+    response = put(teacher, upload_id, 0, DATA)
+    assert (response.status_code, response.json['offset']) == (409, 0)
+    assert os.path.getsize(app._partial_path(upload_id)) == 0
+
+
+def test_uploads_belong_to_teachers(teacher, student):
+    upload_id = start(teacher)
+    assert student.get(f'/uploads/{upload_id}').status_code == 302
+    assert teacher.post('/uploads', json={'filename': 'x.exe', 'size': 10}).status_code == 400